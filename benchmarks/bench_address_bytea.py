@@ -0,0 +1,102 @@
+"""Compare blockchain_addresses with addresses stored as varchar(42) hex and as 20-byte bytea
+
+Usage: python -m benchmarks.bench_address_bytea [n_addresses] [batch_size]
+
+Builds both layouts of the table (before and after migration 0005), with their
+unique (chain, address) index, in the configured database and times what
+AddressResolver does on every load: look up a batch of known addresses, and
+insert a batch of new ones through the unique check. Nothing is kept.
+"""
+import sys
+import time
+import random
+import evm_contracts_db
+from django.db import connection, transaction
+
+from utils.blockchain import address_to_bytes
+
+
+# 20 pseudo-random bytes per row, as 40 hex digits
+HEX = "md5(i::text) || substr(md5((-i)::text), 1, 8)"
+
+SCHEMAS = {
+    'varchar': f"""
+        CREATE UNLOGGED TABLE bench_addresses (id bigserial PRIMARY KEY, chain varchar(3) NOT NULL, address varchar(42) NOT NULL);
+        INSERT INTO bench_addresses (chain, address) SELECT 'ETH', '0x' || {HEX} FROM generate_series(1, %(n)s) i;
+        ALTER TABLE bench_addresses ADD CONSTRAINT bench_unique_address UNIQUE (chain, address);
+    """,
+    'bytea': f"""
+        CREATE UNLOGGED TABLE bench_addresses (id bigserial PRIMARY KEY, chain varchar(3) NOT NULL, address bytea NOT NULL);
+        INSERT INTO bench_addresses (chain, address) SELECT 'ETH', decode({HEX}, 'hex') FROM generate_series(1, %(n)s) i;
+        ALTER TABLE bench_addresses ADD CONSTRAINT bench_unique_address UNIQUE (chain, address);
+    """,
+}
+
+QUERIES = {
+    'lookup': "SELECT address, id FROM bench_addresses WHERE chain = 'ETH' AND address = ANY(%(known)s)",
+    'insert': """INSERT INTO bench_addresses (chain, address) SELECT 'ETH', unnest(%(new)s)
+        ON CONFLICT (chain, address) DO NOTHING RETURNING address, id""",
+}
+
+
+def sample_addresses(cursor, n, size, seed=0):
+    """Return (size addresses in the table, size addresses not in it), as hex"""
+
+    rng = random.Random(seed)
+    cursor.execute(f"SELECT '0x' || {HEX} FROM unnest(%s::int[]) i", [rng.sample(range(1, n + 1), size)])
+    known = [r[0] for r in cursor.fetchall()]
+    new = ['0x' + f"{rng.getrandbits(160):040x}" for _ in range(size)]
+
+    return known, new
+
+
+def best_of(cursor, sql, params, repeat=5):
+    times = []
+    for _ in range(repeat):
+        # Each run is rolled back, so inserts always go through the unique check
+        with transaction.atomic():
+            start = time.perf_counter()
+            cursor.execute(sql, params)
+            cursor.fetchall()
+            times.append(time.perf_counter() - start)
+            transaction.set_rollback(True)
+
+    return min(times)
+
+
+def run(n, size):
+    results = {}
+    for layout, schema in SCHEMAS.items():
+        with transaction.atomic(), connection.cursor() as cursor:
+            start = time.perf_counter()
+            cursor.execute(schema, {'n': n})
+            cursor.execute("ANALYZE bench_addresses")
+            results[('build', layout)] = time.perf_counter() - start
+
+            known, new = sample_addresses(cursor, n, size)
+            if layout == 'bytea':
+                known, new = [address_to_bytes(a) for a in known], [address_to_bytes(a) for a in new]
+            params = {'known': known, 'new': new}
+            for name, sql in QUERIES.items():
+                results[(name, layout)] = best_of(cursor, sql, params)
+
+            cursor.execute("SELECT pg_relation_size('bench_unique_address'), pg_relation_size('bench_addresses')")
+            results[('index bytes', layout)], results[('table bytes', layout)] = cursor.fetchone()
+            transaction.set_rollback(True)
+
+    return results
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000_000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    results = run(n, size)
+    print(f"{n} addresses, batches of {size}")
+    print(f"{'':<16}{'varchar':>12}{'bytea':>12}{'ratio':>8}")
+    for name in ['build'] + list(QUERIES):
+        before, after = results[(name, 'varchar')], results[(name, 'bytea')]
+        print(f"{name:<16}{before * 1000:>10.1f}ms{after * 1000:>10.1f}ms{before / after:>7.1f}x")
+    for name in ['index bytes', 'table bytes']:
+        before, after = results[(name, 'varchar')], results[(name, 'bytea')]
+        print(f"{name:<16}{before / 2**20:>10.1f}MB{after / 2**20:>10.1f}MB{before / after:>7.1f}x")
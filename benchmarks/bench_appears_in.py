@@ -0,0 +1,96 @@
+"""Compare BlockchainAddress.appears_in as a union of the transaction foreign
+keys (before blockchain_address_appearances) and as an appearance range scan
+
+Usage: python -m benchmarks.bench_appears_in [n_transactions] [n_addresses]
+
+Fills the configured database with synthetic transactions (from one of
+n_addresses, to a factory or another address, creating a contract one time in
+ten, with a log emitted by another address) and their appearances, as migration
+0007 backfills them, then times reading every transaction of an address and one
+page of it. Everything is rolled back.
+"""
+import sys
+import time
+import importlib
+import evm_contracts_db
+from django.db import connection, transaction
+
+from evm_contracts_db.database.models.blockchain import BlockchainAddress, BlockchainTransaction
+
+
+BACKFILL = importlib.import_module('evm_contracts_db.database.migrations.0007_address_appearances').BACKFILL
+
+# Address ids are offset by %(base)s, the next id of blockchain_addresses; address 0 is the factory
+FILL = """
+    INSERT INTO blockchain_addresses (id, chain, address)
+        SELECT %(base)s + i, 'ETH', decode(lpad(to_hex(%(base)s + i), 40, '0'), 'hex') FROM generate_series(0, %(addresses)s) i;
+    INSERT INTO blockchain_transactions (tx_key, block_number, value, from_address_id, to_address_id)
+        SELECT ((10000000 + i / 4)::bigint << 32) | (i %% 4), 10000000 + i / 4, 0,
+            %(base)s + 1 + (hashint4(i) & 2147483647) %% %(addresses)s,
+            CASE WHEN i %% 2 = 0 THEN %(base)s ELSE %(base)s + 1 + (hashint4(-i) & 2147483647) %% %(addresses)s END
+        FROM generate_series(0, %(n)s - 1) i;
+    INSERT INTO blockchain_transactions_contracts_created (blockchaintransaction_id, blockchainaddress_id)
+        SELECT tx_key, from_address_id FROM blockchain_transactions WHERE tx_key %% 10 = 0 AND block_number >= 10000000;
+    INSERT INTO blockchain_logs (log_index, address_id, originating_from_id)
+        SELECT 0, %(base)s + 1 + (hashint8(tx_key) & 2147483647) %% %(addresses)s, tx_key
+        FROM blockchain_transactions WHERE block_number >= 10000000;
+"""
+
+
+def union(address, after=0):
+    """appears_in before the appearance table (without the involved addresses it could not find)"""
+
+    txns = address.transactions_from.filter(tx_key__gt=after)
+    txns = txns.union(address.transactions_to.filter(tx_key__gt=after))
+    txns = txns.union(address.created_by_transaction.filter(tx_key__gt=after))
+
+    return txns.order_by('tx_key')
+
+
+def best_of(fcn, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = list(fcn())
+        times.append(time.perf_counter() - start)
+
+    return min(times), len(result)
+
+
+def run(n, addresses, pageSize=100):
+    results = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT coalesce(max(id), 0) + 1 FROM blockchain_addresses")
+        base = cursor.fetchone()[0]
+        start = time.perf_counter()
+        cursor.execute(FILL, {'n': n, 'addresses': addresses, 'base': base})
+        cursor.execute(BACKFILL)
+        results['backfill'] = time.perf_counter() - start
+        cursor.execute("ANALYZE")
+        cursor.execute("SELECT pg_total_relation_size('blockchain_address_appearances')")
+        results['appearance bytes'] = cursor.fetchone()[0]
+
+        for name, address in [('typical', BlockchainAddress.objects.get(pk=base + 1)), ('factory', BlockchainAddress.objects.get(pk=base))]:
+            middle = BlockchainTransaction.objects.filter(tx_key__gte=(10000000 + n // 8) << 32).order_by('tx_key').first().tx_key
+            results[(name, 'union')] = best_of(lambda: union(address))
+            results[(name, 'appearances')] = best_of(lambda: address.appears_in())
+            results[(name, 'union page')] = best_of(lambda: union(address, after=middle)[:pageSize])
+            results[(name, 'appearances page')] = best_of(lambda: address.appears_in(after=middle, limit=pageSize))
+        transaction.set_rollback(True)
+
+    return results
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    addresses = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    results = run(n, addresses)
+    print(f"{n} transactions, {addresses} addresses")
+    print(f"backfill {results['backfill']:.1f}s, appearances {results['appearance bytes'] / 2**20:.1f}MB")
+    print(f"{'':<24}{'union':>18}{'appearances':>18}{'speedup':>9}")
+    for name in ['typical', 'factory']:
+        for query in ['', ' page']:
+            (before, rows), (after, found) = results[(name, 'union' + query)], results[(name, 'appearances' + query)]
+            label = f"{name}{query}"
+            print(f"{label:<24}{before * 1000:>9.1f}ms{rows:>7}{after * 1000:>9.1f}ms{found:>7}{before / after:>8.1f}x")
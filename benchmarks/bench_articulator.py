@@ -0,0 +1,105 @@
+"""Compare articulating raw chifra traces one call at a time with web3 and in
+bulk with Articulator
+
+Usage: python -m benchmarks.bench_articulator [n_traces] [n_functions]
+
+Builds an ABI of n_functions functions (one of them summonMoloch) and n_traces
+traces calling them, with calldata encoded by eth_abi, then articulates every
+trace with Contract.decode_function_input (as a script would, looking the
+function up for each call), with a selector lookup and eth_abi.decode per call,
+and with Articulator.articulate_traces (calls grouped by selector, one decoder
+per function). Nothing touches the database.
+"""
+import sys
+import time
+import evm_contracts_db
+from eth_abi import decode, encode
+from eth_utils.abi import collapse_if_tuple, function_abi_to_4byte_selector
+from web3 import Web3
+
+from evm_contracts_db.database.etl.articulator import AbiStore, Articulator, format_value, param_names
+
+
+def build(n, functions):
+    summon = {'type': 'function', 'name': 'summonMoloch', 'outputs': [], 'inputs': [
+        {'name': '_summoner', 'type': 'address[]'}, {'name': '_approvedTokens', 'type': 'address[]'},
+        {'name': '_periodDuration', 'type': 'uint256'}, {'name': '_votingPeriodLength', 'type': 'uint256'},
+        {'name': '_summonerShares', 'type': 'uint256[]'}, {'name': '_details', 'type': 'string'},
+    ]}
+    abi = [summon] + [
+        {'type': 'function', 'name': f"f{i}", 'outputs': [], 'inputs': [{'name': 'a', 'type': 'uint256'}, {'name': 'b', 'type': 'address'}]}
+        for i in range(functions - 1)
+    ]
+    selectors = [function_abi_to_4byte_selector(f) for f in abi]
+
+    traces = []
+    for i in range(n):
+        f = i % functions
+        if f == 0:
+            args = [['0x' + f"{i:040x}"] * 3, ['0x' + f"{i + 1:040x}"], 17280, 35, [1, 2, 3], f"dao {i}"]
+        else:
+            args = [i, '0x' + f"{i:040x}"]
+        calldata = selectors[f] + encode([p['type'] for p in abi[f]['inputs']], args)
+        traces.append({'action': {'input': '0x' + calldata.hex()}, 'result': {'output': '0x'}})
+
+    return abi, traces
+
+
+def web3_articulate(abi, traces):
+    contract = Web3().eth.contract(abi=abi)
+    articulated = []
+    for trace in traces:
+        function, values = contract.decode_function_input(trace['action']['input'])
+        params = function.abi['inputs']
+        articulated.append((function.fn_name, {
+            name: format_value(p, values[p['name']]) for name, p in zip(param_names(params), params)
+        }))
+
+    return articulated
+
+
+def decode_articulate(abi, traces):
+    functions = {function_abi_to_4byte_selector(f): f for f in abi}
+    articulated = []
+    for trace in traces:
+        calldata = bytes.fromhex(trace['action']['input'][2:])
+        function = functions[calldata[:4]]
+        params = function['inputs']
+        values = decode([collapse_if_tuple(p) for p in params], calldata[4:])
+        articulated.append((function['name'], {
+            name: format_value(p, v) for name, p, v in zip(param_names(params), params, values)
+        }))
+
+    return articulated
+
+
+def bulk_articulate(abi, traces):
+    store = AbiStore()
+    store.add(abi)
+    traces = Articulator(store).articulate_traces([{**t} for t in traces])
+
+    return [(t['articulatedTrace']['name'], t['articulatedTrace']['inputs']) for t in traces]
+
+
+def run(n, functions):
+    abi, traces = build(n, functions)
+    results = {}
+    for name, fcn in [('web3 per call', web3_articulate), ('eth_abi per call', decode_articulate), ('Articulator', bulk_articulate)]:
+        start = time.perf_counter()
+        articulated = fcn(abi, traces)
+        results[name] = (time.perf_counter() - start, articulated)
+    assert results['web3 per call'][1] == results['eth_abi per call'][1] == results['Articulator'][1]
+
+    return results
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    functions = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    results = run(n, functions)
+    print(f"{n} traces, {functions} functions")
+    for name, (seconds, _) in results.items():
+        print(f"{name:<18}{seconds:>10.2f}s{n / seconds:>12.0f} calls/s")
+    for name in ['web3 per call', 'eth_abi per call']:
+        print(f"speedup over {name:<18}{results[name][0] / results['Articulator'][0]:>8.1f}x")
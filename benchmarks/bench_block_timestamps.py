@@ -0,0 +1,70 @@
+"""Compare ways of getting the timestamps of a queryset of transactions
+
+Usage: python -m benchmarks.bench_block_timestamps [n_transactions] [n_sample]
+
+Fills the configured database with n_transactions (4 per block) and their
+blocks, then times BlockchainTransaction.timestamp as it was (a new Web3 client
+and RPC round trip per transaction, against a local stand-in RPC, so a lower
+bound; timed on n_sample transactions and scaled), through BlockTimestamps (a
+batched read into the LRU, then per-object hits) and through the
+with_timestamps() join. Everything is rolled back.
+"""
+import os
+import sys
+import time
+import evm_contracts_db
+from django.db import connection, transaction
+
+from evm_contracts_db.database.etl.block_timestamps import BlockTimestamps
+from evm_contracts_db.database.etl.tests import fake_rpc
+from evm_contracts_db.database.models.blockchain import BlockchainTransaction
+from utils.blockchain import get_timestamp
+
+
+FILL = """
+    INSERT INTO blockchain_transactions (tx_key, block_number, value)
+        SELECT ((10000000 + i / 4)::bigint << 32) | (i %% 4), 10000000 + i / 4, 0 FROM generate_series(0, %(n)s - 1) i;
+    INSERT INTO blockchain_blocks (number, timestamp)
+        SELECT DISTINCT block_number, to_timestamp(1600000000 + 12 * block_number) FROM blockchain_transactions
+        WHERE block_number >= 10000000;
+"""
+
+
+def run(n, sample):
+    results = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(FILL, {'n': n})
+        cursor.execute("ANALYZE blockchain_transactions; ANALYZE blockchain_blocks")
+        txns = BlockchainTransaction.objects.filter(block_number__gte=10000000).order_by('tx_key')
+
+        with fake_rpc.serve() as (url, _):
+            os.environ['RPC_KEY'] = url
+            start = time.perf_counter()
+            for t in txns[:sample]:
+                get_timestamp(t.block_number)
+            results['rpc per transaction'] = (time.perf_counter() - start) * n / sample
+
+        BlockTimestamps.clear_cache()
+        start = time.perf_counter()
+        objs = list(txns)
+        BlockTimestamps(maxsize=n).get_many({t.block_number for t in objs})
+        timestamps = [t.timestamp for t in objs]
+        results['BlockTimestamps'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        timestamps = [t.timestamp for t in txns.with_timestamps()]
+        results['with_timestamps'] = time.perf_counter() - start
+        assert None not in timestamps
+        transaction.set_rollback(True)
+
+    return results
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    sample = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    results = run(n, sample)
+    print(f"{n} transactions")
+    for name, seconds in results.items():
+        print(f"{name:<24}{seconds:>10.2f}s")
@@ -0,0 +1,91 @@
+"""Compare TrueblocksLoader row-by-row and bulk load throughput
+
+Usage: python -m benchmarks.bench_bulk_loader [n_transactions]
+
+Runs against the configured database; every load is rolled back.
+"""
+import sys
+import time
+import random
+import evm_contracts_db
+from django.db import connection, transaction
+
+from evm_contracts_db.database.etl.trueblocks_loader import TrueblocksLoader
+
+
+def synthetic_transactions(n, n_addresses=500, logs_per_txn=3, traces_per_txn=2, seed=0):
+    """Transformer-shaped records for a busy factory: most addresses repeat"""
+
+    rng = random.Random(seed)
+    factory = '0x' + 'f' * 40
+    pool = ['0x' + f"{rng.getrandbits(160):040x}" for _ in range(n_addresses)]
+
+    records = []
+    for i in range(n):
+        block = 10_000_000 + i // 4
+        txId = f"{block}.{i % 4}"
+        created = '0x' + f"{rng.getrandbits(160):040x}"
+        records.append({
+            'transaction_id': txId,
+            'transaction_hash': '0x' + f"{rng.getrandbits(256):064x}",
+            'block_number': block,
+            'from_address': rng.choice(pool),
+            'to_address': factory,
+            'value': str(rng.randrange(10**18)),
+            'call_name': 'summonMoloch',
+            'call_inputs': {'_summoner': rng.choice(pool), '_periodDuration': '17280'},
+            'call_outputs': {},
+            'contracts_created': [created],
+            'addresses_involved': [factory, created, rng.choice(pool)],
+            'logs': [
+                {
+                    'log_index': j,
+                    'address': rng.choice([factory, created]),
+                    'event': 'SummonComplete',
+                    'compressed_log': f"SummonComplete({rng.choice(pool)} /*summoner*/);",
+                } for j in range(logs_per_txn)
+            ],
+            'traces': [
+                {
+                    'trace_path': [j],
+                    'from_address': factory,
+                    'to_address': created,
+                    'compressed_trace': 'init()',
+                    'value': 0,
+                    'error': None,
+                    'outputs': {},
+                    'delegate': None,
+                } for j in range(traces_per_txn)
+            ],
+        })
+
+    return records
+
+
+def time_load(records, bulk):
+    """Return (seconds, number of queries) for loading records, then roll back"""
+
+    queries = [0]
+
+    def _count(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    loader = TrueblocksLoader()
+    with transaction.atomic(), connection.execute_wrapper(_count):
+        start = time.perf_counter()
+        loader.insert_transactions(records, includeTraces=True, bulk=bulk)
+        elapsed = time.perf_counter() - start
+        transaction.set_rollback(True)
+
+    return elapsed, queries[0]
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    print(f"{'mode':<12}{'txns':>8}{'seconds':>10}{'txns/s':>10}{'queries':>10}")
+    for bulk in [False, True]:
+        elapsed, queries = time_load(synthetic_transactions(n), bulk)
+        mode = 'bulk' if bulk else 'row-by-row'
+        print(f"{mode:<12}{n:>8}{elapsed:>10.2f}{n / elapsed:>10.0f}{queries:>10}")
@@ -0,0 +1,38 @@
+"""Scaling of TrueblocksExtractor's chifra process pool against a fake chifra
+
+Usage: python -m benchmarks.bench_chifra_pool [n_txids] [delay_seconds]
+
+Each fake chifra call sleeps delay_seconds (standing in for index lookups and
+RPC calls) and then echoes one JSON record per transaction id.
+"""
+import os
+import sys
+import time
+import tempfile
+import evm_contracts_db
+
+from evm_contracts_db.database.etl.chunking import AdaptiveChunker
+from evm_contracts_db.database.etl.trueblocks_extractor import TrueblocksExtractor
+from evm_contracts_db.database.etl.tests import fake_chifra
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 6400
+    delay = sys.argv[2] if len(sys.argv) > 2 else '0.25'
+    txIds = [f"{10_000_000 + i // 4}.{i % 4}" for i in range(n)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        chifra = fake_chifra.install(tmpdir)
+        os.environ['FAKE_CHIFRA_DELAY'] = delay
+
+        print(f"{'workers':>8}{'chunks':>8}{'seconds':>10}{'txids/s':>10}{'speedup':>9}")
+        baseline = None
+        for maxWorkers in [1, 2, 4, 8, 16, 32, 64]:
+            tbe = TrueblocksExtractor(chifra=chifra, maxWorkers=maxWorkers)
+            # Fixed-size chunks so every run does the same calls
+            chunker = AdaptiveChunker(initialSize=100, maxSize=100)
+            start = time.perf_counter()
+            chunks = list(tbe.iter_chifra_chunks({'function': 'traces', 'value': txIds, 'format': 'json'}, chunker=chunker))
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f"{maxWorkers:>8}{len(chunks):>8}{elapsed:>10.2f}{n / elapsed:>10.0f}{baseline / elapsed:>8.1f}x")
@@ -0,0 +1,81 @@
+"""Compare filtering logs on an event argument by unpacking compressed_log in
+Python and with the event_inputs GIN index
+
+Usage: python -m benchmarks.bench_decoded_calls [n_logs] [n_applicants]
+
+Fills the configured database with n_logs logs (one per transaction), a fifth
+of them SubmitProposal events from one of n_applicants applicants, and finds
+the SubmitProposal logs of one applicant both ways. Everything is rolled back.
+"""
+import sys
+import time
+import evm_contracts_db
+from django.db import connection, transaction
+
+from evm_contracts_db.database.models.blockchain import BlockchainTransactionLog
+from utils.blockchain import unpack_compressed_call
+
+
+FILL = """
+    INSERT INTO blockchain_transactions (tx_key, block_number, value)
+        SELECT ((10000000 + i / 4)::bigint << 32) | (i %% 4), 10000000 + i / 4, 0 FROM generate_series(0, %(n)s - 1) i;
+    INSERT INTO blockchain_logs (log_index, event, event_inputs, compressed_log, originating_from_id)
+        SELECT 0, e.name, jsonb_build_object(e.arg, a.address, 'proposalId', i::text),
+            format('%%s(%%s /*%%s*/, %%s /*proposalId*/);', e.name, a.address, e.arg, i),
+            ((10000000 + i / 4)::bigint << 32) | (i %% 4)
+        FROM generate_series(0, %(n)s - 1) i,
+            LATERAL (SELECT '0x' || lpad(to_hex((hashint4(i) & 2147483647) %% %(applicants)s), 40, '0') AS address) a,
+            LATERAL (SELECT (ARRAY['SubmitProposal', 'SubmitVote', 'ProcessProposal', 'Ragequit', 'Transfer'])[i %% 5 + 1] AS name,
+                (ARRAY['applicant', 'memberAddress', 'applicant', 'memberAddress', 'from'])[i %% 5 + 1] AS arg) e;
+"""
+
+
+def python_filter(applicant):
+    """As before event_inputs: every SubmitProposal log is loaded and its compressed_log unpacked"""
+
+    logs = BlockchainTransactionLog.objects.filter(event='SubmitProposal').values_list('id', 'compressed_log')
+    return [i for i, c in logs.iterator(chunk_size=10000) if unpack_compressed_call(c)['input'].get('applicant') == applicant]
+
+
+def index_filter(applicant):
+    logs = BlockchainTransactionLog.objects.filter(event='SubmitProposal', event_inputs__contains={'applicant': applicant})
+    return list(logs.values_list('id', flat=True))
+
+
+def best_of(fcn, *args, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fcn(*args)
+        times.append(time.perf_counter() - start)
+
+    return min(times), sorted(result)
+
+
+def run(n, applicants):
+    results = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(FILL, {'n': n, 'applicants': applicants})
+        cursor.execute("ANALYZE blockchain_logs")
+        applicant = '0x' + f"{7:040x}"
+
+        results['python'] = best_of(python_filter, applicant)
+        results['gin index'] = best_of(index_filter, applicant)
+        assert results['python'][1] == results['gin index'][1]
+        cursor.execute("SELECT pg_relation_size('log_event_inputs')")
+        results['index bytes'] = cursor.fetchone()[0]
+        transaction.set_rollback(True)
+
+    return results
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    applicants = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    results = run(n, applicants)
+    print(f"{n} logs, {applicants} applicants, {len(results['python'][1])} logs found")
+    for name in ['python', 'gin index']:
+        print(f"{name:<12}{results[name][0] * 1000:>10.1f}ms")
+    print(f"{'speedup':<12}{results['python'][0] / results['gin index'][0]:>10.1f}x")
+    print(f"GIN index size {results['index bytes'] / 2**20:.1f}MB")
@@ -0,0 +1,97 @@
+"""Compare building the DataFrame of a factory's transactions one transaction
+at a time and with the analysis.dataframes export layer
+
+Usage: python -m benchmarks.bench_factory_transactions [n_transactions] [n_sample]
+
+Fills the configured database with a factory and n_transactions summonMoloch
+transactions to it, each creating a DAO that appears in up to 4 more of them,
+then times daohaus.factory_transactions (one query for the transactions, one
+for the contracts they created) and the loop it replaces (a query for the main
+contract of each transaction, a pd.Series per row and pd.concat; timed on the
+first n_sample transactions and scaled). Everything is rolled back.
+"""
+import sys
+import time
+import evm_contracts_db
+import pandas as pd
+from django.db import connection, transaction
+from django.db.models import Count
+
+from evm_contracts_db.database.analysis.daohaus import factory_transactions
+from evm_contracts_db.database.models.blockchain import BlockchainAddress, BlockchainAddressAppearance
+
+Role = BlockchainAddressAppearance.Role
+
+# Address ids are offset by %(base)s, the next id of blockchain_addresses; address 0 is the factory, i + 1 the DAO of transaction i
+FILL = f"""
+    INSERT INTO blockchain_addresses (id, chain, address)
+        SELECT %(base)s + i, 'ETH', decode(lpad(to_hex(%(base)s + i), 40, '0'), 'hex') FROM generate_series(0, %(n)s) i;
+    INSERT INTO blockchain_transactions (tx_key, block_number, value, to_address_id, call_name, call_inputs)
+        SELECT ((10000000 + i / 4)::bigint << 32) | (i %% 4), 10000000 + i / 4, 0, %(base)s, 'summonMoloch',
+            jsonb_build_object('_summoner', format('["0x%%s"]', lpad(to_hex(i), 40, '0')), '_periodDuration', '17280',
+                '_summonerShares', '["1"]', '_proposalDeposit', (i * 1000)::text)
+        FROM generate_series(0, %(n)s - 1) i;
+    INSERT INTO blockchain_transactions_contracts_created (blockchaintransaction_id, blockchainaddress_id)
+        SELECT ((10000000 + i / 4)::bigint << 32) | (i %% 4), %(base)s + 1 + i FROM generate_series(0, %(n)s - 1) i;
+    INSERT INTO blockchain_address_appearances (address_id, tx_key, role)
+        SELECT %(base)s, ((10000000 + i / 4)::bigint << 32) | (i %% 4), {Role.TO} FROM generate_series(0, %(n)s - 1) i
+        UNION ALL
+        SELECT %(base)s + 1 + i, ((10000000 + i / 4)::bigint << 32) | (i %% 4), {Role.CREATED} FROM generate_series(0, %(n)s - 1) i
+        UNION ALL
+        SELECT %(base)s + 1 + i, ((10000000 + j / 4)::bigint << 32) | (j %% 4), {Role.INVOLVED}
+        FROM generate_series(0, %(n)s - 1) i, LATERAL generate_series(i + 1, least(i + (hashint4(i) & 2147483647) %% 5, %(n)s - 1)) j;
+"""
+
+
+def per_row(factory, limit=None):
+    """As before the export layer (on appears_in and appearance counts, which it lacked)"""
+
+    series = []
+    for txn in factory.appears_in(limit=limit):
+        txnDict = {'tx_key': txn.tx_key, 'transaction_id': txn.transaction_id, 'call_name': txn.call_name, 'call_inputs': txn.call_inputs}
+        try:
+            mainContract = txn.contracts_created.annotate(
+                appearance_count=Count('appearances__tx', distinct=True)
+            ).order_by('-appearance_count', 'address')[0]
+            contractDict = {'address': mainContract.address, 'appearance_count': mainContract.appearance_count}
+        except IndexError:
+            contractDict = {'address': None, 'appearance_count': None}
+        series.append(pd.Series({**txnDict, **contractDict}))
+
+    return pd.concat(series, axis=1, ignore_index=True).transpose()
+
+
+def run(n, sample):
+    results = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT coalesce(max(id), 0) + 1 FROM blockchain_addresses")
+        base = cursor.fetchone()[0]
+        cursor.execute(FILL, {'n': n, 'base': base})
+        cursor.execute("ANALYZE")
+        factory = BlockchainAddress.objects.get(pk=base)
+
+        start = time.perf_counter()
+        before = per_row(factory, limit=sample)
+        results['per row'] = (time.perf_counter() - start) * n / sample
+
+        start = time.perf_counter()
+        df = factory_transactions(factory.address)
+        results['export layer'] = time.perf_counter() - start
+
+        assert len(df) == n
+        columns = ['transaction_id', 'call_name', 'address', 'appearance_count']
+        assert df[columns].head(sample).astype(object).values.tolist() == before[columns].values.tolist()
+        transaction.set_rollback(True)
+
+    return results
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    sample = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    results = run(n, sample)
+    print(f"{n} summon transactions")
+    for name, seconds in results.items():
+        print(f"{name:<16}{seconds:>10.2f}s")
+    print(f"{'speedup':<16}{results['per row'] / results['export layer']:>10.1f}x")
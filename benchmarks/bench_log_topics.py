@@ -0,0 +1,89 @@
+"""Compare finding logs by event signature with topics as a varchar of hex
+words and as bytea topic columns with a (topic0, address) index
+
+Usage: python -m benchmarks.bench_log_topics [n_logs] [n_signatures] [n_contracts]
+
+Builds both layouts of blockchain_logs (before and after migration 0010) as
+temporary tables in the configured database, with two topics per log, and
+times finding the logs of one event signature, across all contracts and from
+one contract. Nothing is kept.
+"""
+import sys
+import time
+import evm_contracts_db
+from django.db import connection, transaction
+
+from utils.blockchain import word_to_bytes
+
+
+# Signature i hashes to md5(i) || md5(-i); contract addresses are ids
+TOPIC0 = "decode(md5((i %% %(signatures)s)::text) || md5((-(i %% %(signatures)s))::text), 'hex')"
+CONTRACT = "(hashint4(i) & 2147483647) %% %(contracts)s"
+
+SCHEMAS = {
+    'varchar': f"""
+        CREATE TEMP TABLE bench_logs (id bigserial PRIMARY KEY, address_id bigint, topics varchar(267));
+        INSERT INTO bench_logs (address_id, topics)
+            SELECT {CONTRACT}, '0x' || encode({TOPIC0}, 'hex') || ' 0x' || lpad(to_hex(i), 64, '0')
+            FROM generate_series(0, %(n)s - 1) i;
+    """,
+    'bytea': f"""
+        CREATE TEMP TABLE bench_logs (id bigserial PRIMARY KEY, address_id bigint, topic0 bytea, topic1 bytea, topic2 bytea, topic3 bytea);
+        INSERT INTO bench_logs (address_id, topic0, topic1)
+            SELECT {CONTRACT}, {TOPIC0}, decode(lpad(to_hex(i), 64, '0'), 'hex') FROM generate_series(0, %(n)s - 1) i;
+        CREATE INDEX ON bench_logs (topic0, address_id);
+    """,
+}
+
+# (name, query on varchar topics, query on bytea topics)
+QUERIES = [
+    ('signature', "SELECT count(*) FROM bench_logs WHERE topics LIKE %(prefix)s",
+     "SELECT count(*) FROM bench_logs WHERE topic0 = %(topic0)s"),
+    ('signature, contract', "SELECT count(*) FROM bench_logs WHERE topics LIKE %(prefix)s AND address_id = %(contract)s",
+     "SELECT count(*) FROM bench_logs WHERE topic0 = %(topic0)s AND address_id = %(contract)s"),
+]
+
+
+def best_of(cursor, sql, params, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        result = cursor.fetchall()
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+
+def run(n, signatures, contracts):
+    results = {}
+    for layout, schema in SCHEMAS.items():
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(schema, {'n': n, 'signatures': signatures, 'contracts': contracts})
+            cursor.execute("ANALYZE bench_logs")
+            cursor.execute("SELECT encode(decode(md5('7') || md5('-7'), 'hex'), 'hex')")
+            topic0 = '0x' + cursor.fetchone()[0]
+            params = {'prefix': topic0 + '%', 'topic0': word_to_bytes(topic0), 'contract': 42}
+            for name, varcharSql, byteaSql in QUERIES:
+                results[(name, layout)] = best_of(cursor, varcharSql if layout == 'varchar' else byteaSql, params)
+            cursor.execute("SELECT pg_table_size('bench_logs'), pg_indexes_size('bench_logs')")
+            results[('table bytes', layout)], results[('index bytes', layout)] = cursor.fetchone()
+            transaction.set_rollback(True)
+
+    return results
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    signatures = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    contracts = int(sys.argv[3]) if len(sys.argv) > 3 else 5000
+
+    results = run(n, signatures, contracts)
+    print(f"{n} logs, {signatures} event signatures, {contracts} contracts")
+    print(f"{'query':<22}{'varchar':>12}{'bytea':>12}{'speedup':>10}")
+    for name, _, _ in QUERIES:
+        (before, rows), (after, found) = results[(name, 'varchar')], results[(name, 'bytea')]
+        assert rows == found
+        print(f"{name:<22}{before * 1000:>10.1f}ms{after * 1000:>10.1f}ms{before / after:>9.1f}x")
+    for name in ['table bytes', 'index bytes']:
+        print(f"{name:<22}{results[(name, 'varchar')] / 2**20:>10.1f}MB{results[(name, 'bytea')] / 2**20:>10.1f}MB")
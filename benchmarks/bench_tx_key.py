@@ -0,0 +1,96 @@
+"""Compare queries on "block.index" string transaction keys and packed bigint keys
+
+Usage: python -m benchmarks.bench_tx_key [n_transactions]
+
+Builds both layouts of blockchain_transactions and blockchain_logs, with their
+indexes, before and after migration 0004 as temporary tables in the configured database, with 3
+logs per transaction, and times the same queries on each. Nothing is kept.
+"""
+import sys
+import time
+import random
+import evm_contracts_db
+from django.db import connection, transaction
+
+from utils.blockchain import pack_txid
+
+
+SCHEMAS = {
+    'string': """
+        CREATE TEMP TABLE bench_txns (transaction_id varchar(20) PRIMARY KEY, block_number integer NOT NULL);
+        CREATE TEMP TABLE bench_logs (id bigserial PRIMARY KEY, log_index varchar(50) NOT NULL,
+            originating_from_id varchar(20) REFERENCES bench_txns);
+        INSERT INTO bench_txns SELECT (10000000 + i / 4)::text || '.' || (i %% 4)::text, 10000000 + i / 4
+            FROM generate_series(0, %(n)s - 1) i;
+        INSERT INTO bench_logs (log_index, originating_from_id)
+            SELECT transaction_id || '.' || j, transaction_id FROM bench_txns, generate_series(0, 2) j;
+        CREATE INDEX ON bench_txns (transaction_id varchar_pattern_ops);
+        CREATE INDEX ON bench_logs (originating_from_id);
+        CREATE INDEX ON bench_logs (originating_from_id varchar_pattern_ops);
+    """,
+    'bigint': """
+        CREATE TEMP TABLE bench_txns (tx_key bigint PRIMARY KEY, block_number integer NOT NULL);
+        CREATE TEMP TABLE bench_logs (id bigserial PRIMARY KEY, log_index integer NOT NULL,
+            originating_from_id bigint REFERENCES bench_txns, UNIQUE (originating_from_id, log_index));
+        INSERT INTO bench_txns SELECT ((10000000 + i / 4)::bigint << 32) | (i %% 4), 10000000 + i / 4
+            FROM generate_series(0, %(n)s - 1) i;
+        INSERT INTO bench_logs (log_index, originating_from_id)
+            SELECT j, tx_key FROM bench_txns, generate_series(0, 2) j;
+    """,
+}
+
+# (name, query on string keys, query on packed keys); %(ids)s is a list of transaction ids or keys
+QUERIES = [
+    ('join logs', "SELECT count(*) FROM bench_logs l JOIN bench_txns t ON t.transaction_id = l.originating_from_id",
+     "SELECT count(*) FROM bench_logs l JOIN bench_txns t ON t.tx_key = l.originating_from_id"),
+    ('sort by block', "SELECT transaction_id FROM bench_txns ORDER BY block_number, split_part(transaction_id, '.', 2)::int",
+     "SELECT tx_key FROM bench_txns ORDER BY tx_key"),
+    ('block range', "SELECT count(*) FROM bench_txns WHERE block_number BETWEEN %(first)s AND %(last)s",
+     "SELECT count(*) FROM bench_txns WHERE tx_key BETWEEN %(first)s::bigint << 32 AND (%(last)s::bigint << 32) | 4294967295"),
+    ('IN 1000 ids', "SELECT count(*) FROM bench_logs WHERE originating_from_id = ANY(%(ids)s)",
+     "SELECT count(*) FROM bench_logs WHERE originating_from_id = ANY(%(ids)s)"),
+]
+
+
+def best_of(cursor, sql, params, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def run(n, seed=0):
+    rng = random.Random(seed)
+    txIds = [f"{10000000 + i // 4}.{i % 4}" for i in rng.sample(range(n), 1000)]
+    first = 10000000 + n // 8
+    results = {}
+    for layout, schema in SCHEMAS.items():
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(schema, {'n': n})
+            cursor.execute("ANALYZE bench_txns; ANALYZE bench_logs")
+            ids = txIds if layout == 'string' else [pack_txid(t) for t in txIds]
+            for name, stringSql, packedSql in QUERIES:
+                sql = stringSql if layout == 'string' else packedSql
+                results[(name, layout)] = best_of(cursor, sql, {'ids': ids, 'first': first, 'last': first + 100})
+            cursor.execute("SELECT pg_indexes_size('bench_txns') + pg_indexes_size('bench_logs')")
+            results[('index bytes', layout)] = cursor.fetchone()[0]
+            transaction.set_rollback(True)
+
+    return results
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    results = run(n)
+    print(f"{n} transactions, {3 * n} logs")
+    print(f"{'query':<16}{'string':>12}{'bigint':>12}{'speedup':>10}")
+    for name, _, _ in QUERIES:
+        before, after = results[(name, 'string')], results[(name, 'bigint')]
+        print(f"{name:<16}{before * 1000:>10.1f}ms{after * 1000:>10.1f}ms{before / after:>9.1f}x")
+    before, after = results[('index bytes', 'string')], results[('index bytes', 'bigint')]
+    print(f"{'index size':<16}{before / 2**20:>10.1f}MB{after / 2**20:>10.1f}MB{before / after:>9.1f}x")
@@ -5,7 +5,11 @@ import pandas as pd
 import ast
 import numpy as np
 
+from django.db.models import Count
+
 from evm_contracts_db.database.models.blockchain import BlockchainAddress
+from evm_contracts_db.database.analysis.dataframes import to_dataframe, related_dataframe
+from utils.blockchain import TX_INDEX_BITS, TX_INDEX_MASK
 
 KWARGS_FIG = {'format': 'png', 'bbox_inches': 'tight', 'dpi': 600}
 SAVEDIR = 'tmp'
@@ -28,40 +32,43 @@ def _len(value):
         return 0
 
 
-def get_factory_transactions(factoryAddress, chain=None, threshold=5):
-    """Analyze transactions with at least threshold txns"""
+def factory_transactions(factoryAddress, chain=None):
+    """DataFrame of the transactions in which a factory appears (tx_key,
+    transaction_id, call_name, call_inputs), with the address and
+    appearance_count (number of transactions it appears in) of the contract
+    with the most appearances among those each transaction created (if any),
+    in one query for the transactions and one for the contracts created
+    """
+
+    factory = BlockchainAddress.objects.get(address=factoryAddress, chain=chain or BlockchainAddress.Chains.MAINNET)
+    txns = factory.appears_in()
 
-    txns = BlockchainAddress.objects.get(address=factoryAddress, chain=chain).related_transactions.all()
+    df = to_dataframe(txns, 'tx_key', 'call_name', 'call_inputs')
+    blocks, indexes = df['tx_key'] // (1 << TX_INDEX_BITS), df['tx_key'] & TX_INDEX_MASK
+    df.insert(1, 'transaction_id', blocks.astype(str) + '.' + indexes.astype(str))
 
-    series = []
-    for txn in txns:
-        txnDict = {
-            k: v for k, v in txn.__dict__.items() 
-            if k in ['transaction_id', 'call_name', 'call_inputs']
-        }
+    created = related_dataframe(txns, 'contracts_created', 'address', appearance_count=Count('appearances__tx', distinct=True))
+    mainContracts = created.sort_values(['tx_key', 'appearance_count', 'address'], ascending=[True, False, True]).drop_duplicates('tx_key')
+    df = df.merge(mainContracts, on='tx_key', how='left')
+    df['appearance_count'] = df['appearance_count'].astype('Int64')
 
-        try:
-            mainContract = txn.contracts_created.order_by('-chifra_list_count')[0]
-            contractDict = {
-                k: v for k, v in mainContract.__dict__.items() 
-                if k in ['address', 'chifra_list_count']
-            }
-        except IndexError:
-            contractDict = {'address': None, 'chifra_list_count': None}
+    return df
 
-        series.append(pd.Series({**txnDict, **contractDict}))
 
-    df = pd.concat(series, axis=1, ignore_index=True).transpose()
+def get_factory_transactions(factoryAddress, chain=None, threshold=5):
+    """Analyze transactions with at least threshold txns"""
+
+    df = factory_transactions(factoryAddress, chain=chain)
 
     print(df['call_name'].value_counts())
     df_creation = df[df['call_name'] == 'summonMoloch'] # TODO: add summonMolochLLC
-    df_filtered = df_creation[df_creation['chifra_list_count'] > threshold].reset_index()
+    df_filtered = df_creation[df_creation['appearance_count'] > threshold].reset_index()
 
-    sns.histplot(df_creation['chifra_list_count'], discrete=True)
-    fname = f"{SAVEDIR}/histplot_chifra_list_count"
+    sns.histplot(df_creation['appearance_count'], discrete=True)
+    fname = f"{SAVEDIR}/histplot_appearance_count"
     plt.savefig(f'{fname}.png', **KWARGS_FIG)
 
-    logging.info(f"Selecting {len(df_filtered.index)} txns out of {len(df_creation.index)} that match chifra_list_count >= {threshold}")
+    logging.info(f"Selecting {len(df_filtered.index)} txns out of {len(df_creation.index)} that match appearance_count >= {threshold}")
 
     # TODO: reference dao_creation_functions in DaoFactory
     # TODO: add ABI/dao_creation_fields to DaoFactory, so that this can be drawn from database for any factory
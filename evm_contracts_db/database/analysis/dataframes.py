@@ -0,0 +1,123 @@
+import pandas as pd
+from itertools import islice
+from django.db import models
+from django.db.models.constants import LOOKUP_SEP
+
+from evm_contracts_db.database.models.fields import AddressField, WordField
+
+
+# Number of rows fetched at a time from the server-side cursor
+CHUNK_SIZE = 10000
+
+INTEGER_FIELDS = (models.IntegerField, models.BigIntegerField, models.SmallIntegerField, models.AutoField)
+STRING_FIELDS = (models.CharField, models.TextField, AddressField, WordField)
+
+
+def field_dtype(field, nullable=False):
+    """pandas dtype of the values of a model field (object for JSON and other
+    fields without a matching dtype); nullable integers and booleans use the
+    pandas nullable dtypes
+    """
+
+    if isinstance(field, models.BooleanField):
+        return 'boolean' if nullable else 'bool'
+    if isinstance(field, INTEGER_FIELDS):
+        return 'Int64' if nullable else 'int64'
+    if isinstance(field, models.FloatField):
+        return 'float64'
+    if isinstance(field, STRING_FIELDS):
+        return 'string'
+    if isinstance(field, models.DateTimeField):
+        return 'datetime64[ns, UTC]'
+
+    return 'object'
+
+
+def resolve_path(model, path):
+    """Model field of the values of a values() path (e.g. 'to_address__address';
+    the related primary key for a path ending on a relation), and whether they
+    may be null: a nullable field, or a join that may not match
+    """
+
+    field, nullable = None, False
+    for name in path.split(LOOKUP_SEP):
+        field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+        nullable = nullable or getattr(field, 'null', False)
+        if field.is_relation:
+            # Reverse and many-to-many relations join any number of rows, including none
+            nullable = nullable or not field.concrete or field.many_to_many
+            model = field.related_model
+            field = field.target_field if field.concrete and not field.many_to_many else model._meta.pk
+
+    return field, nullable
+
+
+def _export(queryset, fields, expressions):
+    """values_list queryset of fields and expressions, with the dtype of each column"""
+
+    queryset = queryset.values(*fields, **expressions)
+    dtypes = {}
+    for name in fields:
+        dtypes[name] = field_dtype(*resolve_path(queryset.model, name))
+    for name in expressions:
+        annotation = queryset.query.annotations[name]
+        # A count is 0 over a join that does not match; other expressions may be null
+        dtypes[name] = field_dtype(annotation.output_field, nullable=not isinstance(annotation, models.Count))
+
+    return queryset.values_list(*fields, *expressions), dtypes
+
+
+def _frame(rows, dtypes):
+    return pd.DataFrame.from_records(rows, columns=list(dtypes)).astype(dtypes)
+
+
+def to_dataframe(queryset, *fields, chunkSize=CHUNK_SIZE, **expressions):
+    """DataFrame of fields (values() paths, following forward relations in
+    the same query) and expressions of the rows of queryset, in one query read
+    from a server-side cursor chunkSize rows at a time, with a typed column
+    per field (see field_dtype)
+
+    e.g. to_dataframe(txns, 'tx_key', 'to_address__address', n_logs=Count('logs'))
+    """
+
+    queryset, dtypes = _export(queryset, fields, expressions)
+
+    return _frame(list(queryset.iterator(chunk_size=chunkSize)), dtypes)
+
+
+def iter_dataframes(queryset, *fields, chunkSize=CHUNK_SIZE, **expressions):
+    """Yield the rows of to_dataframe as DataFrames of chunkSize rows (one
+    query), to process a queryset that does not fit in memory
+    """
+
+    queryset, dtypes = _export(queryset, fields, expressions)
+    rows = queryset.iterator(chunk_size=chunkSize)
+    while True:
+        chunk = list(islice(rows, chunkSize))
+        if len(chunk) == 0:
+            return
+        yield _frame(chunk, dtypes)
+
+
+def related_dataframe(queryset, relation, *fields, chunkSize=CHUNK_SIZE, **expressions):
+    """DataFrame of fields and expressions (see to_dataframe) of the objects of
+    a many-valued relation (e.g. 'contracts_created', 'logs') of every row of
+    queryset, in one query, with the primary key of the row they relate to as
+    first column (named after it, e.g. tx_key)
+
+    e.g. related_dataframe(txns, 'contracts_created', 'address', n=Count('appearances'))
+    """
+
+    model = queryset.model
+    field = model._meta.get_field(relation)
+    if field.concrete:
+        # Forward many-to-many relation
+        back = field.related_query_name()
+    else:
+        back = field.field.name
+    related = field.related_model._default_manager.filter(**{f"{back}__in": queryset.values('pk')})
+
+    df = to_dataframe(related, back, *fields, chunkSize=chunkSize, **expressions).rename(columns={back: model._meta.pk.name})
+    df[model._meta.pk.name] = df[model._meta.pk.name].astype(field_dtype(model._meta.pk))
+
+    return df
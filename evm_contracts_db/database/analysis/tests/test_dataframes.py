@@ -0,0 +1,87 @@
+import pandas as pd
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+
+from evm_contracts_db.database.analysis.daohaus import factory_transactions
+from evm_contracts_db.database.analysis.dataframes import to_dataframe, iter_dataframes, related_dataframe
+from evm_contracts_db.database.etl.trueblocks_loader import TrueblocksLoader
+from evm_contracts_db.database.etl.tests.test_trueblocks_loader import _sample_transactions
+from evm_contracts_db.database.models.blockchain import BlockchainTransaction
+
+
+FACTORY = '0x' + 'f' * 40
+
+
+def _load():
+    dataDicts = _sample_transactions()
+    # The first transaction also creates a contract appearing in two more transactions
+    main = '0x' + 'a' * 40
+    dataDicts[0]['contracts_created'].append(main)
+    for i in [1, 2]:
+        dataDicts[i]['addresses_involved'].append(main)
+    TrueblocksLoader().insert_transactions(dataDicts, includeTraces=True, bulk=True)
+
+    return dataDicts
+
+
+def test_to_dataframe():
+    with transaction.atomic():
+        dataDicts = _load()
+        txns = BlockchainTransaction.objects.filter(to_address__address=FACTORY).order_by('tx_key')
+
+        with CaptureQueriesContext(connection) as queries:
+            df = to_dataframe(txns, 'tx_key', 'to_address__address', 'value', 'call_inputs', 'block__timestamp', n_logs=Count('logs'))
+        assert len(queries) == 1
+        assert df.dtypes.astype(str).to_dict() == {
+            'tx_key': 'int64', 'to_address__address': 'string', 'value': 'float64', 'call_inputs': 'object',
+            'block__timestamp': 'datetime64[ns, UTC]', 'n_logs': 'int64',
+        }
+        assert list(df['tx_key']) == [t.tx_key for t in txns]
+        assert (df['to_address__address'] == FACTORY).all() and df['block__timestamp'].isna().all()
+        assert list(df['n_logs']) == [2] * 5
+        assert df['call_inputs'][0] == dataDicts[0]['call_inputs']
+
+        # In chunks, from the same query
+        with CaptureQueriesContext(connection) as queries:
+            chunks = list(iter_dataframes(txns, 'tx_key', 'to_address__address', 'value', 'call_inputs', 'block__timestamp',
+                                          n_logs=Count('logs'), chunkSize=2))
+        assert len(queries) == 1
+        assert [len(c) for c in chunks] == [2, 2, 1]
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), df)
+
+        assert to_dataframe(txns.none(), 'tx_key', 'from_address').dtypes.astype(str).to_dict() == {'tx_key': 'int64', 'from_address': 'Int64'}
+        transaction.set_rollback(True)
+
+
+def test_related_dataframe():
+    with transaction.atomic():
+        _load()
+        txns = BlockchainTransaction.objects.filter(to_address__address=FACTORY)
+
+        with CaptureQueriesContext(connection) as queries:
+            logs = related_dataframe(txns, 'logs', 'log_index', 'event')
+            created = related_dataframe(txns, 'contracts_created', 'address')
+        assert len(queries) == 2
+        assert logs.dtypes.astype(str).to_dict() == {'tx_key': 'int64', 'log_index': 'int64', 'event': 'string'}
+        assert len(logs) == 10 and set(logs['event']) == {'SummonComplete'}
+        assert sorted(created.itertuples(index=False)) == sorted(
+            [(t.tx_key, c.address) for t in txns for c in t.contracts_created.all()]
+        )
+        transaction.set_rollback(True)
+
+
+def test_factory_transactions():
+    with transaction.atomic():
+        _load()
+
+        with CaptureQueriesContext(connection) as queries:
+            df = factory_transactions(FACTORY)
+        # The factory, its transactions and the contracts they created
+        assert len(queries) == 3
+        assert list(df.columns) == ['tx_key', 'transaction_id', 'call_name', 'call_inputs', 'address', 'appearance_count']
+        assert list(df['transaction_id']) == ['100.0', '101.1', '102.2', '103.3', '104.4']
+        assert list(df['address']) == ['0x' + 'a' * 40] + ['0x' + f"{i + 1000:040x}" for i in range(1, 5)]
+        assert list(df['appearance_count']) == [3, 1, 1, 1, 1]
+        assert (df['call_name'] == 'summonMoloch').all()
+        transaction.set_rollback(True)
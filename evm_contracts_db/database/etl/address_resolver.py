@@ -0,0 +1,147 @@
+import logging
+import threading
+from collections import OrderedDict
+from django.db import connection, transaction
+
+from evm_contracts_db.database.models import blockchain
+from utils.blockchain import address_to_bytes, bytes_to_address, normalize_address
+
+
+class AddressResolver:
+    """Resolve address strings to BlockchainAddress ids, creating missing records
+
+    All addresses in a batch are resolved with one SELECT, and any that are
+    missing are created with one INSERT ... ON CONFLICT DO NOTHING. Resolved
+    ids are kept in a bounded LRU shared by every resolver in the process.
+
+    Ids seen inside an uncommitted transaction are only moved to the LRU once
+    that transaction commits, so a rollback can never leave the cache pointing
+    at rows that do not exist.
+    """
+
+    MAXSIZE = 100000
+
+    # Shared across instances: (chain, address) -> id
+    _cache = OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, chain=None, maxsize=None):
+        """By default, assume addresses are on Ethereum mainnet"""
+
+        self.chain = 'ETH' if chain is None else chain
+        self.maxsize = self.MAXSIZE if maxsize is None else maxsize
+
+        # (chain, address) -> (id, atomic block in which it was resolved)
+        self._pending = {}
+
+    @staticmethod
+    def normalize(address):
+        """Addresses are keyed as lowercase 0x-prefixed hex (stored as 20 bytes)"""
+
+        return normalize_address(address)
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._lock:
+            cls._cache.clear()
+
+    def resolve_one(self, address):
+        """Return the BlockchainAddress id of a single address (or None)"""
+
+        if address is None:
+            return None
+
+        return self.resolve([address])[self.normalize(address)]
+
+    def resolve(self, addresses):
+        """Return dictionary of normalized address -> BlockchainAddress id for
+        every (non-None) address in addresses, creating records as needed
+        """
+
+        wanted = {self.normalize(a) for a in addresses if a is not None}
+        resolved = self._lookup(wanted)
+        missing = wanted - resolved.keys()
+        if len(missing) == 0:
+            return resolved
+
+        table = blockchain.BlockchainAddress._meta.db_table
+        found = {}
+
+        def _fetch(cursor):
+            found.update((bytes_to_address(a), i) for a, i in cursor.fetchall())
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT address, id FROM {table} WHERE chain = %s AND address = ANY(%s::bytea[])",
+                [self.chain, [address_to_bytes(a) for a in missing]]
+            )
+            _fetch(cursor)
+
+            toCreate = missing - found.keys()
+            if len(toCreate) > 0:
+                cursor.execute(
+                    f"""INSERT INTO {table} (chain, address)
+                    SELECT %s, unnest(%s::bytea[])
+                    ON CONFLICT (chain, address) DO NOTHING
+                    RETURNING address, id""",
+                    [self.chain, [address_to_bytes(a) for a in toCreate]]
+                )
+                _fetch(cursor)
+                logging.debug(f"Created {len(toCreate)} BlockchainAddress records")
+
+                # Rows created concurrently by another process are skipped by ON CONFLICT
+                raced = toCreate - found.keys()
+                if len(raced) > 0:
+                    cursor.execute(
+                        f"SELECT address, id FROM {table} WHERE chain = %s AND address = ANY(%s::bytea[])",
+                        [self.chain, [address_to_bytes(a) for a in raced]]
+                    )
+                    _fetch(cursor)
+
+        self._store(found)
+        resolved.update(found)
+
+        return resolved
+
+    def _lookup(self, addresses):
+        """Return the ids of addresses already known to this process"""
+
+        resolved = {}
+        with self._lock:
+            for address in addresses:
+                key = (self.chain, address)
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    resolved[address] = self._cache[key]
+
+        # Entries from an atomic block that has since exited may have been rolled back
+        blocks = connection.atomic_blocks
+        for address in addresses - resolved.keys():
+            entry = self._pending.get((self.chain, address))
+            if entry is not None:
+                if any(b is entry[1] for b in blocks):
+                    resolved[address] = entry[0]
+                else:
+                    del self._pending[(self.chain, address)]
+
+        return resolved
+
+    def _store(self, found):
+        entries = {(self.chain, address): addressId for address, addressId in found.items()}
+
+        if connection.in_atomic_block:
+            block = connection.atomic_blocks[-1]
+            for key, addressId in entries.items():
+                self._pending[key] = (addressId, block)
+            transaction.on_commit(lambda: self._promote(entries))
+        else:
+            self._promote(entries)
+
+    def _promote(self, entries):
+        with self._lock:
+            for key, addressId in entries.items():
+                self._cache[key] = addressId
+                self._cache.move_to_end(key)
+                self._pending.pop(key, None)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
@@ -0,0 +1,210 @@
+import io
+import os
+import re
+import mmap
+import logging
+import numpy as np
+import pandas as pd
+
+
+class Appearances:
+    """Appearances of an address as two parallel uint32 arrays of block
+    numbers and transaction indexes, sorted by (block, index)
+    """
+
+    __slots__ = ['blocks', 'txIndexes']
+
+    def __init__(self, blocks=None, txIndexes=None):
+        self.blocks = np.asarray(blocks if blocks is not None else [], dtype=np.uint32)
+        self.txIndexes = np.asarray(txIndexes if txIndexes is not None else [], dtype=np.uint32)
+
+    @classmethod
+    def concatenate(cls, parts):
+        parts = list(parts)
+        if len(parts) == 0:
+            return cls()
+        return cls(np.concatenate([p.blocks for p in parts]), np.concatenate([p.txIndexes for p in parts]))
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def sorted(self):
+        """Return appearances sorted by (block, index), without duplicates"""
+
+        keys = np.unique((self.blocks.astype(np.uint64) << 32) | self.txIndexes)
+        return Appearances((keys >> 32).astype(np.uint32), (keys & 0xffffffff).astype(np.uint32))
+
+    def restrict(self, firstBlock=None, lastBlock=None):
+        """Return appearances with firstBlock <= block <= lastBlock"""
+
+        mask = np.ones(len(self), dtype=bool)
+        if firstBlock is not None:
+            mask &= self.blocks >= firstBlock
+        if lastBlock is not None:
+            mask &= self.blocks <= lastBlock
+        return Appearances(self.blocks[mask], self.txIndexes[mask])
+
+    def txids(self):
+        """Return list of transaction ids ("blockNumber.transactionIndex")"""
+
+        return [f"{b}.{i}" for b, i in zip(self.blocks.tolist(), self.txIndexes.tolist())]
+
+
+def parse_chifra_list(output, addresses=None):
+    """Parse the txt (tab-separated) or csv output of `chifra list` for one or
+    more addresses into a dictionary of lowercase address -> Appearances
+
+    addresses: (optional) addresses to include even if they have no appearances
+    """
+
+    result = {a.lower(): Appearances() for a in addresses or []}
+    if len(output.strip()) == 0:
+        return result
+
+    # Columns are named by a header row (address, blockNumber, transactionIndex, ...)
+    sep = '\t' if b'\t' in output[:output.find(b'\n')] else ','
+    df = pd.read_csv(
+        io.BytesIO(output), sep=sep, usecols=['address', 'blockNumber', 'transactionIndex'],
+        dtype={'address': 'category', 'blockNumber': np.uint32, 'transactionIndex': np.uint32}
+    )
+
+    # Group rows by address, keeping chifra's (block, index) order within each
+    codes = df['address'].cat.codes.to_numpy()
+    order = np.argsort(codes, kind='stable')
+    blocks = df['blockNumber'].to_numpy()[order]
+    txIndexes = df['transactionIndex'].to_numpy()[order]
+    ends = np.cumsum(np.bincount(codes, minlength=len(df['address'].cat.categories)))
+    start = 0
+    for address, end in zip(df['address'].cat.categories, ends):
+        appearances = Appearances(blocks[start:end], txIndexes[start:end])
+        address = address.lower()
+        if len(result.get(address, ())) > 0:
+            appearances = Appearances.concatenate([result[address], appearances]).sorted()
+        result[address] = appearances
+        start = end
+
+    return result
+
+
+class UnchainedIndexReader:
+    """Read appearances straight from the chunks of a local Unchained Index (as
+    written by `chifra scrape`), without running chifra
+
+    Each chunk covers a range of blocks and has two files, named by that range
+    (e.g. 000000000-000000100):
+        finalized/<range>.bin: header (magic uint32, hash [32]byte, address
+            count uint32, appearance count uint32), then a table of address
+            records ([20]byte, offset uint32, count uint32) sorted by address,
+            then a table of appearances (block uint32, index uint32)
+        blooms/<range>.bloom: optional header (magic uint16, hash [32]byte),
+            bloom count uint32, then blooms of (count uint32, 2^20 bits), each
+            address setting the 5 bits given by its 4-byte words (big endian)
+            modulo 2^20
+    Integers are little endian. Files are memory mapped, and the address table
+    of a chunk is only searched when its bloom filter may contain the address.
+    """
+
+    HEADER_WIDTH = 44
+    ADDRESS_DTYPE = np.dtype([('address', 'S20'), ('offset', '<u4'), ('count', '<u4')])
+    APPEARANCE_DTYPE = np.dtype([('block', '<u4'), ('txIndex', '<u4')])
+
+    BLOOM_MAGIC = 0xdead
+    BLOOM_HEADER_WIDTH = 34
+    BLOOM_WIDTH_IN_BITS = 1 << 20
+    BLOOM_WIDTH_IN_BYTES = BLOOM_WIDTH_IN_BITS // 8
+
+    RANGE = re.compile(r'^(\d+)-(\d+)\.bin$')
+
+    def __init__(self, indexPath):
+        """indexPath: directory containing finalized/ and blooms/ (e.g.,
+        ~/.local/share/trueblocks/unchained/mainnet)
+        """
+
+        self.indexPath = os.path.expanduser(indexPath)
+
+    def chunks(self, firstBlock=None, lastBlock=None):
+        """Return sorted list of (first block, last block, range name) of the
+        chunks overlapping the block range
+        """
+
+        chunks = []
+        for fname in os.listdir(os.path.join(self.indexPath, 'finalized')):
+            match = self.RANGE.match(fname)
+            if match is None:
+                continue
+            first, last = int(match.group(1)), int(match.group(2))
+            if (firstBlock is not None and last < firstBlock) or (lastBlock is not None and first > lastBlock):
+                continue
+            chunks.append((first, last, fname[:-len('.bin')]))
+
+        return sorted(chunks)
+
+    def get_appearances(self, addresses, firstBlock=None, lastBlock=None):
+        """Return dictionary of lowercase address -> Appearances in the block range"""
+
+        wanted = {a.lower(): bytes.fromhex(a[2:]) for a in addresses}
+        parts = {a: [] for a in wanted}
+        for first, last, name in self.chunks(firstBlock, lastBlock):
+            candidates = self._bloom_filter(name, wanted)
+            if len(candidates) == 0:
+                continue
+            for address, appearances in self._read_chunk(name, candidates).items():
+                if (firstBlock is not None and first < firstBlock) or (lastBlock is not None and last > lastBlock):
+                    appearances = appearances.restrict(firstBlock, lastBlock)
+                parts[address].append(appearances)
+
+        return {a: Appearances.concatenate(p) for a, p in parts.items()}
+
+    @classmethod
+    def bloom_bits(cls, addressBytes):
+        return [int.from_bytes(addressBytes[i:i + 4], 'big') % cls.BLOOM_WIDTH_IN_BITS for i in range(0, 20, 4)]
+
+    def _bloom_filter(self, name, wanted):
+        """Return the subset of wanted (address -> bytes) that the chunk's
+        bloom filters may contain (all of them if there is no bloom file)
+        """
+
+        fpath = os.path.join(self.indexPath, 'blooms', f"{name}.bloom")
+        if not os.path.isfile(fpath):
+            return wanted
+
+        candidates = {}
+        with open(fpath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offset = self.BLOOM_HEADER_WIDTH if int.from_bytes(mm[:2], 'little') == self.BLOOM_MAGIC else 0
+            count = int.from_bytes(mm[offset:offset + 4], 'little')
+            starts = [offset + 4 + i * (4 + self.BLOOM_WIDTH_IN_BYTES) + 4 for i in range(count)]
+            for address, addressBytes in wanted.items():
+                bits = self.bloom_bits(addressBytes)
+                for start in starts:
+                    if all(mm[start + self.BLOOM_WIDTH_IN_BYTES - b // 8 - 1] & (1 << (b % 8)) for b in bits):
+                        candidates[address] = addressBytes
+                        break
+
+        return candidates
+
+    def _read_chunk(self, name, candidates):
+        """Return address -> Appearances for the candidates found in a chunk"""
+
+        found = {}
+        fpath = os.path.join(self.indexPath, 'finalized', f"{name}.bin")
+        with open(fpath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            nAddresses = int.from_bytes(mm[36:40], 'little')
+            nAppearances = int.from_bytes(mm[40:44], 'little')
+            table = np.frombuffer(mm, dtype=self.ADDRESS_DTYPE, count=nAddresses, offset=self.HEADER_WIDTH)
+            apps = np.frombuffer(
+                mm, dtype=self.APPEARANCE_DTYPE, count=nAppearances,
+                offset=self.HEADER_WIDTH + nAddresses * self.ADDRESS_DTYPE.itemsize
+            )
+            for address, addressBytes in candidates.items():
+                i = np.searchsorted(table['address'], addressBytes)
+                if i < nAddresses and table['address'][i] == addressBytes.rstrip(b'\0'):
+                    start, count = int(table['offset'][i]), int(table['count'][i])
+                    records = apps[start:start + count]
+                    found[address] = Appearances(records['block'].copy(), records['txIndex'].copy())
+                    del records
+            # Views of the map must be released before it is closed
+            del table, apps
+
+        logging.debug(f"Found {len(found)} of {len(candidates)} candidate addresses in chunk {name}")
+
+        return found
@@ -0,0 +1,350 @@
+import os
+import re
+import json
+import logging
+from itertools import islice
+from eth_abi.registry import registry
+from eth_abi.decoding import ContextFramesBytesIO
+from eth_abi.exceptions import DecodingError
+from eth_utils.abi import collapse_if_tuple, function_abi_to_4byte_selector, event_abi_to_log_topic
+
+
+def abi_entries(abi):
+    """Entries of a parsed ABI file: a list of entries, or a dictionary holding
+    it under 'abi' (e.g., a compiler artifact) or 'result' (Etherscan, as text)
+    """
+
+    if isinstance(abi, dict):
+        abi = abi.get('abi', abi.get('result', []))
+    if isinstance(abi, str):
+        abi = json.loads(abi)
+
+    return abi
+
+
+def param_names(params):
+    """Names of the inputs (or outputs) of an ABI entry, val_<i> for those
+    without a name, as chifra names them
+    """
+
+    return [p.get('name') or f"val_{i}" for i, p in enumerate(params)]
+
+
+def _json_value(param, value):
+    if param['type'].endswith(']'):
+        element = {**param, 'type': param['type'][:param['type'].rindex('[')]}
+        return [_json_value(element, v) for v in value]
+    if param['type'] == 'tuple':
+        components = param.get('components', [])
+        return {name: _json_value(p, v) for name, p, v in zip(param_names(components), components, value)}
+
+    return format_value(param, value)
+
+
+def format_value(param, value):
+    """Value decoded for an ABI parameter as chifra articulates it: numbers as
+    decimal text, addresses as lowercase hex, bytes as 0x hex, booleans as
+    true/false, and arrays and tuples as JSON text
+    """
+
+    abiType = param['type']
+    if abiType.endswith(']') or abiType == 'tuple':
+        return json.dumps(_json_value(param, value), separators=(',', ':'))
+    if abiType == 'address':
+        return value.lower()
+    if abiType == 'bool':
+        return 'true' if value else 'false'
+    if abiType.startswith('bytes'):
+        return '0x' + value.hex()
+
+    return str(value)
+
+
+def word_format(abiType):
+    """Function formatting a value of a static elementary ABI type (see
+    format_value) straight from its 32-byte word, or None for other types
+    """
+
+    if abiType == 'address':
+        return lambda word: '0x' + word[12:].hex()
+    if abiType == 'bool':
+        return lambda word: 'true' if any(word) else 'false'
+    if re.fullmatch(r'uint\d*', abiType):
+        return lambda word: str(int.from_bytes(word, 'big'))
+    if re.fullmatch(r'int\d*', abiType):
+        return lambda word: str(int.from_bytes(word, 'big', signed=True))
+    match = re.fullmatch(r'bytes(\d+)', abiType)
+    if match is not None:
+        size = int(match.group(1))
+        return lambda word: '0x' + word[:size].hex()
+
+    return None
+
+
+def compress_call(name, inputs):
+    """Compressed text of a decoded call or event (see unpack_compressed_call)"""
+
+    return f"{name}({', '.join(f'{v} /*{k}*/' for k, v in inputs.items())})"
+
+
+class AbiDecoder:
+    """Decoder of the inputs (and outputs) of a function, or of an event, of an ABI"""
+
+    __slots__ = ['name', 'entry', 'indexed', '_decoders']
+
+    def __init__(self, entry):
+        self.name = entry['name']
+        self.entry = entry
+        self.indexed = sum(1 for p in entry.get('inputs', []) if p.get('indexed'))
+        self._decoders = {}
+
+    def _decoder(self, key, params):
+        """Decoder of params, built once per key: the word_format of each
+        param if they are all static elementary types (one 32-byte word each),
+        else a tuple decoder (not strict, as the Solidity decoder)
+        """
+
+        decoder = self._decoders.get(key)
+        if decoder is None:
+            formats = [word_format(p['type']) for p in params]
+            if None not in formats:
+                decoder = formats
+            else:
+                decoder = registry.get_tuple_decoder(*[collapse_if_tuple(p) for p in params], strict=False)
+            self._decoders[key] = decoder
+
+        return decoder
+
+    def _decode(self, key, params, data):
+        """Formatted values of params (see format_value) decoded from data"""
+
+        decoder = self._decoder(key, params)
+        if isinstance(decoder, list):
+            if len(data) < 32 * len(decoder):
+                raise DecodingError(f"{len(data)} bytes is too short for {len(decoder)} words")
+            return [f(data[32 * i:32 * i + 32]) for i, f in enumerate(decoder)]
+
+        values = decoder(ContextFramesBytesIO(data))
+        return [format_value(p, v) for p, v in zip(params, values)]
+
+    def decode_inputs(self, calldata):
+        """Dictionary of the inputs of a call, from its calldata (without selector)"""
+
+        params = self.entry.get('inputs', [])
+        return dict(zip(param_names(params), self._decode('inputs', params, calldata)))
+
+    def decode_outputs(self, output):
+        """Dictionary of the outputs of a call, from its return data"""
+
+        params = self.entry.get('outputs', [])
+        return dict(zip(param_names(params), self._decode('outputs', params, output)))
+
+    def decode_log(self, topics, data):
+        """Dictionary of the inputs of an event, from its topics (without
+        topic0) and data. Indexed arrays, tuples, strings and bytes are only
+        logged as their hash, which is kept as is.
+        """
+
+        params = self.entry.get('inputs', [])
+        values = iter(self._decode('data', [p for p in params if not p.get('indexed')], data))
+        topics = iter(topics)
+        inputs = {}
+        for i, (name, p) in enumerate(zip(param_names(params), params)):
+            if not p.get('indexed'):
+                inputs[name] = next(values)
+            elif p['type'] in ['string', 'bytes', 'tuple'] or p['type'].endswith(']'):
+                inputs[name] = '0x' + next(topics).hex()
+            else:
+                inputs[name] = self._decode(f"topic{i}", [p], next(topics))[0]
+
+        return inputs
+
+
+class AbiStore:
+    """Functions and events of a set of ABIs, keyed by their 4-byte selector and
+    by their topic0 (and number of indexed inputs, as e.g. the ERC-20 and
+    ERC-721 Transfer events share a topic0)
+    """
+
+    def __init__(self, paths=None):
+        """paths: (optional) ABI files (see abi_entries) or directories of
+        them (e.g., chifra's cache of ABIs) to load
+        """
+
+        self.functions = {}
+        self.events = {}
+        for path in paths or []:
+            self.load(path)
+
+    def load(self, path):
+        """Add the ABI in a JSON file, or every *.json ABI in a directory"""
+
+        if os.path.isdir(path):
+            for fname in sorted(os.listdir(path)):
+                if fname.endswith('.json'):
+                    self.load(os.path.join(path, fname))
+            return
+
+        with open(path) as f:
+            try:
+                self.add(json.load(f))
+            except (ValueError, TypeError, KeyError) as e:
+                logging.warning(f"Could not load ABI from {path}: {e!r}")
+
+    def add(self, abi):
+        """Add the functions and events of an ABI (see abi_entries); the first
+        entry added for a selector is kept
+        """
+
+        for entry in abi_entries(abi):
+            if entry.get('type', 'function') == 'function':
+                self.functions.setdefault(function_abi_to_4byte_selector(entry), AbiDecoder(entry))
+            elif entry['type'] == 'event' and not entry.get('anonymous'):
+                decoder = AbiDecoder(entry)
+                self.events.setdefault((event_abi_to_log_topic(entry), decoder.indexed), decoder)
+
+    def function(self, selector):
+        """AbiDecoder of the function with a 4-byte selector, or None"""
+
+        return self.functions.get(bytes(selector))
+
+    def event(self, topic0, indexed):
+        """AbiDecoder of the event with a topic0 (bytes) and number of indexed inputs, or None"""
+
+        return self.events.get((bytes(topic0), indexed))
+
+
+def _to_bytes(value):
+    if value is None:
+        return b''
+    return bytes.fromhex(value[2:] if value[:2] in ['0x', '0X'] else value)
+
+
+class Articulator:
+    """Articulate raw chifra output (run without --articulate) in process from
+    an AbiStore, filling the articulatedTrace, articulatedTx and articulatedLog
+    records (and compressedTrace and compressedLog) that chifra would output,
+    so that TrueblocksTransformer reads them the same way
+
+    Calls and logs are decoded in bulk: those of a batch that share a selector
+    (or topic0) are decoded together, with one decoder.
+    """
+
+    # Number of records articulated at a time when iterating (see iter_articulated)
+    BATCH_SIZE = 10000
+
+    def __init__(self, store):
+        self.store = store
+
+    def decode_calls(self, calls):
+        """From a list of (calldata, return data or None) as hex, return the list of
+        (name, inputs, outputs or None) of each call, or None for calls of
+        unknown functions or that could not be decoded
+        """
+
+        groups = {}
+        for i, (calldata, output) in enumerate(calls):
+            data = _to_bytes(calldata)
+            if len(data) >= 4:
+                groups.setdefault(data[:4], []).append((i, data[4:], output))
+
+        decoded = [None] * len(calls)
+        for selector, group in groups.items():
+            decoder = self.store.function(selector)
+            if decoder is None:
+                continue
+            for i, data, output in group:
+                try:
+                    inputs = decoder.decode_inputs(data)
+                except (DecodingError, ValueError) as e:
+                    logging.debug(f"Could not decode call to {decoder.name}: {e!r}")
+                    continue
+                outputs = None
+                if output not in [None, '0x'] and len(decoder.entry.get('outputs') or []) > 0:
+                    try:
+                        outputs = decoder.decode_outputs(_to_bytes(output))
+                    except (DecodingError, ValueError) as e:
+                        logging.debug(f"Could not decode output of {decoder.name}: {e!r}")
+                decoded[i] = (decoder.name, inputs, outputs)
+
+        return decoded
+
+    def decode_logs(self, logs):
+        """From a list of chifra logs (with topics and data), return the list of
+        (name, inputs) of each log, or None for logs of unknown events or that
+        could not be decoded
+        """
+
+        groups = {}
+        for i, log in enumerate(logs):
+            topics = [_to_bytes(t) for t in log.get('topics') or []]
+            if len(topics) > 0:
+                groups.setdefault((topics[0], len(topics) - 1), []).append((i, topics[1:], _to_bytes(log.get('data'))))
+
+        decoded = [None] * len(logs)
+        for (topic0, indexed), group in groups.items():
+            decoder = self.store.event(topic0, indexed)
+            if decoder is None:
+                continue
+            for i, topics, data in group:
+                try:
+                    decoded[i] = (decoder.name, decoder.decode_log(topics, data))
+                except (DecodingError, ValueError) as e:
+                    logging.debug(f"Could not decode {decoder.name} log: {e!r}")
+
+        return decoded
+
+    def articulate_traces(self, traces):
+        """Articulate the calls of a list of chifra traces in place (skipping
+        traces already articulated) and return the list
+        """
+
+        pending = [
+            t for t in traces
+            if 'articulatedTrace' not in t and (t.get('action') or {}).get('input') is not None
+        ]
+        decoded = self.decode_calls([(t['action']['input'], (t.get('result') or {}).get('output')) for t in pending])
+        for trace, call in zip(pending, decoded):
+            if call is None:
+                continue
+            name, inputs, outputs = call
+            trace['articulatedTrace'] = {'name': name, 'inputs': inputs, 'outputs': outputs}
+            trace['compressedTrace'] = compress_call(name, inputs)
+
+        return traces
+
+    def articulate_transactions(self, transactions):
+        """Articulate the calls and receipt logs of a list of chifra
+        transactions in place (skipping those already articulated) and return
+        the list
+        """
+
+        pending = [t for t in transactions if 'articulatedTx' not in t and t.get('input') is not None]
+        for tx, call in zip(pending, self.decode_calls([(t['input'], None) for t in pending])):
+            if call is not None:
+                tx['articulatedTx'] = {'name': call[0], 'inputs': call[1]}
+                tx['compressedTx'] = compress_call(call[0], call[1])
+
+        logs = [
+            log for t in transactions for log in (t.get('receipt') or {}).get('logs') or []
+            if 'articulatedLog' not in log
+        ]
+        for log, event in zip(logs, self.decode_logs(logs)):
+            if event is not None:
+                log['articulatedLog'] = {'name': event[0], 'inputs': event[1]}
+                log['compressedLog'] = compress_call(*event)
+
+        return transactions
+
+    def iter_articulated(self, records, articulate, batchSize=None):
+        """Articulate an iterable of records (e.g., streamed chifra traces) with
+        articulate (e.g., self.articulate_traces), batchSize (default
+        BATCH_SIZE) records at a time, yielding each record
+        """
+
+        records = iter(records)
+        while True:
+            batch = list(islice(records, batchSize or self.BATCH_SIZE))
+            if len(batch) == 0:
+                return
+            yield from articulate(batch)
@@ -0,0 +1,96 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+
+def block_of(txId):
+    return int(txId.split('.')[0])
+
+
+def txid_key(txId):
+    """Sort key of a transaction id: (block number, transaction index)"""
+
+    return tuple(int(i) for i in txId.split('.'))
+
+
+class BatchPlan:
+    """Transactions to extract for a batch of addresses
+
+    txIdsByAddress: address -> transaction ids listed for it
+    txIds: ids to extract, each once, sorted by block and transaction index
+    skipped: listed ids left out because another batch is extracting them
+    function: chifra function the ids are extracted with (e.g., traces),
+        whose sync marks synced_blocks are for
+    """
+
+    def __init__(self, txIdsByAddress, txIds, skipped, function):
+        self.txIdsByAddress = txIdsByAddress
+        self.txIds = txIds
+        self.skipped = skipped
+        self.function = function
+
+    @property
+    def listed(self):
+        return sum(len(ids) for ids in self.txIdsByAddress.values())
+
+    def synced_blocks(self, failed):
+        """Return address -> highest block up to which all of its listed
+        transactions are loaded by self.function (or None), given the ids whose
+        extraction failed
+
+        Ids skipped because they were in flight count as not loaded yet.
+        """
+
+        unconfirmed = set(failed) | self.skipped
+        synced = {}
+        for address, txIds in self.txIdsByAddress.items():
+            if len(txIds) == 0:
+                synced[address] = None
+                continue
+            missing = [block_of(t) for t in txIds if t in unconfirmed]
+            synced[address] = min(missing) - 1 if len(missing) > 0 else max(block_of(t) for t in txIds)
+
+        return synced
+
+
+class BatchPlanner:
+    """Plan one extraction for many addresses whose appearances overlap (e.g.,
+    every DAO created by one factory), so that each transaction is extracted
+    once: appearance lists are unioned, and ids already loaded (per
+    TxIdDeduplicator) or being extracted by another batch of the same function
+    are left out
+    """
+
+    # (function, id) pairs, shared across instances, so concurrent batches in one process do not overlap
+    _inFlight = set()
+    _lock = threading.Lock()
+
+    def __init__(self, dedupe):
+        self.dedupe = dedupe
+
+    @contextmanager
+    def plan(self, txIdsByAddress, function):
+        """Plan the extraction with a chifra function (e.g., traces) for address
+        -> listed transaction ids, yielding a BatchPlan whose ids are marked as
+        in flight for that function until the block exits
+        """
+
+        union = set()
+        for txIds in txIdsByAddress.values():
+            union.update(txIds)
+
+        with self._lock:
+            skipped = {t for t in union if (function, t) in self._inFlight}
+            claimed = union - skipped
+            self._inFlight.update((function, t) for t in claimed)
+        try:
+            txIds = self.dedupe.missing(sorted(claimed, key=txid_key))
+            plan = BatchPlan(txIdsByAddress, txIds, skipped, function)
+            logging.info(
+                f"Extracting {len(txIds)} transactions for {len(txIdsByAddress)} addresses "
+                f"({plan.listed} appearances, {len(union)} unique, {len(skipped)} in flight)"
+            )
+            yield plan
+        finally:
+            with self._lock:
+                self._inFlight.difference_update((function, t) for t in claimed)
@@ -0,0 +1,143 @@
+import os
+import logging
+import threading
+import requests
+from collections import OrderedDict
+from datetime import datetime, timezone
+from django.db import connection
+
+from evm_contracts_db.database.models import blockchain
+
+
+def to_datetime(timestamp):
+    """UTC datetime of a unix timestamp (int, or hex string as returned by RPC)"""
+
+    if isinstance(timestamp, datetime):
+        return timestamp
+    if isinstance(timestamp, str):
+        timestamp = int(timestamp, 0)
+
+    return datetime.fromtimestamp(int(timestamp), tz=timezone.utc)
+
+
+def fetch_rpc_timestamps(blocks, rpcUrl=None, batchSize=100, session=None):
+    """Return dictionary of block number -> timestamp from batched
+    eth_getBlockByNumber JSON-RPC requests
+
+    rpcUrl: JSON-RPC endpoint (default: the RPC_KEY environment variable, as for utils.blockchain.get_timestamp)
+    batchSize: number of blocks per request
+    """
+
+    rpcUrl = rpcUrl or os.getenv('RPC_KEY')
+    if rpcUrl is None:
+        raise ValueError("No RPC endpoint: pass rpcUrl or set RPC_KEY")
+    session = requests.Session() if session is None else session
+
+    blocks = sorted(set(blocks))
+    timestamps = {}
+    for i in range(0, len(blocks), batchSize):
+        payload = [
+            {'jsonrpc': '2.0', 'id': b, 'method': 'eth_getBlockByNumber', 'params': [hex(b), False]}
+            for b in blocks[i:i + batchSize]
+        ]
+        response = session.post(rpcUrl, json=payload, timeout=60)
+        response.raise_for_status()
+        for result in response.json():
+            if result.get('result') is None:
+                logging.warning(f"No block {result.get('id')} from RPC: {result.get('error')}")
+                continue
+            timestamps[int(result['id'])] = to_datetime(result['result']['timestamp'])
+
+    return timestamps
+
+
+class BlockTimestamps:
+    """Resolve block numbers to timestamps from an LRU shared by every instance
+    in the process, then the blocks table (one SELECT per batch), then
+    optionally RPC, storing what it returns
+
+    Timestamps never change, so they are cached as soon as they are read.
+    """
+
+    MAXSIZE = 100000
+
+    # Shared across instances: block number -> timestamp
+    _cache = OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, rpcUrl=None, maxsize=None):
+        """rpcUrl: JSON-RPC endpoint for blocks not in the table (default: RPC_KEY, if set)"""
+
+        self.rpcUrl = rpcUrl or os.getenv('RPC_KEY')
+        self.maxsize = self.MAXSIZE if maxsize is None else maxsize
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._lock:
+            cls._cache.clear()
+
+    def get(self, block, fetch=True):
+        """Return the timestamp of a single block (or None)"""
+
+        if block is None:
+            return None
+
+        return self.get_many([block], fetch=fetch).get(int(block))
+
+    def get_many(self, blocks, fetch=False):
+        """Return dictionary of block number -> timestamp for every block whose
+        timestamp is known
+
+        fetch: get the timestamps of blocks not in the table from RPC, and store them
+        """
+
+        wanted = {int(b) for b in blocks if b is not None}
+        found = {}
+        with self._lock:
+            for block in wanted:
+                if block in self._cache:
+                    self._cache.move_to_end(block)
+                    found[block] = self._cache[block]
+
+        missing = wanted - found.keys()
+        if len(missing) > 0:
+            read = dict(blockchain.Block.objects.filter(number__in=missing).values_list('number', 'timestamp'))
+            missing -= read.keys()
+            if fetch and len(missing) > 0 and self.rpcUrl is not None:
+                try:
+                    fetched = fetch_rpc_timestamps(missing, rpcUrl=self.rpcUrl)
+                except requests.RequestException as e:
+                    logging.warning(f"Could not get block timestamps from RPC: {e}")
+                    fetched = {}
+                self.store(fetched)
+                read.update(fetched)
+            self._promote(read)
+            found.update(read)
+
+        return found
+
+    @staticmethod
+    def store(timestamps):
+        """Insert dictionary of block number -> timestamp (datetime or unix) into
+        the blocks table with one statement, skipping blocks already there
+        """
+
+        if len(timestamps) == 0:
+            return
+
+        blocks = sorted(timestamps)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""INSERT INTO {blockchain.Block._meta.db_table} (number, timestamp)
+                SELECT unnest(%s::integer[]), unnest(%s::timestamptz[])
+                ON CONFLICT (number) DO NOTHING""",
+                [blocks, [to_datetime(timestamps[b]) for b in blocks]]
+            )
+
+    def _promote(self, timestamps):
+        with self._lock:
+            for block, timestamp in timestamps.items():
+                self._cache[block] = timestamp
+                self._cache.move_to_end(block)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
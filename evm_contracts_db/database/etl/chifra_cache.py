@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+class ChifraCache:
+    """On-disk cache of chifra results (e.g., `chifra traces --articulate`)
+
+    Each successful chunk is stored as one content-addressed file, named by the
+    hash of the normalized command (function, format, flags and options), the
+    state (e.g., chain and chifra version) and the chunk's values. A small SQLite index maps every
+    (command, transaction id) to the entry holding its records, so a later
+    query for an overlapping set of transaction ids only runs chifra for the
+    ids not cached yet, whatever the chunking.
+
+    Entries are written atomically (to a temporary file, then renamed) and the
+    least recently used are evicted once the cache exceeds maxBytes.
+
+    Only functions whose values are transaction ids are cached; the result of
+    e.g. `chifra list` changes as the index grows. Transactions past the
+    finalized index (lastBlock) are not cached either, as a reorg may still
+    change them.
+    """
+
+    MAX_BYTES = 1 << 30
+    FUNCTIONS = ['traces', 'transactions', 'receipts', 'logs']
+
+    # SQLite limit on the number of host parameters in a statement
+    BATCH_SIZE = 900
+
+    def __init__(self, path, maxBytes=None, state='', lastBlock=None):
+        """path: cache directory
+        maxBytes: size above which least recently used entries are evicted
+        state: what results depend on besides the command (e.g., chain name
+            and chifra and client versions); changing it invalidates every entry
+        lastBlock: (optional) last block of the finalized index; records of
+            later blocks are returned by put but not stored
+        """
+
+        self.path = path
+        self.maxBytes = self.MAX_BYTES if maxBytes is None else maxBytes
+        self.state = state
+        self.lastBlock = lastBlock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, bytes INTEGER, used REAL)")
+            db.execute("""CREATE TABLE IF NOT EXISTS chunk_values (
+                command TEXT, value TEXT, key TEXT, PRIMARY KEY (command, value))""")
+            db.execute("CREATE INDEX IF NOT EXISTS chunk_values_key ON chunk_values (key)")
+
+    @contextmanager
+    def _connect(self):
+        # One connection per call: the cache is used from several threads and processes
+        db = sqlite3.connect(os.path.join(self.path, 'index.sqlite'), timeout=60, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def accepts(self, params):
+        return params.get('function') in self.FUNCTIONS
+
+    def command_key(self, params):
+        """Hash of the normalized command (without its values) and the state"""
+
+        command = {
+            'function': params['function'],
+            'format': params.get('format'),
+            'args': sorted(f.strip('-') for f in params.get('args') or []),
+            'kwargs': sorted((k.strip('-'), str(v)) for k, v in (params.get('kwargs') or {}).items()),
+            'state': self.state,
+        }
+
+        return hashlib.sha256(json.dumps(command, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def value_of(record):
+        """Transaction id ("blockNumber.transactionIndex") of a record"""
+
+        return f"{record.get('blockNumber')}.{record.get('transactionIndex')}"
+
+    def finalized(self, value):
+        """Whether the block of a transaction id is at most lastBlock"""
+
+        if self.lastBlock is None:
+            return True
+        try:
+            return int(value.split('.')[0]) <= self.lastBlock
+        except ValueError:
+            return False
+
+    def stats(self):
+        """Return hit/miss counts (of transaction ids) and the size of the cache"""
+
+        with self._connect() as db:
+            entries, nbytes = db.execute("SELECT count(*), coalesce(sum(bytes), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / lookups if lookups > 0 else None,
+            'entries': entries,
+            'bytes': nbytes,
+        }
+
+    def get(self, params, values):
+        """Return (dictionary of value -> list of cached records, list of values
+        not in the cache)
+        """
+
+        command = self.command_key(params)
+        values = [str(v) for v in values]
+        keys = {}
+        with self._connect() as db:
+            for i in range(0, len(values), self.BATCH_SIZE):
+                batch = values[i:i + self.BATCH_SIZE]
+                rows = db.execute(
+                    f"SELECT value, key FROM chunk_values WHERE command = ? AND value IN ({','.join('?' * len(batch))})",
+                    [command, *batch]
+                ).fetchall()
+                for value, key in rows:
+                    keys.setdefault(key, set()).add(value)
+
+            found = {}
+            for key, wanted in keys.items():
+                entry = self._read(key)
+                if entry is None:
+                    # File removed from under the index
+                    db.execute("DELETE FROM chunk_values WHERE key = ?", [key])
+                    db.execute("DELETE FROM entries WHERE key = ?", [key])
+                    continue
+                for value in wanted:
+                    found[value] = []
+                for record in entry['data']:
+                    value = self.value_of(record)
+                    if value in wanted:
+                        found[value].append(record)
+                db.execute("UPDATE entries SET used = ? WHERE key = ?", [time.time(), key])
+
+        missing = [v for v in values if v not in found]
+        with self._lock:
+            self.hits += len(values) - len(missing)
+            self.misses += len(missing)
+
+        return found, missing
+
+    def put(self, params, values, records):
+        """Store the records returned for a chunk of values (those of finalized
+        blocks); return them as a dictionary of value -> list of records, or
+        None if some records do not belong to any of the values (in which case
+        nothing is cached)
+        """
+
+        command = self.command_key(params)
+        values = [str(v) for v in values]
+        byValue = {v: [] for v in values}
+        for record in records:
+            value = self.value_of(record)
+            if value not in byValue:
+                logging.debug(f"Not caching chifra {params['function']} chunk: unexpected record for {value}")
+                return None
+            byValue[value].append(record)
+
+        if not all(self.finalized(v) for v in values):
+            values = [v for v in values if self.finalized(v)]
+            records = [r for v in values for r in byValue[v]]
+            logging.debug(f"Not caching chifra {params['function']} values past block {self.lastBlock}")
+            if len(values) == 0:
+                return byValue
+
+        key = hashlib.sha256((command + '\n' + '\n'.join(sorted(values))).encode()).hexdigest()
+        nbytes = self._write(key, {'values': values, 'data': records})
+
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("INSERT OR REPLACE INTO entries (key, bytes, used) VALUES (?, ?, ?)", [key, nbytes, time.time()])
+            db.executemany(
+                "INSERT OR REPLACE INTO chunk_values (command, value, key) VALUES (?, ?, ?)",
+                [(command, v, key) for v in values]
+            )
+            # Entries whose values have all been superseded by newer entries
+            orphans = [r[0] for r in db.execute(
+                "SELECT key FROM entries e WHERE NOT EXISTS (SELECT 1 FROM chunk_values v WHERE v.key = e.key)"
+            )]
+            self._delete(db, orphans)
+            self._evict(db)
+            db.execute("COMMIT")
+
+        return byValue
+
+    def _evict(self, db):
+        """Delete least recently used entries until the cache fits in maxBytes"""
+
+        total = db.execute("SELECT coalesce(sum(bytes), 0) FROM entries").fetchone()[0]
+        if total <= self.maxBytes:
+            return
+
+        evict = []
+        for key, nbytes in db.execute("SELECT key, bytes FROM entries ORDER BY used"):
+            if total <= self.maxBytes:
+                break
+            evict.append(key)
+            total -= nbytes
+        self._delete(db, evict)
+        logging.debug(f"Evicted {len(evict)} chifra cache entries")
+
+    def _delete(self, db, keys):
+        for key in keys:
+            db.execute("DELETE FROM chunk_values WHERE key = ?", [key])
+            db.execute("DELETE FROM entries WHERE key = ?", [key])
+            try:
+                os.remove(self._file(key))
+            except FileNotFoundError:
+                pass
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+    def _read(self, key):
+        try:
+            with open(self._file(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return None
+
+    def _write(self, key, entry):
+        """Write entry atomically, so that readers never see a partial file"""
+
+        fpath = self._file(key)
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(fpath), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmpPath, fpath)
+        except BaseException:
+            os.remove(tmpPath)
+            raise
+
+        return os.path.getsize(fpath)
@@ -0,0 +1,67 @@
+import logging
+
+
+class AdaptiveChunker:
+    """Choose how many values (e.g., transaction ids) to pass to each chifra call
+
+    Chunk size adapts to the latency and output size observed for previous
+    chunks, aiming for calls of about targetSeconds that produce at most
+    targetBytes of output. When a chunk fails, the size is halved and never
+    grows back to the size that failed. Each chunk is
+    also capped at maxChars characters of arguments, to keep command lines well
+    below the operating system's limit (ARG_MAX).
+    """
+
+    def __init__(self, initialSize=200, minSize=1, maxSize=10000,
+                 targetSeconds=60, targetBytes=256 * 1024 * 1024, maxChars=100000):
+        self.size = initialSize
+        self.minSize = minSize
+        self.maxSize = maxSize
+        self.targetSeconds = targetSeconds
+        self.targetBytes = targetBytes
+        self.maxChars = maxChars
+        self.ceiling = maxSize
+
+    def next_chunk(self, values, start=0, end=None):
+        """Return the next chunk of values beginning at index start (and ending
+        no later than index end)
+        """
+
+        end = len(values) if end is None else end
+        chunk = []
+        chars = 0
+        for value in values[start:min(end, start + self.size)]:
+            chars += len(str(value)) + 1
+            if chars > self.maxChars and len(chunk) > 0:
+                break
+            chunk.append(value)
+
+        return chunk
+
+    def record(self, n, seconds, nbytes):
+        """Adapt chunk size after a successful call on n values"""
+
+        if n == 0:
+            return
+
+        ideal = self.maxSize
+        if seconds > 0:
+            ideal = min(ideal, self.targetSeconds * n / seconds)
+        if nbytes > 0:
+            ideal = min(ideal, self.targetBytes * n / nbytes)
+
+        # Grow at most 2x per call, but shrink straight away when over target
+        size = min(ideal, 2 * self.size, self.ceiling)
+        self._set_size(int(size))
+
+        logging.debug(f"Chunk of {n} took {seconds:.1f}s for {nbytes} bytes; next chunk size {self.size}")
+
+    def shrink(self, n=None):
+        """Halve chunk size after a failed call (on n values)"""
+
+        if n is not None:
+            self.ceiling = max(self.minSize, min(self.ceiling, n - 1))
+        self._set_size(min(self.size, n or self.size) // 2)
+
+    def _set_size(self, size):
+        self.size = max(self.minSize, min(self.maxSize, size))
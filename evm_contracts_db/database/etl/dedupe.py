@@ -0,0 +1,110 @@
+import math
+import hashlib
+import logging
+from django.db import connection, transaction
+
+from evm_contracts_db.database.models import blockchain
+from evm_contracts_db.database.etl.trueblocks_loader import copy_rows
+from utils.blockchain import pack_txid, txid_of
+
+
+class BloomFilter:
+    """Fixed-size set of strings that may report false positives (at about
+    errorRate once it holds capacity items) but never false negatives
+    """
+
+    def __init__(self, capacity, errorRate=0.01):
+        capacity = max(1, int(capacity))
+        self.nbits = max(8, int(-capacity * math.log(errorRate) / math.log(2) ** 2))
+        self.nhashes = max(1, round(self.nbits / capacity * math.log(2)))
+        self.bits = bytearray((self.nbits + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.nbits for i in range(self.nhashes))
+
+    def add(self, item):
+        for p in self._positions(item):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+
+class TxIdDeduplicator:
+    """Find which transaction ids are not loaded in blockchain_transactions yet
+
+    Candidate ids are copied (as packed keys) into a temporary table and
+    anti-joined against blockchain_transactions in one query, instead of an IN
+    list of every id.
+
+    With bloom=True, the ids already loaded are also kept in a BloomFilter
+    (built on first use, then extended with every id passed to add). Ids it
+    does not contain are missing without asking the database; only those it
+    may contain are checked. Ids loaded by other processes after the filter
+    is built are reported missing, so at worst they are extracted again.
+    """
+
+    STAGING = 'candidate_txids'
+
+    def __init__(self, bloom=False, errorRate=0.01):
+        self.useBloom = bloom
+        self.errorRate = errorRate
+        self.bloom = None
+
+    def missing(self, txIds):
+        """Return the ids of txIds (in their order) that are not loaded yet"""
+
+        if self.useBloom:
+            if self.bloom is None:
+                self.load_bloom()
+            maybeLoaded = {t for t in txIds if t in self.bloom}
+        else:
+            maybeLoaded = set(txIds)
+
+        notLoaded = self.not_loaded(maybeLoaded)
+        missing = [t for t in txIds if t not in maybeLoaded or t in notLoaded]
+        logging.debug(f"{len(missing)} of {len(txIds)} transaction ids not loaded ({len(maybeLoaded)} checked in database)")
+
+        return missing
+
+    def not_loaded(self, txIds):
+        """Return the set of ids of txIds that are not in blockchain_transactions"""
+
+        if len(txIds) == 0:
+            return set()
+
+        table = blockchain.BlockchainTransaction._meta.db_table
+        keys = {pack_txid(t): t for t in txIds}
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.STAGING}")
+            cursor.execute(f"CREATE TEMP TABLE {self.STAGING} (tx_key bigint) ON COMMIT DROP")
+            copy_rows(cursor, self.STAGING, ['tx_key'], ((k,) for k in keys))
+            cursor.execute(
+                f"""SELECT c.tx_key FROM {self.STAGING} c
+                WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.tx_key = c.tx_key)"""
+            )
+            notLoaded = {keys[row[0]] for row in cursor.fetchall()}
+            cursor.execute(f"DROP TABLE {self.STAGING}")
+
+        return notLoaded
+
+    def load_bloom(self, chunkSize=100000):
+        """Build the BloomFilter of every loaded transaction id"""
+
+        txns = blockchain.BlockchainTransaction.objects
+        self.bloom = BloomFilter(capacity=max(2 * txns.count(), 1000000), errorRate=self.errorRate)
+        self.bloom.update(txid_of(k) for k in txns.values_list('tx_key', flat=True).iterator(chunk_size=chunkSize))
+
+    def add(self, txIds):
+        """Record txIds as loaded (a no-op without a BloomFilter)"""
+
+        if self.bloom is not None:
+            self.bloom.update(txIds)
@@ -0,0 +1,237 @@
+import re
+import logging
+import threading
+from django.db import connection, transaction
+
+from utils.blockchain import TX_INDEX_BITS
+
+
+# Tables partitioned by block range, with their partition key: transactions on
+# tx_key, logs and traces on the tx_key of their transaction, so that a block
+# range is a key range in all three
+PARTITIONED_TABLES = [
+    ("blockchain_transactions", "tx_key"),
+    ("blockchain_logs", "originating_from_id"),
+    ("blockchain_traces", "originating_from_id"),
+]
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass", [table])
+    return cursor.fetchone()[0]
+
+
+def partition_bounds(cursor, table):
+    """Return sorted list of (first block, end block) of the partitions of table"""
+
+    cursor.execute(
+        """SELECT pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass""",
+        [table]
+    )
+    bounds = []
+    for (expr,) in cursor.fetchall():
+        keys = [int(k) for k in re.findall(r'\d+', expr)]
+        if len(keys) == 2:
+            bounds.append((keys[0] >> TX_INDEX_BITS, keys[1] >> TX_INDEX_BITS))
+
+    return sorted(bounds)
+
+
+def create_partitions(cursor, table, starts, blockRange):
+    """Create the partitions of table for blocks [start, start + blockRange), for each start"""
+
+    for start in sorted(starts):
+        cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {table}_p{start} PARTITION OF {table}
+            FOR VALUES FROM ({start << TX_INDEX_BITS}) TO ({(start + blockRange) << TX_INDEX_BITS})"""
+        )
+
+
+def partition_tables(cursor, blockRange):
+    """Convert the PARTITIONED_TABLES into tables partitioned by ranges of
+    blockRange blocks, with a partition for the first range and each range holding rows
+    """
+
+    _rebuild_all(cursor, blockRange)
+
+
+def unpartition_tables(cursor):
+    """Convert the PARTITIONED_TABLES back into plain tables"""
+
+    _rebuild_all(cursor, None)
+
+
+def block_range(cursor):
+    """Return the number of blocks per partition of the PARTITIONED_TABLES, or
+    None if they are not partitioned
+    """
+
+    table = PARTITIONED_TABLES[0][0]
+    if not is_partitioned(cursor, table):
+        return None
+    first, end = partition_bounds(cursor, table)[0]
+
+    return end - first
+
+
+def set_block_range(cursor, blockRange):
+    """Partition the PARTITIONED_TABLES by ranges of blockRange blocks (or
+    convert them back into plain tables if blockRange is None), in place and
+    keeping their rows; return whether they were rebuilt (not if they already
+    were so)
+    """
+
+    current = block_range(cursor)
+    if current == blockRange:
+        return False
+    if current is not None:
+        unpartition_tables(cursor)
+    if blockRange is not None:
+        partition_tables(cursor, blockRange)
+
+    return True
+
+
+def _rebuild_all(cursor, blockRange):
+    # Foreign keys to blockchain_transactions (from logs, traces and contracts
+    # created) are dropped while it is rebuilt, then added back; those of
+    # partitions are copies of their parent's
+    cursor.execute(
+        """SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE contype = 'f' AND confrelid = 'blockchain_transactions'::regclass AND conparentid = 0"""
+    )
+    references = cursor.fetchall()
+    for table, name, _ in references:
+        cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+
+    for table, key in PARTITIONED_TABLES:
+        _rebuild(cursor, table, key, blockRange)
+
+    for table, name, definition in references:
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+
+def _rebuild(cursor, table, key, blockRange):
+    """Copy table into a new table, partitioned by key if blockRange is given,
+    with the same columns, constraints and indexes
+    """
+
+    old = f"{table}_old"
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    cursor.execute(
+        """SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('u', 'f')""",
+        [old]
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        """SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s
+        AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)""",
+        [old, old]
+    )
+    indexes = [r[0] for r in cursor.fetchall()]
+    cursor.execute(
+        "SELECT attname FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'id' AND NOT attisdropped",
+        [old]
+    )
+    hasId = cursor.fetchone() is not None
+
+    partitionBy = f" PARTITION BY RANGE ({key})" if blockRange is not None else ""
+    cursor.execute(
+        f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE){partitionBy}"
+    )
+    if hasId:
+        # The id sequence (or identity) of the old table goes with it
+        cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id DROP DEFAULT")
+    if blockRange is not None:
+        cursor.execute(f"SELECT count(*) FROM {old} WHERE {key} IS NULL")
+        if cursor.fetchone()[0] > 0:
+            raise ValueError(f"{old} has rows without {key}, which cannot be partitioned")
+        # The first range always exists, so that the range is known from the partitions
+        cursor.execute(f"SELECT DISTINCT ({key} >> {TX_INDEX_BITS}) / {blockRange} * {blockRange} FROM {old}")
+        create_partitions(cursor, table, {0} | {r[0] for r in cursor.fetchall()}, blockRange)
+
+    cursor.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    cursor.execute(f"DROP TABLE {old}")
+
+    # The primary key of a partitioned table must include the partition key
+    if hasId:
+        primaryKey = ['id', key] if blockRange is not None else ['id']
+    else:
+        primaryKey = [key]
+    cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY ({', '.join(primaryKey)})")
+    if hasId:
+        if blockRange is not None:
+            cursor.execute(f"CREATE SEQUENCE {table}_id_seq OWNED BY {table}.id")
+            cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')")
+        else:
+            cursor.execute(f"ALTER TABLE {table} ALTER COLUMN {key} DROP NOT NULL")
+            cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY")
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), coalesce(max(id), 0) + 1, false) FROM {table}")
+
+    for name, _, definition in constraints:
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+    for definition in indexes:
+        # Indexes of partitioned tables are listed "ON ONLY", which would skip the partitions
+        cursor.execute(re.sub(rf" ON (ONLY )?(\w+\.)?{old} ", f" ON {table} ", definition))
+
+    logging.info(f"Rebuilt {table}" + (f" partitioned by {blockRange} blocks" if blockRange is not None else ""))
+
+
+class BlockPartitions:
+    """Create the partitions that rows for new block ranges need, when the
+    PARTITIONED_TABLES are partitioned (see the partition_tables command),
+    spanning as many blocks as the existing ones; a no-op otherwise
+
+    Known partitions are cached for the process. Partitions created inside an
+    atomic block are only cached once it commits, as a rollback drops them.
+    """
+
+    # Shared across instances: (first block, end block) of existing partitions,
+    # False if the tables are not partitioned, None until loaded
+    _bounds = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._lock:
+            cls._bounds = None
+
+    def _load(self):
+        with self._lock:
+            if self._bounds is not None:
+                return self._bounds
+        with connection.cursor() as cursor:
+            bounds = partition_bounds(cursor, PARTITIONED_TABLES[0][0]) if is_partitioned(cursor, PARTITIONED_TABLES[0][0]) else False
+        with self._lock:
+            BlockPartitions._bounds = bounds
+
+        return bounds
+
+    def ensure(self, blocks):
+        """Create the partitions (of every partitioned table) holding blocks"""
+
+        bounds = self._load()
+        if bounds is False:
+            return
+
+        blockRange = bounds[0][1] - bounds[0][0]
+        starts = {
+            b // blockRange * blockRange for b in set(blocks)
+            if not any(first <= b < end for first, end in bounds)
+        }
+        if len(starts) == 0:
+            return
+
+        with connection.cursor() as cursor:
+            for table, _ in PARTITIONED_TABLES:
+                create_partitions(cursor, table, starts, blockRange)
+        logging.info(f"Created partitions for blocks {sorted(starts)} (+{blockRange})")
+
+        def promote():
+            with self._lock:
+                if isinstance(BlockPartitions._bounds, list):
+                    BlockPartitions._bounds = sorted(BlockPartitions._bounds + [(s, s + blockRange) for s in starts])
+
+        transaction.on_commit(promote)
@@ -0,0 +1,156 @@
+import time
+import queue
+import logging
+import threading
+
+
+class StageStats:
+    """Throughput counters of one pipeline stage"""
+
+    __slots__ = ['name', 'items', 'records', 'busy', 'blocked']
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0      # batches output
+        self.records = 0    # total length of batches output
+        self.busy = 0.0     # seconds spent working
+        self.blocked = 0.0  # seconds spent waiting on a full output queue
+
+    @property
+    def rate(self):
+        """Records per busy second"""
+
+        return self.records / self.busy if self.busy > 0 else None
+
+    def __str__(self):
+        rate = f"{self.rate:.0f}/s" if self.rate is not None else "n/a"
+        return (f"{self.name}: {self.items} batches, {self.records} records, {self.busy:.1f}s busy "
+                f"({rate}), {self.blocked:.1f}s blocked")
+
+
+class Pipeline:
+    """Run extract -> transform -> load as concurrent stages connected by
+    bounded queues
+
+    Extraction and transformation each run on a worker thread; loading runs on
+    the calling thread, so that it uses the caller's database connection and
+    transaction. When a stage falls behind, the queue before it fills up and
+    the stages upstream block (backpressure), so at most maxsize batches wait
+    between two stages. StageStats show which stage is the bottleneck: it is
+    busy all the time while the others are blocked or starved.
+    """
+
+    _DONE = object()
+
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self.stats = {name: StageStats(name) for name in ['extract', 'transform', 'load']}
+        self._stop = threading.Event()
+        self._errors = []
+
+    def run(self, source, transform, load):
+        """source: iterable of batches (e.g., lists of chifra records)
+        transform: function from a batch to an iterable of batches to load
+        load: function called on each transformed batch
+
+        Returns the StageStats of each stage, keyed by name.
+        """
+
+        extracted = queue.Queue(maxsize=self.maxsize)
+        transformed = queue.Queue(maxsize=self.maxsize)
+        workers = [
+            threading.Thread(target=self._extract, args=(source, extracted), name='pipeline-extract', daemon=True),
+            threading.Thread(target=self._transform, args=(transform, extracted, transformed), name='pipeline-transform', daemon=True),
+        ]
+        for worker in workers:
+            worker.start()
+
+        stats = self.stats['load']
+        try:
+            for batch in self._drain(transformed):
+                t0 = time.perf_counter()
+                load(batch)
+                stats.busy += time.perf_counter() - t0
+                stats.items += 1
+                stats.records += len(batch)
+        finally:
+            self._stop.set()
+            for worker in workers:
+                worker.join()
+
+        if len(self._errors) > 0:
+            raise self._errors[0]
+
+        for s in self.stats.values():
+            logging.info(f"Pipeline {s}")
+
+        return self.stats
+
+    def _extract(self, source, out):
+        stats = self.stats['extract']
+        iterator = iter(source)
+        try:
+            while not self._stop.is_set():
+                t0 = time.perf_counter()
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    break
+                stats.busy += time.perf_counter() - t0
+                stats.items += 1
+                stats.records += len(batch)
+                self._put(out, batch, stats)
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            # Stops any chifra calls still running when the pipeline is cut short
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            self._put(out, self._DONE)
+
+    def _transform(self, transform, source, out):
+        stats = self.stats['transform']
+        try:
+            for batch in self._drain(source):
+                t0 = time.perf_counter()
+                for result in transform(batch):
+                    stats.busy += time.perf_counter() - t0
+                    stats.items += 1
+                    stats.records += len(result)
+                    self._put(out, result, stats)
+                    t0 = time.perf_counter()
+                stats.busy += time.perf_counter() - t0
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            self._put(out, self._DONE)
+
+    def _put(self, q, item, stats=None):
+        """Put item on q, waiting while it is full unless the pipeline stops"""
+
+        t0 = time.perf_counter()
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                if self._stop.is_set():
+                    break
+        if stats is not None:
+            stats.blocked += time.perf_counter() - t0
+
+    def _drain(self, q):
+        """Yield items from q until the upstream stage is done or the pipeline stops"""
+
+        while True:
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            if item is self._DONE:
+                return
+            yield item
@@ -0,0 +1,26 @@
+import os
+import pytest
+
+from evm_contracts_db.database.etl.tests import fake_chifra as _fake_chifra
+from evm_contracts_db.database.etl.tests import fake_rpc as _fake_rpc
+
+
+@pytest.fixture
+def fake_chifra(tmp_path, monkeypatch):
+    """Put a fake chifra executable first on PATH and return its path"""
+
+    fpath = _fake_chifra.install(tmp_path)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    return fpath
+
+
+@pytest.fixture
+def fake_rpc(monkeypatch):
+    """Serve a stand-in JSON-RPC endpoint, set as RPC_KEY, and return (url,
+    list of the blocks of each request)
+    """
+
+    with _fake_rpc.serve() as (url, calls):
+        monkeypatch.setenv('RPC_KEY', url)
+        yield url, calls
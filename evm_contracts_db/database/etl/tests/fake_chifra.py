@@ -0,0 +1,79 @@
+"""Stand-in for chifra: echoes each block.index value as a JSON record, or three
+appearances per address (in blocks 100 to 102, from --first_block) for `chifra list`,
+or its version and index head for `chifra status`
+
+FAKE_CHIFRA_DELAY: seconds to sleep before answering
+FAKE_CHIFRA_MAX_VALUES: exit with an error if given more values than this
+FAKE_CHIFRA_LOG: file to which the values of each call (but status) are appended, one line per call
+FAKE_CHIFRA_VERSION: version reported by `chifra status`
+FAKE_CHIFRA_FINALIZED: last block of the finalized index reported by `chifra status`
+FAKE_CHIFRA_CALLS: if set, each transaction of `chifra traces` also makes a call (trace [0]) to 0x33..33
+"""
+import os
+import sys
+import json
+import time
+import stat
+
+
+def install(dirpath):
+    """Write a `chifra` executable running this script into dirpath and return its path"""
+
+    fpath = os.path.join(dirpath, 'chifra')
+    with open(fpath, 'w') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.abspath(__file__)}" "$@"\n')
+    os.chmod(fpath, os.stat(fpath).st_mode | stat.S_IEXEC)
+
+    return fpath
+
+
+OPTIONS = ['--fmt', '--first_block', '--last_block']
+
+
+def main(args):
+    function = args[0]
+    values = []
+    options = {}
+    rest = iter(args[1:])
+    for arg in rest:
+        if arg in OPTIONS:
+            options[arg] = next(rest)
+        elif not arg.startswith('-'):
+            values.append(arg)
+    if os.getenv('FAKE_CHIFRA_LOG') and function != 'status':
+        with open(os.getenv('FAKE_CHIFRA_LOG'), 'a') as f:
+            f.write(" ".join(values) + "\n")
+    time.sleep(float(os.getenv('FAKE_CHIFRA_DELAY', 0)))
+    if len(values) > int(os.getenv('FAKE_CHIFRA_MAX_VALUES', 1 << 30)):
+        sys.exit(1)
+
+    if function == 'status':
+        status = {'trueblocksVersion': os.getenv('FAKE_CHIFRA_VERSION', 'GHC-TrueBlocks//0.0.0-fake'), 'clientVersion': 'fake'}
+        meta = {'finalized': int(os.getenv('FAKE_CHIFRA_FINALIZED', 1 << 30)), 'chain': 'mainnet'}
+        print(json.dumps({'data': [status], 'meta': meta}, indent=2))
+    elif function == 'list':
+        print("address\tblockNumber\ttransactionIndex")
+        for value in values:
+            for i in range(3):
+                if 100 + i >= int(options.get('--first_block', 0)):
+                    print(f"{value}\t{100 + i}\t{i}")
+    else:
+        data = []
+        for v in values:
+            record = {'blockNumber': int(v.split('.')[0]), 'transactionIndex': int(v.split('.')[1]), 'function': function,
+                      'from': '0x' + '1' * 40, 'to': '0x' + '2' * 40, 'value': 0}
+            if function == 'traces':
+                # The originating call of the transaction
+                record['traceAddress'] = []
+                record['action'] = {'callType': 'call', 'from': record['from'], 'to': record['to'], 'value': 0}
+                if os.getenv('FAKE_CHIFRA_CALLS'):
+                    # ... and one call it makes
+                    data.append(record)
+                    record = {**record, 'traceAddress': [0], 'compressedTrace': 'f()',
+                              'action': {'callType': 'call', 'from': record['to'], 'to': '0x' + '3' * 40, 'value': 0}}
+            data.append(record)
+        print(json.dumps({'data': data}, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,48 @@
+"""Stand-in for an Ethereum JSON-RPC endpoint: answers eth_getBlockByNumber
+(single or batched) with timestamp_of(block), in a thread of the test process
+"""
+import json
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def timestamp_of(block):
+    return 1600000000 + 12 * block
+
+
+@contextmanager
+def serve():
+    """Run the server for the duration of the block, yielding (url, list of the
+    block numbers of each request)
+    """
+
+    calls = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            requests = payload if isinstance(payload, list) else [payload]
+            calls.append([int(r['params'][0], 16) for r in requests])
+            results = [
+                {'jsonrpc': '2.0', 'id': r['id'], 'result': {'timestamp': hex(timestamp_of(int(r['params'][0], 16)))}}
+                for r in requests
+            ]
+            body = json.dumps(results if isinstance(payload, list) else results[0]).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}", calls
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,66 @@
+from django.db import connection, transaction
+
+from evm_contracts_db.database.etl.address_resolver import AddressResolver
+from evm_contracts_db.database.models.blockchain import BlockchainAddress
+
+
+def _count_queries(fcn, *args):
+    queries = []
+    with connection.execute_wrapper(lambda execute, sql, *a: queries.append(sql) or execute(sql, *a)):
+        result = fcn(*args)
+    return result, len(queries)
+
+
+def test_resolve_batch():
+    addresses = ['0x' + f"{i:040X}" for i in range(50)]
+    resolver = AddressResolver()
+
+    with transaction.atomic():
+        resolved, n = _count_queries(resolver.resolve, addresses + [None])
+        assert n == 2, "Expected one SELECT and one INSERT for the batch"
+        assert set(resolved.keys()) == {a.lower() for a in addresses}
+        assert BlockchainAddress.objects.filter(address__in=resolved.keys()).count() == 50
+
+        # Resolved again within the same transaction without touching the database
+        again, n = _count_queries(resolver.resolve, addresses)
+        assert n == 0
+        assert again == resolved
+
+        transaction.set_rollback(True)
+
+
+def test_rollback_does_not_poison_cache():
+    address = '0x' + 'a' * 40
+    resolver = AddressResolver()
+
+    with transaction.atomic():
+        with transaction.atomic():
+            resolver.resolve_one(address)
+            transaction.set_rollback(True)
+
+        addressId = resolver.resolve_one(address)
+        assert BlockchainAddress.objects.filter(pk=addressId, address=address).exists()
+
+        transaction.set_rollback(True)
+
+
+def test_address_field():
+    address = '0x' + 'AbC' * 13 + 'd'
+    resolver = AddressResolver()
+
+    with transaction.atomic():
+        addressId = resolver.resolve_one(address)
+        assert addressId == resolver.resolve_one(address.lower())
+
+        # Stored as 20 bytes, read back as lowercase hex, looked up by string in any case
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT octet_length(address) FROM blockchain_addresses WHERE id = %s", [addressId])
+            assert cursor.fetchone()[0] == 20
+        assert BlockchainAddress.objects.get(pk=addressId).address == address.lower()
+        assert BlockchainAddress.objects.get(address=address).pk == addressId
+        assert BlockchainAddress.objects.filter(address__in=[address.upper().replace('0X', '0x')]).count() == 1
+
+        # "0x0" is the zero address
+        assert resolver.resolve_one('0x0') == resolver.resolve_one('0x' + '0' * 40)
+
+        transaction.set_rollback(True)
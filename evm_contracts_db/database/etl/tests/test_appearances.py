@@ -0,0 +1,87 @@
+import os
+import numpy as np
+
+from evm_contracts_db.database.etl.appearances import Appearances, UnchainedIndexReader, parse_chifra_list
+from evm_contracts_db.database.etl.trueblocks_extractor import TrueblocksExtractor
+
+
+def test_parse_chifra_list():
+    txt = b"address\tblockNumber\ttransactionIndex\n0xAA\t5\t1\n0xbb\t3\t0\n0xaa\t7\t2\n"
+    csv = b'"address","blockNumber","transactionIndex"\n"0xaa","5","1"\n"0xbb","3","0"\n"0xaa","7","2"\n'
+
+    for output in [txt, csv]:
+        result = parse_chifra_list(output, addresses=['0xaa', '0xbb', '0xcc'])
+        assert result['0xaa'].txids() == ['5.1', '7.2']
+        assert result['0xbb'].blocks.dtype == np.uint32
+        assert len(result['0xcc']) == 0
+
+    assert parse_chifra_list(b"", addresses=['0xaa'])['0xaa'].txids() == []
+
+
+def _write_chunk(indexPath, first, last, appearancesByAddress, withBloom=True):
+    """Write an index chunk (and its bloom) in the format read by UnchainedIndexReader"""
+
+    name = f"{first:09d}-{last:09d}"
+    addresses = sorted(bytes.fromhex(a[2:]) for a in appearancesByAddress)
+    table = b""
+    apps = b""
+    offset = 0
+    for addressBytes in addresses:
+        records = appearancesByAddress['0x' + addressBytes.hex()]
+        table += addressBytes + offset.to_bytes(4, 'little') + len(records).to_bytes(4, 'little')
+        apps += b"".join(b.to_bytes(4, 'little') + i.to_bytes(4, 'little') for b, i in records)
+        offset += len(records)
+    header = (0xdeadbeef).to_bytes(4, 'little') + bytes(32) + len(addresses).to_bytes(4, 'little') + offset.to_bytes(4, 'little')
+    os.makedirs(os.path.join(indexPath, 'finalized'), exist_ok=True)
+    with open(os.path.join(indexPath, 'finalized', f"{name}.bin"), 'wb') as f:
+        f.write(header + table + apps)
+
+    if withBloom:
+        bits = bytearray(UnchainedIndexReader.BLOOM_WIDTH_IN_BYTES)
+        for addressBytes in addresses:
+            for b in UnchainedIndexReader.bloom_bits(addressBytes):
+                bits[len(bits) - b // 8 - 1] |= 1 << (b % 8)
+        os.makedirs(os.path.join(indexPath, 'blooms'), exist_ok=True)
+        with open(os.path.join(indexPath, 'blooms', f"{name}.bloom"), 'wb') as f:
+            f.write((0xdead).to_bytes(2, 'little') + bytes(32) + (1).to_bytes(4, 'little'))
+            f.write(len(addresses).to_bytes(4, 'little') + bytes(bits))
+
+
+def test_unchained_index_reader(tmp_path, monkeypatch):
+    a, b, c = '0x' + '11' * 20, '0x' + 'ab' * 19 + '00', '0x' + 'cd' * 20
+    _write_chunk(tmp_path, 0, 99, {a: [(10, 0), (50, 3)], b: [(20, 1)]})
+    _write_chunk(tmp_path, 100, 199, {a: [(150, 2)], c: [(120, 0), (199, 5)]}, withBloom=False)
+    _write_chunk(tmp_path, 200, 299, {c: [(250, 1)]})
+
+    reader = UnchainedIndexReader(str(tmp_path))
+    result = reader.get_appearances([a, b.upper().replace('0X', '0x'), c])
+    assert result[a].txids() == ['10.0', '50.3', '150.2']
+    assert result[b].txids() == ['20.1']
+    assert result[c].txids() == ['120.0', '199.5', '250.1']
+
+    # Block range restriction, within and across chunks
+    assert reader.get_appearances([a, c], firstBlock=40, lastBlock=199)[a].txids() == ['50.3', '150.2']
+    assert [name for _, _, name in reader.chunks(firstBlock=150)] == ['000000100-000000199', '000000200-000000299']
+
+    # Chunks whose bloom filter rules the address out are not read
+    read = []
+    readChunk = reader._read_chunk
+    monkeypatch.setattr(reader, '_read_chunk', lambda name, candidates: read.append(name) or readChunk(name, candidates))
+    assert reader.get_appearances([c])[c].txids() == ['120.0', '199.5', '250.1']
+    assert read == ['000000100-000000199', '000000200-000000299']
+
+
+def test_appearances_sorted():
+    appearances = Appearances([5, 3, 5, 3], [1, 0, 1, 2]).sorted()
+    assert appearances.txids() == ['3.0', '3.2', '5.1']
+
+
+def test_get_appearances_one_call(fake_chifra, monkeypatch, tmp_path):
+    log = tmp_path / 'calls.log'
+    monkeypatch.setenv('FAKE_CHIFRA_LOG', str(log))
+    addresses = [f"0x{i:040x}" for i in range(50)]
+
+    result = TrueblocksExtractor().get_appearances(addresses, firstBlock=101)
+
+    assert len(log.read_text().splitlines()) == 1
+    assert all(result[a].txids() == ['101.1', '102.2'] for a in addresses)
@@ -0,0 +1,156 @@
+import json
+from eth_abi import encode
+from eth_utils.abi import function_abi_to_4byte_selector
+
+from evm_contracts_db.database.etl.articulator import AbiStore, Articulator, format_value, word_format
+from evm_contracts_db.database.etl.trueblocks import TrueblocksHandler
+from evm_contracts_db.database.etl.trueblocks_transformer import TrueblocksTransformer
+from utils.blockchain import event_topic, unpack_compressed_call
+
+
+def _param(name, abiType, **kwargs):
+    return {'name': name, 'type': abiType, **kwargs}
+
+
+SUMMON = {'type': 'function', 'name': 'summonMoloch', 'inputs': [
+    _param('_summoner', 'address[]'), _param('_periodDuration', 'uint256'), _param('_summonerShares', 'uint256[]'),
+], 'outputs': [_param('', 'address')]}
+INIT = {'type': 'function', 'name': 'init', 'inputs': [_param('', 'bool'), _param('salt', 'bytes32')], 'outputs': []}
+SUMMON_COMPLETE = {'type': 'event', 'name': 'SummonComplete', 'inputs': [
+    _param('summoner', 'address', indexed=True), _param('details', 'string', indexed=True), _param('shares', 'uint256'),
+]}
+# The ERC-20 and ERC-721 Transfer events share a topic0
+TRANSFER_20 = {'type': 'event', 'name': 'Transfer', 'inputs': [
+    _param('from', 'address', indexed=True), _param('to', 'address', indexed=True), _param('value', 'uint256'),
+]}
+TRANSFER_721 = {'type': 'event', 'name': 'Transfer', 'inputs': [
+    _param('from', 'address', indexed=True), _param('to', 'address', indexed=True), _param('tokenId', 'uint256', indexed=True),
+]}
+ABI = [SUMMON, INIT, SUMMON_COMPLETE, TRANSFER_20, TRANSFER_721]
+
+
+def _address(i):
+    return '0x' + f"{i:040x}"
+
+
+def _word(value):
+    return '0x' + encode(['uint256'], [value]).hex()
+
+
+def _calldata(entry, values):
+    types = [p['type'] for p in entry['inputs']]
+    return '0x' + (function_abi_to_4byte_selector(entry) + encode(types, values)).hex()
+
+
+def _summon_trace(i, **kwargs):
+    return {
+        'blockNumber': 100 + i, 'transactionIndex': 0, 'traceAddress': [],
+        'action': {'callType': 'call', 'from': _address(i), 'to': _address(99), 'value': 0,
+                   'input': _calldata(SUMMON, [[_address(i), _address(i + 1)], 17280, [1, i]])},
+        'result': {'output': _word(1000 + i)},
+        **kwargs
+    }
+
+
+def test_abi_store(tmp_path):
+    (tmp_path / 'moloch.json').write_text(json.dumps({'abi': [SUMMON, SUMMON_COMPLETE]}))
+    (tmp_path / 'tokens.json').write_text(json.dumps({'result': json.dumps([TRANSFER_20, TRANSFER_721])}))
+    (tmp_path / 'broken.json').write_text('not json')
+    store = AbiStore([tmp_path])
+
+    assert store.function(function_abi_to_4byte_selector(SUMMON)).name == 'summonMoloch'
+    assert store.function(function_abi_to_4byte_selector(INIT)) is None
+    topic0 = bytes.fromhex(event_topic('Transfer(address,address,uint256)')[2:])
+    assert store.event(topic0, 2).entry == TRANSFER_20 and store.event(topic0, 3).entry == TRANSFER_721
+    assert store.event(topic0, 1) is None
+
+
+def test_format_value():
+    assert format_value(_param('a', 'address'), '0xAbC' + '0' * 37) == '0xabc' + '0' * 37
+    assert format_value(_param('b', 'bool'), True) == 'true'
+    assert format_value(_param('c', 'bytes4'), b'\x01\x02\x03\x04') == '0x01020304'
+    assert format_value(_param('d', 'uint256[2][]'), [(1, 2), (3, 4)]) == '[["1","2"],["3","4"]]'
+    tupleParam = _param('e', 'tuple', components=[_param('x', 'int8'), _param('', 'address')])
+    assert format_value(tupleParam, (-1, _address(1))) == json.dumps({'x': '-1', 'val_1': _address(1)}, separators=(',', ':'))
+
+    # Static elementary types are formatted straight from their word, as eth_abi decodes them
+    for abiType, value in [('int8', -1), ('uint256', 2**255), ('address', _address(3)), ('bool', False), ('bytes4', b'\xff' * 4)]:
+        assert word_format(abiType)(encode([abiType], [value])) == format_value(_param('', abiType), value)
+    assert word_format('string') is None and word_format('uint8[2]') is None
+
+
+def test_transform_articulated_traces():
+    store = AbiStore()
+    store.add(ABI)
+    tbt = TrueblocksTransformer(articulator=Articulator(store))
+
+    traces = [_summon_trace(i) for i in range(3)]
+    init = _calldata(INIT, [True, b'\x01' * 32])
+    traces[0]['action']['input'] = init
+    # A proxy forwarding the call to its implementation, and calls that cannot be articulated
+    traces += [
+        {**_summon_trace(1, traceAddress=[0]), 'action': {'callType': 'call', 'from': _address(99), 'to': _address(5), 'input': init}},
+        {**_summon_trace(1, traceAddress=[0, 0]), 'action': {'callType': 'delegatecall', 'from': _address(5), 'to': _address(6), 'input': init}},
+        {**_summon_trace(1, traceAddress=[1]), 'action': {'callType': 'call', 'from': _address(99), 'to': _address(7), 'input': '0xdeadbeef'}},
+        {**_summon_trace(1, traceAddress=[2]), 'action': {'callType': 'call', 'from': _address(99), 'to': _address(8), 'input': init[:20]}},
+    ]
+    # Articulated by chifra already
+    traces.append(_summon_trace(3, articulatedTrace={'name': 'summonMoloch', 'inputs': {'_summoner': 'chifra'}}))
+
+    parsed = tbt.transform_chifra_trace_result({'data': traces})
+    assert [t['call_name'] for t in parsed] == ['init', 'summonMoloch', 'summonMoloch', 'summonMoloch']
+    assert parsed[0]['call_inputs'] == {'val_0': 'true', 'salt': '0x' + '01' * 32}
+    assert parsed[0]['call_outputs'] is None
+    assert parsed[1]['call_inputs'] == {
+        '_summoner': json.dumps([_address(1), _address(2)]).replace(' ', ''), '_periodDuration': '17280', '_summonerShares': '["1","1"]'
+    }
+    assert parsed[1]['call_outputs'] == {'val_0': _address(1001)}
+    assert parsed[3]['call_inputs'] == {'_summoner': 'chifra'}
+
+    calls = parsed[1]['traces']
+    assert [(c['call_name'], c['delegate']) for c in calls] == [('init', _address(6)), (None, None), (None, None)]
+    assert unpack_compressed_call(calls[0]['compressed_trace']) == {'name': 'init', 'input': calls[0]['call_inputs']}
+
+    # Streamed in batches, as by the pipeline
+    tbt.articulator.BATCH_SIZE = 2
+    streamed = list(tbt.iter_chifra_trace_records(iter([_summon_trace(i) for i in range(3)])))
+    assert [t['call_inputs']['_summonerShares'] for t in streamed] == ['["1","0"]', '["1","1"]', '["1","2"]']
+
+
+def test_transform_articulated_transactions():
+    store = AbiStore()
+    store.add(ABI)
+    tbt = TrueblocksTransformer(articulator=Articulator(store))
+
+    transfer = event_topic('Transfer(address,address,uint256)')
+    logs = [
+        {'logIndex': 0, 'address': _address(50), 'topics': [event_topic('SummonComplete(address,string,uint256)'), _word(7), _word(123)],
+         'data': _word(5)},
+        {'logIndex': 1, 'address': _address(51), 'topics': [transfer, _word(1), _word(2)], 'data': _word(10)},
+        {'logIndex': 2, 'address': _address(52), 'topics': [transfer, _word(1), _word(2), _word(3)], 'data': '0x'},
+        {'logIndex': 3, 'address': _address(53), 'topics': [_word(0)], 'data': '0x'},
+    ]
+    tx = {
+        'blockNumber': 100, 'transactionIndex': 1, 'hash': '0x1', 'from': _address(1), 'to': _address(99), 'value': 0,
+        'input': _calldata(SUMMON, [[_address(1)], 1, [1]]), 'receipt': {'logs': logs},
+    }
+
+    [parsed] = tbt.transform_chifra_transaction_result({'data': [tx]})
+    assert parsed['call_name'] == 'summonMoloch' and parsed['call_inputs']['_summoner'] == f'["{_address(1)}"]'
+    assert [(l['event'], l['event_inputs']) for l in parsed['logs']] == [
+        ('SummonComplete', {'summoner': _address(7), 'details': _word(123), 'shares': '5'}),
+        ('Transfer', {'from': _address(1), 'to': _address(2), 'value': '10'}),
+        ('Transfer', {'from': _address(1), 'to': _address(2), 'tokenId': '3'}),
+        (None, None),
+    ]
+    assert unpack_compressed_call(parsed['logs'][1]['compressed_log'])['input'] == parsed['logs'][1]['event_inputs']
+    assert _address(7) in parsed['addresses_involved']
+
+
+def test_handler_articulates_in_process(tmp_path):
+    (tmp_path / 'abi.json').write_text(json.dumps(ABI))
+
+    assert TrueblocksHandler(saveDir=tmp_path).chifra_query('traces', ['1.0'])['args'] == ['articulate']
+    tb = TrueblocksHandler(saveDir=tmp_path, abiPaths=[tmp_path / 'abi.json'])
+    assert tb.chifra_query('traces', ['1.0'])['args'] == []
+    assert tb.transformer.articulator is tb.articulator and len(tb.articulator.store.functions) == 2
@@ -0,0 +1,30 @@
+from evm_contracts_db.database.etl.batch_planner import BatchPlanner
+from evm_contracts_db.database.etl.dedupe import TxIdDeduplicator
+
+
+def test_plan_unions_and_skips_in_flight():
+    planner = BatchPlanner(TxIdDeduplicator())
+    txIdsByAddress = {
+        '0xa': ['900000010.1', '900000002.0', '900000010.0'],
+        '0xb': ['900000002.0', '900000020.0'],
+    }
+
+    with planner.plan(txIdsByAddress, 'traces') as plan:
+        assert plan.txIds == ['900000002.0', '900000010.0', '900000010.1', '900000020.0']
+        assert plan.listed == 5
+
+        # A concurrent batch leaves out the ids in flight, and does not count
+        # them as loaded when attributing sync marks
+        with planner.plan({'0xb': ['900000002.0', '900000020.0'], '0xc': ['900000030.0']}, 'traces') as other:
+            assert other.txIds == ['900000030.0']
+            assert other.synced_blocks([]) == {'0xb': 900000001, '0xc': 900000030}
+
+        # Ids in flight for traces are still extracted for transactions
+        with planner.plan({'0xb': ['900000002.0', '900000020.0']}, 'transactions') as other:
+            assert other.txIds == ['900000002.0', '900000020.0']
+            assert other.synced_blocks([]) == {'0xb': 900000020}
+
+        assert plan.synced_blocks(['900000010.1']) == {'0xa': 900000009, '0xb': 900000020}
+
+    with planner.plan({'0xb': ['900000020.0']}, 'traces') as plan:
+        assert plan.txIds == ['900000020.0']
@@ -0,0 +1,68 @@
+import copy
+from django.core.management import call_command
+from django.db import connection, transaction
+
+from evm_contracts_db.database.etl.block_timestamps import BlockTimestamps, to_datetime
+from evm_contracts_db.database.etl.trueblocks_loader import TrueblocksLoader
+from evm_contracts_db.database.etl.tests.fake_rpc import timestamp_of
+from evm_contracts_db.database.etl.tests.test_trueblocks_loader import _sample_transactions
+from evm_contracts_db.database.models.blockchain import Block, BlockchainTransaction
+
+
+def _count_queries(fcn, *args):
+    queries = []
+    with connection.execute_wrapper(lambda execute, sql, *a: queries.append(sql) or execute(sql, *a)):
+        result = fcn(*args)
+    return result, len(queries)
+
+
+def test_loader_stores_block_timestamps():
+    dataDicts = _sample_transactions()
+    for d in dataDicts[:3]:
+        d['timestamp'] = timestamp_of(d['block_number'])
+
+    for bulk in [False, True]:
+        with transaction.atomic():
+            TrueblocksLoader().insert_transactions(copy.deepcopy(dataDicts), bulk=bulk)
+            assert sorted(Block.objects.values_list('number', 'timestamp')) == [
+                (b, to_datetime(timestamp_of(b))) for b in [100, 101, 102]
+            ]
+
+            # One join; blocks without a timestamp are kept, with None
+            txns, n = _count_queries(lambda: list(BlockchainTransaction.objects.with_timestamps().order_by('tx_key')))
+            assert n == 1
+            assert [t.block_timestamp for t in txns] == [to_datetime(timestamp_of(b)) for b in [100, 101, 102]] + [None, None]
+            _, n = _count_queries(lambda: [t.timestamp for t in txns[:3]])
+            assert n == 0
+            transaction.set_rollback(True)
+
+
+def test_backfill_block_timestamps(fake_rpc):
+    url, calls = fake_rpc
+    BlockTimestamps.clear_cache()
+
+    with transaction.atomic():
+        TrueblocksLoader().insert_transactions(_sample_transactions(), bulk=True)
+        BlockTimestamps.store({100: timestamp_of(100)})
+
+        # Only the blocks missing from the table are requested, in batches
+        call_command('backfill_block_timestamps', rpc=url, batch_size=3, last_block=103)
+        assert calls == [[101, 102, 103]]
+        assert Block.objects.count() == 4
+        call_command('backfill_block_timestamps', batch_size=3)
+        assert calls[1:] == [[104]]
+
+        # Then from the LRU, without querying the table again
+        blocks = BlockTimestamps()
+        timestamps, n = _count_queries(blocks.get_many, [100, 101, 102, 103, 104])
+        assert timestamps == {b: to_datetime(timestamp_of(b)) for b in [100, 101, 102, 103, 104]}
+        assert n == 1
+        _, n = _count_queries(blocks.get_many, [100, 104])
+        assert n == 0
+
+        # Blocks of no transaction are fetched (and stored) on demand
+        assert BlockchainTransaction(block_number=200).timestamp == to_datetime(timestamp_of(200))
+        assert calls[2:] == [[200]]
+        assert Block.objects.filter(number=200).exists()
+        transaction.set_rollback(True)
+    BlockTimestamps.clear_cache()
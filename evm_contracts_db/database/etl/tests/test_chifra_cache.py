@@ -0,0 +1,117 @@
+import asyncio
+
+from evm_contracts_db.database.etl.chifra_cache import ChifraCache
+from evm_contracts_db.database.etl.trueblocks_extractor import TrueblocksExtractor
+from evm_contracts_db.database.etl.chunking import AdaptiveChunker
+
+
+def _chifra_calls(fpath):
+    if not fpath.exists():
+        return []
+    return [line.split() for line in fpath.read_text().splitlines()]
+
+
+def _txids(result):
+    return [f"{r['blockNumber']}.{r['transactionIndex']}" for r in result['data']]
+
+
+def test_cache_skips_cached_txids(fake_chifra, monkeypatch, tmp_path):
+    log = tmp_path / 'calls.log'
+    monkeypatch.setenv('FAKE_CHIFRA_LOG', str(log))
+    cache = ChifraCache(str(tmp_path / 'cache'))
+    tbe = TrueblocksExtractor(cache=cache)
+    query = {'function': 'traces', 'format': 'json', 'args': ['articulate']}
+
+    txIds = [f"{100 + i}.{i}" for i in range(10)]
+    first = tbe.run_chifra_chunked({**query, 'value': txIds}, chunker=AdaptiveChunker(initialSize=4, maxSize=4))
+    assert _txids(first) == txIds
+    assert len(_chifra_calls(log)) == 3
+
+    # Re-run with an overlapping set of ids: only the new ones go to chifra
+    log.unlink()
+    overlap = txIds[5:] + [f"{100 + i}.{i}" for i in range(10, 13)]
+    second = tbe.run_chifra_chunked({**query, 'value': overlap}, chunker=AdaptiveChunker(initialSize=20))
+    assert _txids(second) == overlap
+    assert second['data'][:5] == first['data'][5:]
+    assert _chifra_calls(log) == [overlap[5:]]
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (5, 13)
+    assert stats['entries'] == 4
+
+    # A different command (here, without --articulate) does not share entries
+    log.unlink()
+    tbe.run_chifra_chunked({**query, 'args': [], 'value': txIds[:2]})
+    assert _chifra_calls(log) == [txIds[:2]]
+
+
+class LoopCheckingCache(ChifraCache):
+    """Record whether each get and put ran on the event loop's thread"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.onLoop = []
+
+    def _check(self):
+        try:
+            asyncio.get_running_loop()
+            self.onLoop.append(True)
+        except RuntimeError:
+            self.onLoop.append(False)
+
+    def get(self, *args):
+        self._check()
+        return super().get(*args)
+
+    def put(self, *args):
+        self._check()
+        return super().put(*args)
+
+
+def test_cache_off_event_loop(fake_chifra, tmp_path):
+    cache = LoopCheckingCache(str(tmp_path / 'cache'))
+    tbe = TrueblocksExtractor(cache=cache)
+    query = {'function': 'traces', 'format': 'json', 'value': [f"{100 + i}.{i}" for i in range(4)]}
+
+    tbe.run_chifra_chunked(query, chunker=AdaptiveChunker(initialSize=2, maxSize=2))
+    assert cache.onLoop == [False] * 4
+
+
+def test_cache_eviction(tmp_path):
+    cache = ChifraCache(str(tmp_path), maxBytes=1000)
+    query = {'function': 'traces', 'format': 'json'}
+
+    for i in range(10):
+        txId = f"{100 + i}.0"
+        records = [{'blockNumber': 100 + i, 'transactionIndex': 0, 'padding': 'x' * 200}]
+        assert cache.put(query, [txId], records) == {txId: records}
+
+    stats = cache.stats()
+    assert stats['bytes'] <= 1000
+    assert 0 < stats['entries'] < 10
+
+    # Least recently used entries are evicted first
+    found, missing = cache.get(query, ['100.0', '109.0'])
+    assert missing == ['100.0']
+    assert found['109.0'][0]['blockNumber'] == 109
+
+
+def test_cache_rejects_unmatched_records(tmp_path):
+    cache = ChifraCache(str(tmp_path))
+    query = {'function': 'traces', 'format': 'json'}
+
+    # e.g., values given as transaction hashes
+    assert cache.put(query, ['0xabc'], [{'blockNumber': 1, 'transactionIndex': 0}]) is None
+    assert cache.get(query, ['0xabc']) == ({}, ['0xabc'])
+
+
+def test_cache_skips_unfinalized_blocks(tmp_path):
+    cache = ChifraCache(str(tmp_path), lastBlock=101)
+    query = {'function': 'traces', 'format': 'json'}
+    records = [{'blockNumber': 100 + i, 'transactionIndex': 0} for i in range(3)]
+
+    # Every record is returned, but those past the finalized index are not stored
+    assert cache.put(query, ['100.0', '101.0', '102.0'], records) == {f"{100 + i}.0": [r] for i, r in enumerate(records)}
+    assert cache.get(query, ['100.0', '101.0', '102.0'])[1] == ['102.0']
+    assert cache.put(query, ['102.0'], records[2:]) == {'102.0': records[2:]}
+    assert cache.stats()['entries'] == 1
@@ -0,0 +1,57 @@
+import copy
+from django.core.management import call_command
+from django.db import connection, transaction
+
+from evm_contracts_db.database.etl.trueblocks_loader import TrueblocksLoader
+from evm_contracts_db.database.etl.tests.test_trueblocks_loader import _sample_transactions
+from evm_contracts_db.database.models.blockchain import BlockchainTransactionLog, BlockchainTransactionTrace
+from utils.blockchain import unpack_compressed_call
+
+
+def test_unpack_compressed_call():
+    assert unpack_compressed_call("SummonComplete(0xab /*summoner*/, 1 /*shares*/);") == {
+        'name': 'SummonComplete', 'input': {'summoner': '0xab', 'shares': '1'}
+    }
+    # Commas inside values, unnamed parameters, no parameters
+    assert unpack_compressed_call('f([1, 2] /*ids*/, "a, b" /*s*/, 3)')['input'] == {'ids': '[1, 2]', 's': '"a, b"', '2': '3'}
+    assert unpack_compressed_call("init()") == {'name': 'init', 'input': {}}
+
+
+def test_loader_stores_decoded_calls():
+    dataDicts = _sample_transactions()
+    # Articulated inputs are stored as given; the others are unpacked from the compressed text
+    dataDicts[0]['logs'][0]['event_inputs'] = {'summoner': dataDicts[0]['from_address'], 'shares': 0}
+    dataDicts[0]['traces'][0].update(call_name='init', call_inputs={'x': 1})
+    summoner = dataDicts[2]['from_address']
+
+    for bulk in [False, True]:
+        with transaction.atomic():
+            TrueblocksLoader().insert_transactions(copy.deepcopy(dataDicts), includeTraces=True, bulk=bulk)
+            logs = BlockchainTransactionLog.objects.filter(event='SummonComplete', event_inputs__contains={'summoner': summoner})
+            assert sorted((l.log_index, l.event_inputs['shares']) for l in logs) == [(0, '0'), (1, '1')]
+            assert BlockchainTransactionLog.objects.filter(event_inputs__contains={'shares': 0}).count() == 1
+            traces = BlockchainTransactionTrace.objects.order_by('originating_from_id')
+            assert list(traces.values_list('call_name', 'call_inputs')) == [('init', {'x': 1})] + [('init', {'0': '\\t'})] * 4
+            assert logs[0].log_dict == {'name': 'SummonComplete', 'input': logs[0].event_inputs}
+
+            # Containment is answered from the GIN index
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            assert 'log_event_inputs' in BlockchainTransactionLog.objects.filter(event_inputs__contains={'summoner': summoner}).explain()
+            transaction.set_rollback(True)
+
+
+def test_backfill_decoded_calls():
+    with transaction.atomic():
+        TrueblocksLoader().insert_transactions(_sample_transactions(), includeTraces=True, bulk=True)
+        # As loaded before the decoded columns existed
+        BlockchainTransactionLog.objects.update(event=None, event_inputs=None)
+        BlockchainTransactionTrace.objects.update(call_inputs=None)
+        BlockchainTransactionLog.objects.filter(log_index=1).update(compressed_log='not a call')
+
+        call_command('backfill_decoded_calls', batch_size=2)
+        assert list(BlockchainTransactionLog.objects.order_by('originating_from_id', 'log_index').values_list('event', 'event_inputs')) == [
+            row for i in range(5) for row in [('SummonComplete', {'summoner': '0x' + f"{i:040x}", 'shares': '0'}), (None, None)]
+        ]
+        assert not BlockchainTransactionTrace.objects.filter(call_inputs__isnull=True).exists()
+        transaction.set_rollback(True)
@@ -0,0 +1,51 @@
+from django.db import connection, transaction
+
+from evm_contracts_db.database.etl.dedupe import BloomFilter, TxIdDeduplicator
+from evm_contracts_db.database.etl.partitions import BlockPartitions
+from evm_contracts_db.database.models.blockchain import BlockchainTransaction
+from utils.blockchain import pack_txid
+
+
+def _count_queries(fcn, *args):
+    queries = []
+    with connection.execute_wrapper(lambda execute, sql, *a: queries.append(sql) or execute(sql, *a)):
+        result = fcn(*args)
+    return result, len(queries)
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=10000, errorRate=0.01)
+    items = [f"{i}.{i % 7}" for i in range(10000)]
+    bloom.update(items)
+
+    assert all(i in bloom for i in items)
+    falsePositives = sum(f"{i}.{i % 7}" in bloom for i in range(10000, 20000))
+    assert falsePositives < 300
+
+
+def test_missing_txids():
+    loadedIds = [f"{900000000 + i}.0" for i in range(0, 100, 2)]
+    txIds = [f"{900000000 + i}.0" for i in range(100)]
+
+    with transaction.atomic():
+        BlockPartitions().ensure(int(t.split('.')[0]) for t in loadedIds)
+        BlockchainTransaction.objects.bulk_create(
+            [BlockchainTransaction(tx_key=pack_txid(t), block_number=int(t.split('.')[0]), value=0) for t in loadedIds]
+        )
+
+        dedupe = TxIdDeduplicator()
+        missing, n = _count_queries(dedupe.missing, txIds)
+        assert missing == [t for t in txIds if t not in loadedIds]
+        assert n <= 6, "Expected a constant number of queries"
+
+        # With a Bloom filter, ids it does not contain are not checked in the database
+        dedupe = TxIdDeduplicator(bloom=True)
+        dedupe.load_bloom()
+        newIds = [f"{910000000 + i}.0" for i in range(100)]
+        missing, n = _count_queries(dedupe.missing, newIds)
+        assert missing == newIds
+        assert n == 0
+
+        assert dedupe.missing(txIds) == [t for t in txIds if t not in loadedIds]
+
+        transaction.set_rollback(True)
@@ -0,0 +1,83 @@
+import pytest
+from django.db import transaction
+from django.test import TestCase
+
+from evm_contracts_db.database.etl.trueblocks import TrueblocksHandler
+from evm_contracts_db.database.models.blockchain import BlockchainAddress, BlockchainTransaction
+from evm_contracts_db.database.models.etl import EtlJob, EtlJobChunk
+from utils.blockchain import pack_txid
+
+
+def test_resume_job(fake_chifra, monkeypatch, tmp_path):
+    log = tmp_path / 'calls.log'
+    monkeypatch.setenv('FAKE_CHIFRA_LOG', str(log))
+    tb = TrueblocksHandler(saveDir=str(tmp_path), bulk=True)
+
+    with transaction.atomic():
+        addressObjs = [BlockchainAddress.objects.create(address='0x' + f"{i:040x}") for i in range(0xc0, 0xc2)]
+        job = tb.create_job(addressObjs, function='traces', since_block=False, chunkSize=1)
+        assert [c.tx_ids for c in job.chunks.all()] == [['100.0'], ['101.1'], ['102.2']]
+
+        # Crash while loading the second chunk
+        insert = tb.insert_transactions
+        def crash(dataDicts, **kwargs):
+            if dataDicts[0]['transaction_id'] == '101.1':
+                raise RuntimeError("crash")
+            insert(dataDicts, **kwargs)
+        monkeypatch.setattr(tb, 'insert_transactions', crash)
+        with pytest.raises(RuntimeError):
+            tb.run_job(job)
+
+        job.refresh_from_db()
+        assert job.status == EtlJob.Status.FAILED
+        assert [c.status for c in job.chunks.all()] == [
+            EtlJobChunk.Status.LOADED, EtlJobChunk.Status.TRANSFORMED, EtlJobChunk.Status.PENDING
+        ]
+        assert BlockchainTransaction.objects.filter(tx_key__in=[pack_txid(t) for t in ['100.0', '101.1']]).count() == 1
+
+        # A new run (e.g., resume_etl_jobs) reuses the cached extraction of the second chunk
+        log.unlink()
+        tb = TrueblocksHandler(saveDir=str(tmp_path), bulk=True)
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            tb.run_job(EtlJob.objects.get(pk=job.pk))
+        assert log.read_text().splitlines() == ['102.2']
+
+        job.refresh_from_db()
+        assert job.status == EtlJob.Status.DONE
+        assert all(c.status == EtlJobChunk.Status.LOADED for c in job.chunks.all())
+        assert BlockchainTransaction.objects.filter(tx_key__in=[pack_txid(t) for t in ['100.0', '101.1', '102.2']]).count() == 3
+        for addressObj in addressObjs:
+            addressObj.refresh_from_db()
+            assert addressObj.last_synced_traces_block == 102
+            assert addressObj.last_synced_transactions_block is None
+
+        transaction.set_rollback(True)
+
+
+def test_claim_job(fake_chifra, monkeypatch, tmp_path):
+    log = tmp_path / 'calls.log'
+    monkeypatch.setenv('FAKE_CHIFRA_LOG', str(log))
+    tb = TrueblocksHandler(saveDir=str(tmp_path), bulk=True)
+
+    with transaction.atomic():
+        addressObj = BlockchainAddress.objects.create(address='0x' + 'c3' * 20)
+        job = tb.create_job([addressObj], function='transactions', since_block=False)
+        log.unlink()
+
+        # Only one of two concurrent runs claims the job
+        other = EtlJob.objects.get(pk=job.pk)
+        assert tb.claim_job(job)
+        assert not tb.claim_job(other)
+        assert other.status == EtlJob.Status.RUNNING
+
+        # A running job is left alone, unless forced (e.g., resumed by id after a crash)
+        assert tb.run_job(other).status == EtlJob.Status.RUNNING
+        assert not log.exists()
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            assert tb.run_job(other, force=True).status == EtlJob.Status.DONE
+        assert log.read_text().splitlines() == ['100.0 101.1 102.2']
+
+        # A job that is done is never run again
+        assert not tb.claim_job(job, force=True)
+
+        transaction.set_rollback(True)
@@ -0,0 +1,40 @@
+import copy
+import pytest
+from django.db import connection, transaction
+
+from evm_contracts_db.database.etl.trueblocks_loader import TrueblocksLoader
+from evm_contracts_db.database.etl.tests.test_trueblocks_loader import _sample_transactions
+from evm_contracts_db.database.models.blockchain import BlockchainTransactionLog
+from utils.blockchain import event_topic
+
+
+SUMMON = event_topic('SummonComplete(address,uint256)')
+
+
+def test_log_topics():
+    assert event_topic('Transfer(address,address,uint256)') == '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+
+    dataDicts = _sample_transactions()
+    for i, d in enumerate(dataDicts):
+        for l in d['logs']:
+            l['topics'] = [SUMMON, '0x' + f"{i:064x}"]
+    # An anonymous event, and one whose articulation is unknown
+    dataDicts[0]['logs'][1]['topics'] = []
+    dataDicts[1]['logs'][1].update(event=None, compressed_log=None)
+
+    for bulk in [False, True]:
+        with transaction.atomic():
+            TrueblocksLoader().insert_transactions(copy.deepcopy(dataDicts), bulk=bulk)
+            logs = BlockchainTransactionLog.objects.filter(topic0=SUMMON, address__address='0x' + f"{1001:040x}")
+            assert sorted((l.log_index, l.event) for l in logs) == [(0, 'SummonComplete'), (1, None)]
+            assert logs[0].topics == [SUMMON, '0x' + f"{1:064x}"]
+            assert BlockchainTransactionLog.objects.filter(topic0=SUMMON).count() == 9
+            assert BlockchainTransactionLog.objects.get(originating_from__block_number=100, log_index=1).topics == []
+
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            assert 'log_topic0_address' in logs.explain()
+            transaction.set_rollback(True)
+
+    with pytest.raises(ValueError):
+        TrueblocksLoader.topic_columns([SUMMON] * 5)
@@ -0,0 +1,67 @@
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection, transaction
+
+from evm_contracts_db.database.etl.partitions import (
+    BlockPartitions, PARTITIONED_TABLES, block_range, is_partitioned, partition_bounds, partition_tables, unpartition_tables
+)
+from evm_contracts_db.database.etl.trueblocks_loader import TrueblocksLoader
+from evm_contracts_db.database.etl.tests.test_trueblocks_loader import _sample_transactions
+from evm_contracts_db.database.models.blockchain import BlockchainTransaction, BlockchainTransactionLog
+
+
+def test_block_range_partitions():
+    dataDicts = _sample_transactions()
+    late = dict(dataDicts[0], transaction_id='250.0', transaction_hash='0x' + 'a' * 64, block_number=250)
+    late['logs'] = [dict(l, address='0x' + 'b' * 40) for l in late['logs']]
+
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            if is_partitioned(cursor, 'blockchain_transactions'):
+                unpartition_tables(cursor)
+            partition_tables(cursor, 100)
+            BlockPartitions.clear_cache()
+
+            # Partitions for blocks 100-104 and 250 are created by the loader
+            TrueblocksLoader().insert_transactions(dataDicts + [late], bulk=True)
+            for table, _ in PARTITIONED_TABLES:
+                assert partition_bounds(cursor, table) == [(0, 100), (100, 200), (200, 300)]
+            assert BlockchainTransaction.objects.count() == 6
+
+            # A block range only scans the partitions holding it
+            logs = BlockchainTransactionLog.objects.filter(BlockchainTransaction.block_range(250, 250, 'originating_from_id'))
+            assert logs.count() == 2
+            plan = logs.explain()
+            assert 'blockchain_logs_p200' in plan and 'blockchain_logs_p100' not in plan
+
+            # Rows are copied back when unpartitioned (after the deferred foreign key checks of the load)
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            unpartition_tables(cursor)
+            assert not is_partitioned(cursor, 'blockchain_transactions')
+            assert BlockchainTransactionLog.objects.count() == 12
+            transaction.set_rollback(True)
+    finally:
+        BlockPartitions.clear_cache()
+
+
+def test_partition_tables_command():
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            call_command('partition_tables', undo=True, stdout=StringIO())
+            TrueblocksLoader().insert_transactions(_sample_transactions(), bulk=True)
+
+            # Rows loaded before are moved into the partitions, and back
+            out = StringIO()
+            call_command('partition_tables', block_range=100, stdout=out)
+            assert out.getvalue().strip() == "Tables partitioned by 100 blocks"
+            assert block_range(cursor) == 100
+            assert partition_bounds(cursor, 'blockchain_logs') == [(0, 100), (100, 200)]
+            assert BlockchainTransactionLog.objects.count() == 10
+
+            call_command('partition_tables', undo=True, stdout=out)
+            assert block_range(cursor) is None
+            assert BlockchainTransaction.objects.count() == 5
+            assert BlockchainTransactionLog.objects.count() == 10
+            transaction.set_rollback(True)
+    finally:
+        BlockPartitions.clear_cache()
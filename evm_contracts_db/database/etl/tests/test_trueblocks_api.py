@@ -0,0 +1,139 @@
+import json
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from evm_contracts_db.database.etl.trueblocks_api import TrueblocksApiExtractor
+from evm_contracts_db.database.etl.chunking import AdaptiveChunker
+
+
+# Recorded `chifra serve` responses
+LIST_RESPONSE = {
+    'data': [
+        {'address': '0x01', 'blockNumber': 100 + i, 'transactionIndex': i}
+        for i in range(5)
+    ],
+    'meta': {'client': 123},
+}
+
+TRACES_RESPONSE = {
+    'data': [
+        {'blockNumber': 100 + i, 'transactionIndex': i, 'traceAddress': [], 'compressedTrace': 'f()'}
+        for i in range(5)
+    ],
+    'meta': {'client': 123},
+}
+
+STATUS_RESPONSE = {
+    'data': [{'trueblocksVersion': 'GHC-TrueBlocks//3.0.0', 'clientVersion': 'erigon/2.60.0'}],
+    'meta': {'client': 123, 'finalized': 101},
+}
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """Replay recorded responses, filtered by the query as chifra serve would"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        self.server.requests.append((url.path, query))
+        self.server.ports.add(self.client_address[1])
+
+        if url.path == '/list':
+            first = int(query.get('firstRecord', 0))
+            data = LIST_RESPONSE['data'][first:first + int(query.get('maxRecords', 1000))]
+            if not self.server.listAddresses:
+                # As for a single address
+                data = [{k: v for k, v in r.items() if k != 'address'} for r in data]
+            body = {**LIST_RESPONSE, 'data': data}
+        elif url.path == '/traces':
+            txIds = query['transactions'].split()
+            data = [r for r in TRACES_RESPONSE['data'] if f"{r['blockNumber']}.{r['transactionIndex']}" in txIds]
+            body = {**TRACES_RESPONSE, 'data': data}
+        elif url.path == '/status':
+            body = STATUS_RESPONSE
+        else:
+            body = {'errors': [f"unknown route {url.path}"]}
+
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def chifra_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ReplayHandler)
+    server.requests = []
+    server.ports = set()
+    server.listAddresses = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_txids_paged(chifra_server):
+    tbe = TrueblocksApiExtractor(baseUrl=f"http://127.0.0.1:{chifra_server.server_port}", maxWorkers=1, pageSize=2)
+
+    assert tbe.get_txids('0x01') == [f"{100 + i}.{i}" for i in range(5)]
+    assert [q['firstRecord'] for _, q in chifra_server.requests] == ['0', '2', '4']
+    assert all(q['addrs'] == '0x01' for _, q in chifra_server.requests)
+    # All pages are requested over one pooled keep-alive connection
+    assert len(chifra_server.ports) == 1
+
+
+def test_appearances_without_address(chifra_server):
+    tbe = TrueblocksApiExtractor(baseUrl=f"http://127.0.0.1:{chifra_server.server_port}", maxWorkers=2)
+    chifra_server.listAddresses = False
+
+    # The appearances cannot be split between the addresses: each is listed on its own
+    appearances = tbe.get_appearances(['0x01', '0x02'])
+    assert sorted(q['addrs'] for _, q in chifra_server.requests) == ['0x01', '0x01 0x02', '0x02']
+    assert [len(appearances[a].txids()) for a in ['0x01', '0x02']] == [5, 5]
+
+
+def test_run_chifra_chunked(chifra_server):
+    tbe = TrueblocksApiExtractor(baseUrl=f"http://127.0.0.1:{chifra_server.server_port}", maxWorkers=2)
+    txIds = [f"{100 + i}.{i}" for i in range(5)]
+    query = {'function': 'traces', 'value': txIds, 'format': 'json', 'args': ['articulate']}
+
+    result = tbe.run_chifra_chunked(query, chunker=AdaptiveChunker(initialSize=2, maxSize=2))
+
+    assert result['failed'] == []
+    assert [f"{r['blockNumber']}.{r['transactionIndex']}" for r in result['data']] == txIds
+    assert len(chifra_server.requests) == 3
+    assert all(q['articulate'] == 'true' for _, q in chifra_server.requests)
+
+
+def test_errors_fail_chunk(chifra_server):
+    tbe = TrueblocksApiExtractor(baseUrl=f"http://127.0.0.1:{chifra_server.server_port}", maxWorkers=1)
+    query = {'function': 'unknown', 'value': ['100.0'], 'format': 'json'}
+
+    result = tbe.run_chifra_chunked(query, maxRetries=0)
+
+    assert result == {'data': [], 'failed': ['100.0']}
+
+
+def test_get_status(chifra_server):
+    tbe = TrueblocksApiExtractor(baseUrl=f"http://127.0.0.1:{chifra_server.server_port}", maxWorkers=1)
+
+    assert tbe.get_status() == STATUS_RESPONSE
+
+
+def test_close(chifra_server):
+    with TrueblocksApiExtractor(baseUrl=f"http://127.0.0.1:{chifra_server.server_port}", maxWorkers=1) as tbe:
+        assert len(tbe.get_txids('0x01')) == 5
+
+    # The request threads are stopped
+    with pytest.raises(RuntimeError):
+        tbe.aio._executor.submit(print)
@@ -0,0 +1,55 @@
+import time
+import asyncio
+import pytest
+
+from evm_contracts_db.database.etl.chunking import AdaptiveChunker
+from evm_contracts_db.database.etl.trueblocks_async import AsyncTrueblocksExtractor
+
+
+def test_get_txids_interleaved(fake_chifra, monkeypatch):
+    monkeypatch.setenv('FAKE_CHIFRA_DELAY', '0.5')
+    addresses = [f"0x{i:02x}" for i in range(20)]
+    tbe = AsyncTrueblocksExtractor()
+
+    async def _run():
+        return await asyncio.gather(*[tbe.get_txids(a) for a in addresses])
+
+    start = time.perf_counter()
+    results = asyncio.run(_run())
+    assert time.perf_counter() - start < 5, "chifra calls did not run concurrently"
+    assert results == [['100.0', '101.1', '102.2']] * len(addresses)
+
+
+def test_timeout_and_cancellation(fake_chifra, monkeypatch):
+    monkeypatch.setenv('FAKE_CHIFRA_DELAY', '30')
+    tbe = AsyncTrueblocksExtractor(timeout=0.5)
+
+    async def _cancel():
+        task = asyncio.ensure_future(tbe.get_txids('0x01', timeout=60))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    async def _stream():
+        cmd = tbe.build_chifra_args({'function': 'traces', 'value': ['1.0'], 'format': 'json'})
+        return [r async for r in tbe.stream_chifra(cmd, fpath=False)]
+
+    start = time.perf_counter()
+    assert asyncio.run(tbe.get_txids('0x01')) is None
+    asyncio.run(_cancel())
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(_stream())
+    assert time.perf_counter() - start < 10, "chifra was not killed"
+
+
+def test_iter_records(fake_chifra):
+    txIds = [f"{100 + i}.{i}" for i in range(30)]
+    tbe = AsyncTrueblocksExtractor(maxWorkers=4)
+
+    async def _run():
+        params = {'function': 'transactions', 'value': txIds, 'format': 'json'}
+        return [r async for r in tbe.iter_records(params, chunker=AdaptiveChunker(initialSize=4))]
+
+    records = asyncio.run(_run())
+    assert [f"{r['blockNumber']}.{r['transactionIndex']}" for r in records] == txIds
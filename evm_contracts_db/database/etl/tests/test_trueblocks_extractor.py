@@ -1,6 +1,8 @@
 import pytest
 
 from evm_contracts_db.database.etl.trueblocks_extractor import TrueblocksExtractor
+from evm_contracts_db.database.etl.chunking import AdaptiveChunker
+from utils.files import JsonArrayStream
 
 
 @pytest.mark.parametrize("query,result", [
@@ -40,3 +42,105 @@ def test_run_chifra_list():
     assert result is not None, "No result returned; error encountered"
     assert isinstance(result, list), f"Expected list, not {type(result)}"
     assert len(result) > 148, f"Fewer results found than expected... what gives?"
+
+
+CHIFRA_OUTPUT = b"""{
+  "data": [
+    {"blockNumber": 1, "transactionIndex": 0, "compressedTrace": "name(a\\x)", "articulatedTrace": {"name": "caf\xc3\xa9"}},
+    {"blockNumber": 1, "transactionIndex": 1, "traceAddress": [0, 1]}
+  ],
+  "meta": {"client": 123, "data": [0]}
+}
+"""
+
+
+def test_json_array_stream_bytewise():
+    stream = JsonArrayStream(key='data')
+    items = []
+    for i in range(len(CHIFRA_OUTPUT)):
+        items.extend(stream.feed(CHIFRA_OUTPUT[i:i + 1]))
+    items.extend(stream.close())
+
+    assert len(items) == 2
+    assert items[0]['compressedTrace'] == 'name(a\\x)'
+    assert items[0]['articulatedTrace']['name'] == 'café'
+    assert items[1]['traceAddress'] == [0, 1]
+
+
+def test_stream_chifra(tmp_path):
+    fpath_in = tmp_path / 'chifra.json'
+    fpath_in.write_bytes(CHIFRA_OUTPUT)
+    fpath_out = tmp_path / 'tee.json'
+
+    tbe = TrueblocksExtractor()
+    items = list(tbe.stream_chifra(f"cat {fpath_in}", fpath=str(fpath_out)))
+
+    assert [i['transactionIndex'] for i in items] == [0, 1]
+    assert fpath_out.read_bytes() == CHIFRA_OUTPUT
+
+
+def test_adaptive_chunker():
+    chunker = AdaptiveChunker(initialSize=10, maxSize=1000, targetSeconds=10, targetBytes=1000, maxChars=20)
+    values = [f"{i}.0" for i in range(100)]
+
+    # Capped by the number of characters before the chunk size
+    assert chunker.next_chunk(values) == ['0.0', '1.0', '2.0', '3.0', '4.0']
+
+    # Fast, small chunks grow at most 2x; slow or large chunks shrink to target
+    chunker.record(10, 0.1, 10)
+    assert chunker.size == 20
+    chunker.record(20, 20, 10)
+    assert chunker.size == 10
+    chunker.record(10, 0.1, 5000)
+    assert chunker.size == 2
+    chunker.shrink()
+    chunker.shrink()
+    assert chunker.size == 1
+
+    # Never grows back to a size that failed
+    chunker.record(1, 0.1, 10)
+    chunker.record(2, 0.1, 10)
+    chunker.shrink(4)
+    for _ in range(5):
+        chunker.record(chunker.size, 0.1, 10)
+    assert chunker.size == 3
+
+
+def test_run_chifra_chunked(fake_chifra, monkeypatch):
+    monkeypatch.setenv('FAKE_CHIFRA_MAX_VALUES', '3')
+    txIds = [f"{100 + i}.{i}" for i in range(20)]
+
+    tbe = TrueblocksExtractor()
+    result = tbe.run_chifra_chunked(
+        {'function': 'traces', 'value': txIds, 'format': 'json'},
+        chunker=AdaptiveChunker(initialSize=8),
+        retryDelay=0
+    )
+
+    assert result['failed'] == []
+    assert [f"{r['blockNumber']}.{r['transactionIndex']}" for r in result['data']] == txIds
+
+
+def test_get_txids_without_shell(fake_chifra):
+    tbe = TrueblocksExtractor()
+    assert tbe.build_chifra_args({'function': 'list', 'value': '0x01', 'format': 'txt'}) == ['chifra', 'list', '--fmt', 'txt', '0x01']
+    assert tbe.get_txids('0x01') == ['100.0', '101.1', '102.2']
+
+
+def test_run_many(fake_chifra, monkeypatch):
+    monkeypatch.setenv('FAKE_CHIFRA_MAX_VALUES', '3')
+    addresses = [f"0x{i:02x}" for i in range(8)]
+    txIds = [f"{100 + i}.{i}" for i in range(40)]
+
+    tbe = TrueblocksExtractor(maxWorkers=4)
+    assert [a for a, _ in tbe.run_many(tbe.get_txids, addresses)] == addresses
+    assert sorted(a for a, _ in tbe.run_many(tbe.get_txids, addresses, ordered=False)) == addresses
+
+    # Chunks run concurrently (and are retried) but are yielded in order
+    chunks = list(tbe.iter_chifra_chunks(
+        {'function': 'traces', 'value': txIds, 'format': 'json'},
+        chunker=AdaptiveChunker(initialSize=5),
+        retryDelay=0
+    ))
+    assert [v for chunk, _ in chunks for v in chunk] == txIds
+    assert [f"{r['blockNumber']}.{r['transactionIndex']}" for _, records in chunks for r in records] == txIds
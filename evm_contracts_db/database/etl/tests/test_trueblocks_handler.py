@@ -1,5 +1,9 @@
+import os
+import json
+import pytest
 from evm_contracts_db.database.etl.trueblocks import TrueblocksHandler
 from evm_contracts_db.database.models.blockchain import BlockchainAddress
+from utils.blockchain import pack_txid
 
 
 def test_add_or_update_address_traces():
@@ -16,3 +20,173 @@ def test_add_or_update_address_transactions():
     dao_address = '0xe9d7e590171cb5080ab8dfd45850692a714260f0' #defi omega
     addressObj = tb.loader.update_or_create_address_record(address=dao_address)
     tb.add_or_update_address_transactions(addressObj)   
+
+
+def test_incremental_sync(fake_chifra, monkeypatch, tmp_path):
+    from django.db import transaction
+    from django.test import TestCase
+
+    log = tmp_path / 'calls.log'
+    monkeypatch.setenv('FAKE_CHIFRA_LOG', str(log))
+    tb = TrueblocksHandler(saveDir=str(tmp_path), cacheDir=False, bulk=True)
+
+    with transaction.atomic():
+        addressObj = BlockchainAddress.objects.create(address='0x' + 'f' * 40)
+
+        # The high-water mark only advances once the load commits
+        with TestCase.captureOnCommitCallbacks() as callbacks:
+            tb.add_or_update_address_transactions(addressObj)
+        addressObj.refresh_from_db()
+        assert addressObj.last_synced_transactions_block is None
+        for callback in callbacks:
+            callback()
+        assert addressObj.last_synced_transactions_block == 102
+        assert BlockchainAddress.objects.get(pk=addressObj.pk).last_synced_transactions_block == 102
+
+        # A refresh only lists appearances from the next block on, and finds none
+        log.unlink()
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            tb.add_or_update_address_transactions(addressObj)
+        assert log.read_text().splitlines() == [addressObj.address]
+        assert addressObj.last_synced_transactions_block == 102
+
+        transaction.set_rollback(True)
+
+
+def test_sync_marks_per_function(fake_chifra, monkeypatch, tmp_path):
+    from django.db import transaction
+    from django.test import TestCase
+
+    tb = TrueblocksHandler(saveDir=str(tmp_path), cacheDir=False, bulk=True)
+    firstBlocks = []
+    get_appearances = tb.extractor.get_appearances
+    def record(addresses, firstBlock=None, **kwargs):
+        firstBlocks.append(firstBlock)
+        return get_appearances(addresses, firstBlock=firstBlock, **kwargs)
+    monkeypatch.setattr(tb.extractor, 'get_appearances', record)
+
+    with transaction.atomic():
+        addressObj = BlockchainAddress.objects.create(address='0x' + 'e' * 40)
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            tb.add_or_update_address_transactions(addressObj)
+        assert (addressObj.last_synced_transactions_block, addressObj.last_synced_traces_block) == (102, None)
+
+        # The traces sync lists the full history, whatever the transactions sync loaded
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            tb.add_or_update_address_traces(addressObj)
+        assert firstBlocks == [None, None]
+        addressObj.refresh_from_db()
+        assert (addressObj.last_synced_transactions_block, addressObj.last_synced_traces_block) == (102, 102)
+
+        # Each then continues from its own mark
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            tb.add_or_update_address_transactions(addressObj)
+            tb.add_or_update_address_traces(addressObj)
+        assert firstBlocks[2:] == [103, 103]
+
+        transaction.set_rollback(True)
+
+
+@pytest.mark.parametrize('path', ['address', 'stream', 'addresses', 'job'])
+@pytest.mark.parametrize('bulk', [False, True])
+def test_traces_loaded(fake_chifra, monkeypatch, tmp_path, path, bulk):
+    from django.db import transaction
+    from django.test import TestCase
+    from evm_contracts_db.database.models.blockchain import BlockchainAddressAppearance, BlockchainTransactionTrace
+
+    from evm_contracts_db.database.etl.address_resolver import AddressResolver
+
+    # Ids resolved by a previous (rolled back) case were promoted by its on-commit callbacks
+    AddressResolver.clear_cache()
+    monkeypatch.setenv('FAKE_CHIFRA_CALLS', '1')
+    tb = TrueblocksHandler(saveDir=str(tmp_path), cacheDir=False, bulk=bulk)
+    txKeys = [pack_txid(t) for t in ['100.0', '101.1', '102.2']]
+
+    with transaction.atomic():
+        addressObj = BlockchainAddress.objects.create(address='0x' + 'b' * 40)
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            if path == 'address':
+                tb.add_or_update_address_traces(addressObj, since_block=False)
+            elif path == 'stream':
+                tb.add_or_update_address_traces(addressObj, since_block=False, stream=True)
+            elif path == 'addresses':
+                tb.add_or_update_addresses_traces([addressObj], since_block=False)
+            else:
+                tb.run_job(tb.create_job([addressObj], function='traces', since_block=False))
+
+        traces = BlockchainTransactionTrace.objects.filter(originating_from__in=txKeys)
+        assert sorted(traces.values_list('originating_from', 'compressed_trace')) == [(k, 'f()') for k in txKeys]
+        called = BlockchainAddress.objects.get(address='0x' + '3' * 40)
+        assert sorted(BlockchainAddressAppearance.objects.filter(address=called).values_list('tx', 'role')) == [
+            (k, BlockchainAddressAppearance.Role.INVOLVED) for k in txKeys
+        ]
+
+        transaction.set_rollback(True)
+
+
+def test_cache_state(fake_chifra, monkeypatch, tmp_path):
+    monkeypatch.setenv('FAKE_CHIFRA_FINALIZED', '101')
+
+    # The cache is only opened by the first chunked query
+    tb = TrueblocksHandler(saveDir=str(tmp_path))
+    assert tb.extractor.cache is None and not (tmp_path / 'tmp' / 'chifra_cache').exists()
+    tb.chifra_query('traces', ['100.0'])
+    cache = tb.extractor.cache
+    assert cache.lastBlock == 101
+    query = {'function': 'traces', 'format': 'json'}
+
+    # Upgrading chifra invalidates the cache
+    monkeypatch.setenv('FAKE_CHIFRA_VERSION', 'GHC-TrueBlocks//9.9.9')
+    upgraded = TrueblocksHandler(saveDir=str(tmp_path)).ensure_cache()
+    assert upgraded.command_key(query) != cache.command_key(query)
+
+    # Without a readable status, nothing is cached
+    os.remove(fake_chifra)
+    monkeypatch.setenv('PATH', str(tmp_path))
+    assert TrueblocksHandler(saveDir=str(tmp_path)).ensure_cache() is None
+
+
+def test_stream_transactions(fake_chifra, tmp_path):
+    from django.db import transaction
+    from evm_contracts_db.database.models.blockchain import BlockchainTransaction
+
+    tb = TrueblocksHandler(saveDir=str(tmp_path), cacheDir=False, bulk=True)
+    tb.BATCH_SIZE = 2
+
+    with transaction.atomic():
+        addressObj = BlockchainAddress.objects.create(address='0x' + 'e' * 40)
+        tb.add_or_update_address_transactions(addressObj, since_block=False, stream=True)
+
+        txns = BlockchainTransaction.objects.filter(tx_key__in=[pack_txid(t) for t in ['100.0', '101.1', '102.2']])
+        assert txns.count() == 3
+        # The output of each chunk is saved instead of the merged result
+        assert not (tmp_path / 'tmp' / f"trueblocks_txns_{addressObj.address}.json").exists()
+        saved = json.loads((tmp_path / 'tmp' / f"trueblocks_txns_{addressObj.address}.0.json").read_text())
+        assert [(d['blockNumber'], d['transactionIndex']) for d in saved['data']] == [(100, 0), (101, 1), (102, 2)]
+
+        transaction.set_rollback(True)
+
+
+def test_add_or_update_addresses_traces(fake_chifra, monkeypatch, tmp_path):
+    from django.db import transaction
+    from django.test import TestCase
+    from evm_contracts_db.database.models.blockchain import BlockchainTransaction
+
+    log = tmp_path / 'calls.log'
+    monkeypatch.setenv('FAKE_CHIFRA_LOG', str(log))
+    tb = TrueblocksHandler(saveDir=str(tmp_path), cacheDir=False, bulk=True, maxWorkers=4)
+
+    with transaction.atomic():
+        addressObjs = [BlockchainAddress.objects.create(address='0x' + f"{i:040x}") for i in range(0xd0, 0xd4)]
+
+        # Every address lists the same three transactions, which are traced once
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            synced = tb.add_or_update_addresses_traces(addressObjs, since_block=False)
+
+        calls = log.read_text().splitlines()
+        assert calls == [" ".join(a.address for a in addressObjs), "100.0 101.1 102.2"]
+        assert BlockchainTransaction.objects.filter(tx_key__in=[pack_txid(t) for t in ['100.0', '101.1', '102.2']]).count() == 3
+        assert synced == {a.address: 102 for a in addressObjs}
+        assert all(a.last_synced_traces_block == 102 for a in addressObjs)
+
+        transaction.set_rollback(True)
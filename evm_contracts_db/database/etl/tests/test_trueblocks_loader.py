@@ -30,3 +30,176 @@ def test_save_chifra_trace_result():
     assert len(parsed) == len(txIds), "Did not get traces of all transactions"
 
     tbl.insert_transactions(parsed)    
+
+
+def _sample_transactions():
+    factory = '0x' + 'f' * 40
+    return [
+        {
+            'transaction_id': f"{100 + i}.{i}",
+            'transaction_hash': '0x' + f"{i:064x}",
+            'block_number': 100 + i,
+            'from_address': '0x' + f"{i:040x}",
+            'to_address': factory,
+            'value': "1000000000000000000",
+            'call_name': 'summonMoloch',
+            'call_inputs': {'_summoner': '0x' + f"{i:040x}", '_periodDuration': '17280'},
+            'call_outputs': None,
+            'contracts_created': ['0x' + f"{i + 1000:040x}"],
+            'addresses_involved': [factory, '0x' + f"{i + 2000:040x}"],
+            'logs': [
+                {
+                    'log_index': j,
+                    'address': '0x' + f"{i + 1000:040x}",
+                    'event': 'SummonComplete',
+                    'compressed_log': f"SummonComplete(0x{i:040x} /*summoner*/, {j} /*shares*/);",
+                } for j in range(2)
+            ],
+            'traces': [
+                {
+                    'trace_path': [0],
+                    'from_address': factory,
+                    'to_address': '0x' + f"{i + 1000:040x}",
+                    'compressed_trace': 'init(\\t)',
+                    'value': 0,
+                    'error': None,
+                    'outputs': {'ok': True},
+                    'delegate': '0x' + 'd' * 40,
+                },
+            ],
+        } for i in range(5)
+    ]
+
+
+def _snapshot():
+    """Database contents with surrogate ids replaced by natural keys"""
+
+    from evm_contracts_db.database.models import blockchain
+
+    def _address(a):
+        return a.address if a is not None else None
+
+    return {
+        'addresses': sorted(blockchain.BlockchainAddress.objects.values_list('chain', 'address')),
+        'transactions': sorted(
+            (t.transaction_id, t.transaction_hash, t.block_number, _address(t.from_address), _address(t.to_address),
+             t.value, t.error, t.call_name, t.call_inputs, t.call_outputs,
+             tuple(sorted(c.address for c in t.contracts_created.all())))
+            for t in blockchain.BlockchainTransaction.objects.all()
+        ),
+        'logs': sorted(
+            (l.log_index, _address(l.address), l.topics, l.event, l.compressed_log, l.originating_from_id, l.event_inputs)
+            for l in blockchain.BlockchainTransactionLog.objects.all()
+        ),
+        'traces': sorted(
+            (t.trace_path, _address(t.from_address), _address(t.to_address), t.value, t.call_name,
+             t.compressed_trace, t.error, t.outputs, _address(t.delegate), t.originating_from_id, t.call_inputs)
+            for t in blockchain.BlockchainTransactionTrace.objects.all()
+        ),
+        'appearances': sorted(
+            blockchain.BlockchainAddressAppearance.objects.values_list('address__address', 'tx_id', 'role')
+        ),
+    }
+
+
+def test_bulk_insert_matches_row_by_row():
+    import copy
+    from django.db import transaction
+
+    tbl = TrueblocksLoader()
+    snapshots = {}
+    for bulk in [False, True]:
+        with transaction.atomic():
+            # Load twice to check that reloading leaves the same state
+            for _ in range(2):
+                tbl.insert_transactions(copy.deepcopy(_sample_transactions()), includeTraces=True, bulk=bulk)
+            snapshots[bulk] = _snapshot()
+            transaction.set_rollback(True)
+
+    assert len(snapshots[False]['transactions']) == 5
+    assert snapshots[True] == snapshots[False]
+
+
+def test_packed_tx_key():
+    from django.db import transaction
+    from evm_contracts_db.database.models.blockchain import BlockchainTransaction
+    from utils.blockchain import tx_key, pack_txid, unpack_txid, txid_of
+
+    assert pack_txid('15000000.7') == tx_key(15000000, 7) == (15000000 << 32) | 7
+    assert unpack_txid(pack_txid('15000000.7')) == unpack_txid('15000000.7') == {'blockNumber': '15000000', 'transactionIndex': '7'}
+    assert txid_of(pack_txid('15000000.7')) == '15000000.7'
+    # Keys sort by (block, index), unlike the ids as strings
+    txIds = ['9.1', '10.0', '10.2', '100.0']
+    assert sorted(txIds, key=pack_txid) == txIds
+
+    with transaction.atomic():
+        TrueblocksLoader().insert_transactions(_sample_transactions(), bulk=True)
+        txns = BlockchainTransaction.objects.filter(BlockchainTransaction.block_range(101, 102)).order_by('pk')
+        assert [t.transaction_id for t in txns] == ['101.1', '102.2']
+        assert sorted(l.log_index for l in txns[0].logs.all()) == [0, 1]
+        transaction.set_rollback(True)
+
+
+def test_address_appearances():
+    import copy
+    from django.db import transaction
+    from evm_contracts_db.database.models.blockchain import BlockchainAddress, BlockchainAddressAppearance
+    from utils.blockchain import pack_txid
+
+    Role = BlockchainAddressAppearance.Role
+    dataDicts = _sample_transactions()
+    # A self-transfer, whose sender is also involved in another transaction's logs
+    dataDicts[3]['to_address'] = dataDicts[3]['from_address']
+    dataDicts[4]['logs'][0]['address'] = dataDicts[3]['from_address']
+
+    for bulk in [False, True]:
+        with transaction.atomic():
+            TrueblocksLoader().insert_transactions(copy.deepcopy(dataDicts), includeTraces=True, bulk=bulk)
+            factory = BlockchainAddress.objects.get(address='0x' + 'f' * 40)
+            sender = BlockchainAddress.objects.get(address=dataDicts[3]['from_address'])
+
+            # Every transaction touching the factory, in block order, one page at a time
+            txIds = [t.transaction_id for t in factory.appears_in()]
+            assert txIds == ['100.0', '101.1', '102.2', '103.3', '104.4']
+            page = factory.appears_in(limit=2)
+            assert [t.transaction_id for t in page] == ['100.0', '101.1']
+            page = factory.appears_in(after=page[1].tx_key, limit=2)
+            assert [t.transaction_id for t in page] == ['102.2', '103.3']
+            assert [t.transaction_id for t in factory.appears_in(after='103.3')] == ['104.4']
+
+            # Each role once per transaction; 'involved' only without another role
+            assert sorted(sender.appearances.values_list('tx_id', 'role')) == [
+                (pack_txid('103.3'), Role.FROM), (pack_txid('103.3'), Role.TO), (pack_txid('104.4'), Role.INVOLVED)
+            ]
+            assert [t.transaction_id for t in sender.appears_in()] == ['103.3', '104.4']
+            assert [t.transaction_id for t in sender.appears_in(roles=[Role.INVOLVED])] == ['104.4']
+            # Created contracts (also emitting logs) and addresses only in addresses_involved
+            assert BlockchainAddressAppearance.objects.filter(role=Role.CREATED).count() == 5
+            assert [t.transaction_id for t in BlockchainAddress.objects.get(address='0x' + f"{2000:040x}").appears_in()] == ['100.0']
+            # The zero address is not recorded
+            assert not BlockchainAddressAppearance.objects.filter(address__address='0x0').exists()
+            transaction.set_rollback(True)
+
+
+def test_update_or_create_address_record():
+    from django.db import connection, transaction
+    from django.test.utils import CaptureQueriesContext
+    from evm_contracts_db.database.models.blockchain import BlockchainAddress
+
+    loader = TrueblocksLoader()
+    address = '0x' + 'C' * 40
+
+    with transaction.atomic():
+        BlockchainAddress.objects.create(address=address, last_synced_traces_block=7)
+
+        # Only the resolver's SELECT is run, not another read of the record
+        with CaptureQueriesContext(connection) as queries:
+            addressObj = loader.update_or_create_address_record(address)
+        assert len(queries) == 1
+        assert (addressObj.chain, addressObj.address) == ('ETH', address.lower())
+        assert addressObj == BlockchainAddress.objects.get(address=address)
+
+        # Sync marks are read when first used
+        assert addressObj.last_synced_traces_block == 7
+
+        transaction.set_rollback(True)
@@ -1,5 +1,6 @@
 import os
 import json
+import pytest
 
 from evm_contracts_db.database.etl.trueblocks_extractor import TrueblocksExtractor
 from evm_contracts_db.database.etl.trueblocks_transformer import TrueblocksTransformer
@@ -34,3 +35,73 @@ def test_parse_chifra_trace_result():
 
     with open(os.path.join(os.getcwd(), 'tmp/test_parse_chifra_trace_result.json'), 'w') as f:
         json.dump(parsed, f, indent=4)
+
+
+def _trace(blockNumber, transactionIndex, traceAddress, callType, sender, to, compressedTrace="", **kwargs):
+    return {
+        'blockNumber': blockNumber,
+        'transactionIndex': transactionIndex,
+        'transactionHash': f"0x{blockNumber:x}{transactionIndex:x}",
+        'traceAddress': traceAddress,
+        'action': {'callType': callType, 'from': sender, 'to': to, 'value': 0},
+        'compressedTrace': compressedTrace,
+        'result': {'output': '0x'},
+        **kwargs
+    }
+
+
+def test_transform_chifra_trace_result_call_tree():
+    tbt = TrueblocksTransformer()
+    result = {'data': [
+        _trace(1, 0, None, 'call', '0xuser', '0xfactory', 'summon()'),
+        _trace(2, 3, None, 'call', '0xuser', '0xproxy', 'vote(1)'),
+        _trace(1, 0, '0', 'creation', '0xfactory', None, result={'newContract': '0xdao'}),
+        # Proxy forwards to an upgradeable proxy, which forwards to the implementation
+        _trace(1, 0, '1', 'call', '0xfactory', '0xproxy', 'init()'),
+        _trace(1, 0, '1-0', 'delegatecall', '0xproxy', '0ximpl1', 'init()'),
+        _trace(1, 0, '1-0-0', 'delegatecall', '0xproxy', '0ximpl2', 'init()'),
+        # traceAddress 10 starts with 1 as a string, but is not in the subtree of 1
+        _trace(1, 0, '10', 'call', '0xfactory', '0xother', 'init()'),
+        _trace(1, 0, '10-0', 'delegatecall', '0xother', '0ximpl3', 'init()'),
+        _trace(2, 3, '0', 'call', '0xproxy', '0xtoken', 'balanceOf()'),
+    ]}
+
+    parsed = tbt.transform_chifra_trace_result(result)
+    assert [t['transaction_id'] for t in parsed] == ['1.0', '2.3']
+
+    summon = parsed[0]
+    assert summon['from_address'] == '0xuser' and summon['to_address'] == '0xfactory'
+    assert summon['contracts_created'] == ['0xdao']
+    assert {tuple(c['trace_path']): c['delegate'] for c in summon['traces']} == {(1,): '0ximpl2', (10,): '0ximpl3'}
+
+    vote = parsed[1]
+    assert [c['delegate'] for c in vote['traces']] == [None]
+
+
+def test_iter_chifra_trace_records():
+    tbt = TrueblocksTransformer()
+    traces = [
+        _trace(1, 0, None, 'call', '0xuser', '0xfactory', 'summon()'),
+        _trace(1, 0, '0', 'creation', '0xfactory', None, result={'newContract': '0xdao'}),
+        _trace(1, 0, '1', 'call', '0xfactory', '0xproxy', 'init()'),
+        _trace(2, 3, None, 'call', '0xuser', '0xproxy', 'vote(1)'),
+        _trace(2, 3, '0', 'call', '0xproxy', '0xtoken', 'balanceOf()'),
+        _trace(3, 0, None, 'call', '0xuser', '0xproxy', 'vote(2)'),
+    ]
+
+    # Each transaction is yielded once the first trace of the next one is read
+    consumed = []
+    def source():
+        for trace in traces:
+            consumed.append(trace)
+            yield trace
+
+    records = tbt.iter_chifra_trace_records(source())
+    assert next(records)['transaction_id'] == '1.0'
+    assert len(consumed) == 4
+
+    assert [next(records)] + list(records) == tbt.transform_chifra_trace_result({'data': traces})[1:]
+
+    # A transaction whose traces are split is not loaded from part of them
+    with pytest.raises(ValueError):
+        list(tbt.iter_chifra_trace_records(traces[:4] + traces[1:3]))
@@ -1,12 +1,22 @@
 import os
 import logging
+from itertools import islice
 from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 
 from evm_contracts_db.settings import BASE_DIR
-from evm_contracts_db.database.models import blockchain
+from evm_contracts_db.database.models import blockchain, etl
 from evm_contracts_db.database.etl.trueblocks_extractor import TrueblocksExtractor
+from evm_contracts_db.database.etl.trueblocks_api import TrueblocksApiExtractor
+from evm_contracts_db.database.etl.chifra_cache import ChifraCache
 from evm_contracts_db.database.etl.trueblocks_transformer import TrueblocksTransformer
+from evm_contracts_db.database.etl.articulator import AbiStore, Articulator
 from evm_contracts_db.database.etl.trueblocks_loader import TrueblocksLoader
+from evm_contracts_db.database.etl.dedupe import TxIdDeduplicator
+from evm_contracts_db.database.etl.pipeline import Pipeline
+from evm_contracts_db.database.etl.batch_planner import BatchPlanner, block_of, txid_key
+from evm_contracts_db.database.etl.appearances import UnchainedIndexReader
 
 from utils.files import load_json, save_json
 
@@ -16,46 +26,145 @@ class TrueblocksHandler:
     e.g., `chifra traces --articulate --fmt json [addresses]` 
     """
 
-    def __init__(self, chain=None, saveDir=None):
-        self.extractor = TrueblocksExtractor()
-        self.transformer = TrueblocksTransformer()
-        self.loader = TrueblocksLoader(chain=chain)
+    # Number of transactions inserted at a time when streaming
+    BATCH_SIZE = 1000
+    # Number of batches that may wait between two stages of the pipeline
+    QUEUE_SIZE = 4
+    # Number of transaction ids per chunk of an EtlJob (and per database transaction)
+    JOB_CHUNK_SIZE = 1000
+    # BlockchainAddress field of the sync mark of each chifra function
+    SYNC_FIELDS = {'traces': 'last_synced_traces_block', 'transactions': 'last_synced_transactions_block'}
+
+    def __init__(self, chain=None, saveDir=None, bulk=False, maxWorkers=1, backend='cli', apiUrl=None,
+                 cacheDir=None, cacheBytes=None, bloom=False, indexPath=None, abiPaths=None):
+        """bulk: load with TrueblocksLoader.bulk_insert_transactions
+        maxWorkers: number of chifra processes (or requests) to run concurrently
+        backend: 'cli' to run chifra locally, or 'api' to query a TrueBlocks
+            REST server (chifra serve) at apiUrl
+        cacheDir: directory of the ChifraCache of traces and transactions
+            (default tmp/chifra_cache in saveDir), or False to disable it; it is
+            opened on the first chunked chifra query (see ensure_cache)
+        cacheBytes: size cap of the cache (default ChifraCache.MAX_BYTES)
+        bloom: keep a Bloom filter of loaded transaction ids (see TxIdDeduplicator)
+        indexPath: (optional) local Unchained Index to read appearances from
+            instead of running chifra list (see UnchainedIndexReader)
+        abiPaths: (optional) ABI files or directories to articulate chifra
+            output with in process (see Articulator), running chifra without
+            --articulate
+        """
 
         if saveDir is None:
             self.saveDir = BASE_DIR
         else:
             self.saveDir = saveDir
+        os.makedirs(os.path.join(self.saveDir, 'tmp'), exist_ok=True)
+
+        assert backend in ['cli', 'api'], "Only 'cli' and 'api' backends are supported"
+        if backend == 'api':
+            self.extractor = TrueblocksApiExtractor(baseUrl=apiUrl or 'http://localhost:8080', maxWorkers=maxWorkers)
+        else:
+            self.extractor = TrueblocksExtractor(maxWorkers=maxWorkers)
+        if cacheDir is not False:
+            cacheDir = cacheDir or os.path.join(self.saveDir, 'tmp/chifra_cache')
+        self.cacheDir = cacheDir
+        self.cacheBytes = cacheBytes
+        self.chain = chain
+        self._cacheOpened = False
+        self.articulator = Articulator(AbiStore(abiPaths)) if abiPaths is not None else None
+        self.transformer = TrueblocksTransformer(articulator=self.articulator)
+        self.loader = TrueblocksLoader(chain=chain)
+        self.dedupe = TxIdDeduplicator(bloom=bloom)
+        self.planner = BatchPlanner(self.dedupe)
+        self.indexReader = UnchainedIndexReader(indexPath) if indexPath is not None else None
+
+        self.bulk = bulk
+
+    def ensure_cache(self):
+        """Open the extractor's ChifraCache (see open_cache) on first use, so
+        that handlers that never run a chunked chifra query neither call chifra
+        status nor create the cache directory; return it (None if disabled or
+        unavailable)
+        """
+
+        if not self._cacheOpened:
+            self._cacheOpened = True
+            if self.cacheDir is not False:
+                self.extractor.cache = self.open_cache(self.cacheDir, maxBytes=self.cacheBytes, chain=self.chain)
+
+        return self.extractor.cache
+
+    def open_cache(self, cacheDir, maxBytes=None, chain=None):
+        """Return a ChifraCache in cacheDir whose entries are keyed by the chain
+        and the chifra and client versions, and that only caches blocks of the
+        finalized index, as reported by chifra status; or None (no caching) if
+        the status cannot be read
+        """
+
+        status = self.extractor.get_status()
+        try:
+            versions = [status['data'][0]['trueblocksVersion'], status['data'][0].get('clientVersion')]
+            lastBlock = int(status['meta']['finalized'])
+        except (TypeError, KeyError, IndexError, ValueError):
+            logging.warning("Could not read chifra status: chifra results will not be cached")
+            return None
+
+        return ChifraCache(cacheDir, maxBytes=maxBytes, state=" ".join([chain or 'ETH', *map(str, versions)]), lastBlock=lastBlock)
+
+    def close(self):
+        """Release the extractor's resources (e.g., the request threads of the 'api' backend)"""
+
+        self.extractor.close()
+
+    def __enter__(self):
+        return self
 
-    def add_or_update_address_traces(self, addressObj, debug=False, reuseList=False):
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_or_update_address_traces(self, addressObj, debug=False, reuseList=False, since_block=None, stream=False):
         """Get list of all transaction ids from index, then export trace 
 
         If debug=True, saves result to file in tmp directory
+        since_block: see first_block
+        stream: extract, transform and insert transactions concurrently (see
+            run_pipeline), saving the output of each chunk to its own file
+            instead of the merged result (which reuseList reads)
+
+        Without stream, the whole chifra result (and its transformed records)
+        is held in memory and saved to file before anything is loaded, so
+        memory grows with the address's history; use stream=True for
+        addresses with many transactions.
         """
 
         address = addressObj.address
 
         fpath = os.path.join(self.saveDir, f"tmp/trueblocks_traces_{address}.json")
 
+        syncedBlock = None
         if not os.path.isfile(fpath) or not reuseList:
-            # Get list of all transaction IDs
-            txIds = self.extractor.get_txids(address)
+            # Get list of transaction IDs (since the last sync)
+            txIds = self.list_txids([addressObj], 'traces', since_block).get(address)
+            if txIds is None:
+                logging.error(f"Could not list appearances of {address}")
+                return
 
             # Filter transaction IDs for those not yet in database
-            existingTxIds = blockchain.BlockchainTransaction.objects.filter(transaction_id__in=txIds).values_list('transaction_id', flat=True)
-            newTxIds = list(filter(lambda id: id not in existingTxIds, txIds))
+            newTxIds = self.dedupe.missing(txIds)
             logging.info(f"Processing {len(newTxIds)} transactions (of {len(txIds)} total transactions found)")
 
             # Get all transaction traces
             logging.info("Running chifra traces for the list of tx ids...")
-            query_trace = {
-                'function': 'traces', 
-                'value': newTxIds, 
-                'format': 'json',
-                'args': ['articulate']
-            }  
+            query_trace = self.chifra_query('traces', newTxIds)
+
+            if stream:
+                failed = []
+                self.run_pipeline(query_trace, self.transformer.iter_chifra_trace_records, failed=failed, fpath=fpath)
+                self.mark_synced(addressObj, 'traces', self.synced_block(txIds, failed))
+                return
             
-            cmd = self.extractor.build_chifra_command(query_trace)
-            result = self.extractor.run_chifra(cmd, parse_as='json', fpath=fpath)
+            result = self.extractor.run_chifra_chunked(query_trace, fpath=fpath)
+            self.log_cache_stats()
+            syncedBlock = self.synced_block(txIds, result['failed'])
         else:
             logging.info(f"Using existing trace list from file for {address}")
             result = load_json(fpath)
@@ -67,46 +176,76 @@ class TrueblocksHandler:
             save_json(parsed, fpath_parsed)
 
         logging.info(f"Adding {len(parsed)} transactions to database...")
-        self.insert_transactions(parsed)    
+        self.insert_transactions(parsed, includeTraces=True)
+        self.dedupe.add(d['transaction_id'] for d in parsed)
+        self.mark_synced(addressObj, 'traces', syncedBlock)
 
-    def add_or_update_address_transactions(self, addressObj, since_block=False, local_only=False):
-        """Get list of all transaction ids from index, then export logs
-        
-        since_block options: 
-            - None: look for most recent appearance of block in [int block_number|False]
+    def add_or_update_addresses_traces(self, addressObjs, since_block=None):
+        """Export traces for many addresses at once (e.g., every DAO created
+        by a factory), tracing each transaction they share only once (see
+        BatchPlanner), then advance the traces sync mark of every address.
+        Traces are extracted, transformed and inserted concurrently (see
+        run_pipeline), so memory does not grow with the number of addresses.
+
+        since_block: see first_block (applied to each address)
 
-        TODO: Test!!
+        Returns dictionary of address -> last synced block (or None)
         """
 
-        address = addressObj.address
+        addressObjs = list(addressObjs)
+
+        txIdsByAddress = self.list_txids(addressObjs, 'traces', since_block)
+        for addressObj in addressObjs:
+            if addressObj.address not in txIdsByAddress:
+                logging.error(f"Could not list appearances of {addressObj.address}")
+
+        with self.planner.plan(txIdsByAddress, 'traces') as plan:
+            query_trace = self.chifra_query('traces', plan.txIds)
+
+            failed = []
+            self.run_pipeline(query_trace, self.transformer.iter_chifra_trace_records, failed=failed)
+
+        synced = plan.synced_blocks(failed)
+        for addressObj in addressObjs:
+            self.mark_synced(addressObj, plan.function, synced.get(addressObj.address))
+
+        return synced
 
-        fpath = os.path.join(os.getcwd(), f"tmp/trueblocks_txns_{address}.json")
-        fpath_parsed = os.path.join(os.getcwd(), f"tmp/trueblocks_{address}_parsed.json")
+    def add_or_update_address_transactions(self, addressObj, since_block=None, local_only=False, reuseList=False,
+                                           stream=False):
+        """Get list of all transaction ids from index, then export logs
+        
+        since_block: see first_block
+        stream: see add_or_update_address_traces (ignored if local_only);
+            without it, memory grows with the address's history
+        """
 
-        if not os.path.isfile(fpath):
-            # Get list of all transaction IDs
-            txIds = self.extractor.get_txids(address)
+        address = addressObj.address
 
-            # Filter transaction IDs for those since most recent appearance in chain
-            if since_block is not False:
-                #if since_block is None:
-                #    since_block = addressObj.most_recent_appearance() # TODO: add support for this
-                #else:
-                since_block = str(since_block)
+        fpath = os.path.join(self.saveDir, f"tmp/trueblocks_txns_{address}.json")
+        fpath_parsed = os.path.join(self.saveDir, f"tmp/trueblocks_{address}_parsed.json")
 
-                txIds = list(filter(lambda id: int(id.split('.')[0]) > since_block, txIds))
+        syncedBlock = None
+        if not os.path.isfile(fpath) or not reuseList:
+            # Get list of transaction IDs (since the last sync)
+            txIds = self.list_txids([addressObj], 'transactions', since_block).get(address)
+            if txIds is None:
+                logging.error(f"Could not list appearances of {address}")
+                return
 
             # Get all transaction traces
             logging.info("Running chifra transactions for the list of tx ids...")
-            query_txn = {
-                'function': 'transactions', 
-                'value': txIds, 
-                'format': 'json',
-                'args': ['articulate']
-            }  
+            query_txn = self.chifra_query('transactions', txIds)
+
+            if stream and not local_only:
+                failed = []
+                self.run_pipeline(query_txn, self.transformer.iter_chifra_transaction_records, failed=failed, fpath=fpath)
+                self.mark_synced(addressObj, 'transactions', self.synced_block(txIds, failed))
+                return
             
-            cmd = self.extractor.build_chifra_command(query_txn)
-            result = self.extractor.run_chifra(cmd, parse_as='json', fpath=fpath)
+            result = self.extractor.run_chifra_chunked(query_txn, fpath=fpath)
+            self.log_cache_stats()
+            syncedBlock = self.synced_block(txIds, result['failed'])
         else:
             result = load_json(fpath)
         
@@ -118,13 +257,263 @@ class TrueblocksHandler:
             # Insert transactions
             logging.info(f"Adding {len(parsed)} transactions to database...")
             self.insert_transactions(parsed)    
+            self.mark_synced(addressObj, 'transactions', syncedBlock)
 
-    def insert_transactions(self, dataDicts, includeTraces=False):
-        """Upload all blockchain transactions in file"""
+    def create_job(self, addressObjs, function='traces', since_block=None, chunkSize=None):
+        """List the transactions of addressObjs that are not loaded yet and
+        record them as a resumable EtlJob, split into chunks of chunkSize
+        (default JOB_CHUNK_SIZE) transaction ids; run it with run_job
+
+        function: 'traces' or 'transactions'
+        since_block: see first_block (applied to each address)
+        """
+
+        assert function in ['traces', 'transactions'], "Only traces and transactions jobs are supported"
+        addressObjs = list(addressObjs)
+        chunkSize = chunkSize or self.JOB_CHUNK_SIZE
+
+        txIdsByAddress = self.list_txids(addressObjs, function, since_block)
+        union = set()
+        for addressObj in addressObjs:
+            if addressObj.address not in txIdsByAddress:
+                logging.error(f"Could not list appearances of {addressObj.address}")
+            union.update(txIdsByAddress.get(addressObj.address, []))
+        txIds = self.dedupe.missing(sorted(union, key=txid_key))
 
         with transaction.atomic():
-            for d in dataDicts:
-                logging.debug(f"Updating/creating BlockchainTransaction for {d['transaction_id']}...")
-                self.loader.update_or_create_transaction_record(d, includeTraces)
+            job = etl.EtlJob.objects.create(
+                function=function,
+                listed_blocks={a: max(block_of(t) for t in ids) for a, ids in txIdsByAddress.items() if len(ids) > 0}
+            )
+            job.addresses.set([a for a in addressObjs if a.address in txIdsByAddress])
+            etl.EtlJobChunk.objects.bulk_create([
+                etl.EtlJobChunk(job=job, position=i // chunkSize, tx_ids=txIds[i:i + chunkSize])
+                for i in range(0, len(txIds), chunkSize)
+            ])
+
+        logging.info(f"Created {job} for {len(txIds)} transactions of {len(txIdsByAddress)} addresses")
+
+        return job
+
+    def claim_job(self, job, force=False):
+        """Mark job as running if it is pending or failed (or, if force, running
+        already, e.g. after a crash), in one conditional update, so that a job
+        is only run by one process at a time; return whether it was claimed
+        """
+
+        statuses = [etl.EtlJob.Status.PENDING, etl.EtlJob.Status.FAILED]
+        if force:
+            statuses.append(etl.EtlJob.Status.RUNNING)
+        claimed = etl.EtlJob.objects.filter(pk=job.pk, status__in=statuses).update(
+            status=etl.EtlJob.Status.RUNNING, error=None, updated_at=timezone.now()
+        )
+        job.refresh_from_db(fields=['status', 'error', 'updated_at'])
+
+        return claimed > 0
+
+    def run_job(self, job, force=False):
+        """Run (or resume) an EtlJob: extract, transform and load each chunk
+        not loaded yet, committing each chunk together with its status, so a
+        crashed run can be resumed from the first chunk not loaded. Chunks
+        extracted before a crash are read back from the chifra cache.
+
+        The job is first claimed (see claim_job); a job that is done, or
+        running in another process (unless force), is left as is.
+
+        Ids whose extraction fails stay in their chunk (marked failed) for the
+        next run. Once every chunk is loaded, the job is done and the sync mark
+        (of job.function) of each of its addresses advances to the last block
+        listed for it.
+
+        Returns the job, with its status updated.
+        """
+
+        transform = {
+            'traces': self.transformer.transform_chifra_trace_result,
+            'transactions': self.transformer.transform_chifra_transaction_result,
+        }[job.function]
+
+        if not self.claim_job(job, force=force):
+            logging.warning(f"Not running {job}: it is not pending or failed")
+            return job
+
+        Chunk = etl.EtlJobChunk
+        try:
+            for chunk in job.chunks.exclude(status=Chunk.Status.LOADED).order_by('position'):
+                chunk.attempts += 1
+                query = self.chifra_query(job.function, chunk.tx_ids)
+                result = self.extractor.run_chifra_chunked(query)
+                chunk.status = Chunk.Status.EXTRACTED
+                chunk.records_extracted = len(result['data'])
+                chunk.save(update_fields=['status', 'records_extracted', 'attempts', 'updated_at'])
+
+                parsed = transform(result)
+                chunk.status = Chunk.Status.TRANSFORMED
+                chunk.save(update_fields=['status', 'updated_at'])
+
+                with transaction.atomic():
+                    self.insert_transactions(parsed, includeTraces=job.function == 'traces')
+                    chunk.records_loaded += len(parsed)
+                    if len(result['failed']) > 0:
+                        # Only the ids that failed are retried
+                        chunk.status = Chunk.Status.FAILED
+                        chunk.tx_ids = result['failed']
+                    else:
+                        chunk.status = Chunk.Status.LOADED
+                    chunk.save(update_fields=['status', 'tx_ids', 'records_loaded', 'updated_at'])
+                self.dedupe.add(d['transaction_id'] for d in parsed)
+                logging.info(f"{job}: chunk {chunk.position} {chunk.status} ({len(parsed)} transactions)")
+        except Exception as e:
+            job.status = etl.EtlJob.Status.FAILED
+            job.error = repr(e)
+            job.save(update_fields=['status', 'error', 'updated_at'])
+            raise
+        finally:
+            self.log_cache_stats()
+
+        if job.chunks.exclude(status=Chunk.Status.LOADED).exists():
+            job.status = etl.EtlJob.Status.FAILED
+        else:
+            job.status = etl.EtlJob.Status.DONE
+            for addressObj in job.addresses.all():
+                self.mark_synced(addressObj, job.function, job.listed_blocks.get(addressObj.address))
+        job.save(update_fields=['status', 'updated_at'])
+        logging.info(f"Finished {job}")
+
+        return job
+
+    def chifra_query(self, function, txIds):
+        """Query of chifra traces or transactions for txIds, articulated by chifra
+        unless they are articulated in process; opens the cache the query is
+        run through (see ensure_cache)
+        """
+
+        self.ensure_cache()
+
+        return {
+            'function': function,
+            'value': txIds,
+            'format': 'json',
+            'args': ['articulate'] if self.articulator is None else []
+        }
+
+    def list_txids(self, addressObjs, function, since_block=None):
+        """List the transaction ids of every address in addressObjs since its
+        first_block for function, with one chifra call (or index read) per
+        distinct first block; return dictionary of address -> txIds, without
+        the addresses that could not be listed
+        """
+
+        byFirstBlock = {}
+        for addressObj in addressObjs:
+            byFirstBlock.setdefault(self.first_block(addressObj, function, since_block), []).append(addressObj.address)
+
+        txIdsByAddress = {}
+        for firstBlock, addresses in byFirstBlock.items():
+            if self.indexReader is not None:
+                appearances = self.indexReader.get_appearances(addresses, firstBlock=firstBlock)
+            else:
+                appearances = self.extractor.get_appearances(addresses, firstBlock=firstBlock)
+            if appearances is None:
+                continue
+            for address in addresses:
+                txIdsByAddress[address] = appearances[address.lower()].txids()
+
+        return txIdsByAddress
+
+    def first_block(self, addressObj, function, since_block=None):
+        """Return first block to list appearances of addressObj from to extract
+        them with function ('traces' or 'transactions'), given since_block options:
+            - None: continue after the sync mark of addressObj for function
+              (e.g., last_synced_traces_block), if any
+            - False: list the full history
+            - int block_number: list appearances after this block
+        """
+
+        if since_block is None:
+            since_block = getattr(addressObj, self.SYNC_FIELDS[function])
+        if since_block is None or since_block is False:
+            return None
+
+        return int(since_block) + 1
+
+    @staticmethod
+    def synced_block(txIds, failed):
+        """Return highest block up to which all appearances in txIds are loaded,
+        given the tx ids that could not be extracted (or None if txIds is empty)
+        """
+
+        if len(txIds) == 0:
+            return None
+        if len(failed) > 0:
+            return min(int(id.split('.')[0]) for id in failed) - 1
+
+        return max(int(id.split('.')[0]) for id in txIds)
+
+    def mark_synced(self, addressObj, function, block):
+        """Advance the sync mark of addressObj for function ('traces' or
+        'transactions', see SYNC_FIELDS) to block once the current transaction
+        (if any) commits; the mark never moves backwards
+        """
+
+        if block is None:
+            return
+        field = self.SYNC_FIELDS[function]
+
+        def advance():
+            updated = blockchain.BlockchainAddress.objects.filter(pk=addressObj.pk).filter(
+                Q(**{f"{field}__isnull": True}) | Q(**{f"{field}__lt": block})
+            ).update(**{field: block})
+            if updated > 0:
+                setattr(addressObj, field, block)
+
+        transaction.on_commit(advance)
+
+    def log_cache_stats(self):
+        if self.extractor.cache is not None:
+            logging.info(f"chifra cache: {self.extractor.cache.stats()}")
+
+    def insert_transactions(self, dataDicts, includeTraces=False):
+        """Upload all blockchain transactions in file
+
+        includeTraces: also load the traces (and trace appearances) of each
+            transaction, as output by transform_chifra_trace_result
+        """
+
+        self.loader.insert_transactions(dataDicts, includeTraces=includeTraces, bulk=self.bulk)
+
+    def run_pipeline(self, query, transform, failed=None, fpath=None):
+        """Run the chunked chifra query, transform (e.g.,
+        self.transformer.iter_chifra_trace_records) and insert_transactions as
+        concurrent stages of a Pipeline, inserting BATCH_SIZE transactions at a
+        time; return the StageStats of the pipeline
+
+        failed: (optional) list extended with the values that could not be extracted
+        fpath: (optional) save the output of each chunk to a file of its own
+            (see AsyncChunkedExtractor.chunk_path)
+        """
+
+        def extract():
+            chunks = self.extractor.iter_chifra_chunks(query, failed=failed, fpath=fpath)
+            try:
+                for chunk, records in chunks:
+                    yield records
+            finally:
+                chunks.close()
+
+        def transformBatches(records):
+            dataDicts = transform(records)
+            while True:
+                batch = list(islice(dataDicts, self.BATCH_SIZE))
+                if len(batch) == 0:
+                    return
+                yield batch
+
+        def load(batch):
+            self.insert_transactions(batch, includeTraces=query['function'] == 'traces')
+            self.dedupe.add(d['transaction_id'] for d in batch)
+
+        stats = Pipeline(maxsize=self.QUEUE_SIZE).run(extract(), transformBatches, load)
+        self.log_cache_stats()
 
-        logging.info(f'Added {len(dataDicts)} transactions to database')
+        return stats
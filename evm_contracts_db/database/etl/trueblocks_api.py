@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from evm_contracts_db.database.etl.trueblocks_async import AsyncChunkedExtractor
+from evm_contracts_db.database.etl.appearances import Appearances
+from evm_contracts_db.database.etl.trueblocks_extractor import ChunkedExtractor
+from utils.files import save_json
+from utils.strings import snake_to_camel
+
+
+class AsyncTrueblocksApiExtractor(AsyncChunkedExtractor):
+    """Query a TrueBlocks REST server (`chifra serve`) instead of running chifra:
+    https://trueblocks.io/api/
+
+    Requests share one keep-alive connection pool of maxWorkers connections.
+    Chunking, concurrency, retries and ordering of chunked queries are the same
+    as for AsyncTrueblocksExtractor; only running a chunk differs. Requests run
+    on a pool of maxWorkers threads: close the extractor (or use it as a context
+    manager) to stop them.
+    """
+
+    # Query parameter holding the values of each endpoint
+    VALUE_PARAMS = {
+        'list': 'addrs',
+        'export': 'addrs',
+        'traces': 'transactions',
+        'transactions': 'transactions',
+        'receipts': 'transactions',
+        'logs': 'transactions',
+    }
+
+    def __init__(self, baseUrl='http://localhost:8080', maxWorkers=4, timeout=60, pageSize=1000, session=None,
+                 cache=None):
+        """baseUrl: address of the chifra serve instance
+        maxWorkers: number of concurrent requests (and pooled connections)
+        timeout: default timeout for each request, in seconds
+        pageSize: number of records per request for endpoints that are paged
+        session: (optional) requests.Session to use instead of a new one (not
+            closed with the extractor)
+        cache: (optional) ChifraCache of chunked query results
+        """
+
+        super().__init__(maxWorkers=maxWorkers, timeout=timeout, cache=cache)
+        self.baseUrl = baseUrl.rstrip('/')
+        self.pageSize = pageSize
+
+        self._ownsSession = session is None
+        if session is None:
+            session = requests.Session()
+            retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=maxWorkers, max_retries=retries)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self._executor = ThreadPoolExecutor(max_workers=maxWorkers)
+
+    def close(self):
+        """Stop the request threads and close the session (if created here)"""
+
+        self._executor.shutdown()
+        if self._ownsSession:
+            self.session.close()
+
+    def build_query(self, params):
+        """Translate chifra command params (see build_chifra_command) into an
+        endpoint and query parameters
+        """
+
+        assert ('function' in params.keys()) and ('value' in params.keys()), "Provide both a function and a value"
+
+        fcn = params['function']
+        values = params['value']
+        if not isinstance(values, list):
+            values = [values]
+
+        query = {self.VALUE_PARAMS.get(fcn, 'terms'): " ".join(str(v) for v in values)}
+        for f in params.get('args') or []:
+            query[snake_to_camel(f.strip('-').replace('-', '_'))] = 'true'
+        for k, v in (params.get('kwargs') or {}).items():
+            query[snake_to_camel(k.strip('-').replace('-', '_'))] = v
+
+        return f"{self.baseUrl}/{fcn}", query
+
+    def get_result(self, url, query, timeout=None):
+        """GET url and return (its JSON result, response size in bytes) (blocking)"""
+
+        timeout = self.timeout if timeout is None else timeout
+        response = self.session.get(url, params=query, timeout=timeout)
+        response.raise_for_status()
+        result = response.json()
+        if result.get('errors'):
+            raise requests.HTTPError(f"{url}: {result['errors']}")
+
+        return result, len(response.content)
+
+    def get(self, url, query, timeout=None):
+        """GET url and return (its 'data' list, response size in bytes) (blocking)"""
+
+        result, nbytes = self.get_result(url, query, timeout)
+
+        return result.get('data') or [], nbytes
+
+    def get_paged(self, url, query, timeout=None):
+        """GET all pages of url, using firstRecord/maxRecords (blocking)"""
+
+        data = []
+        while True:
+            page, _ = self.get(url, {**query, 'firstRecord': len(data), 'maxRecords': self.pageSize}, timeout)
+            data.extend(page)
+            if len(page) < self.pageSize:
+                return data
+
+    async def get_status(self, timeout=None):
+        """Return the /status result ({'data': [status], 'meta': {'finalized':
+        ..., ...}}), or None on error
+        """
+
+        url = f"{self.baseUrl}/status"
+        try:
+            result, _ = await asyncio.get_running_loop().run_in_executor(self._executor, self.get_result, url, {}, timeout)
+        except (requests.RequestException, ValueError) as e:
+            logging.warning(f"Request to {url} failed: {e}")
+            return None
+
+        return result
+
+    async def get_appearances(self, addresses, firstBlock=None, lastBlock=None, timeout=None):
+        """Get the appearances of many addresses from the index in one (paged)
+        request; return dictionary of lowercase address -> Appearances (or None on error)
+
+        If the server does not tell the address of each appearance, addresses
+        are listed again one request each.
+
+        firstBlock, lastBlock: (optional) only list appearances in this block range
+        """
+
+        kwargs = {}
+        if firstBlock is not None:
+            kwargs['first_block'] = firstBlock
+        if lastBlock is not None:
+            kwargs['last_block'] = lastBlock
+        url, query = self.build_query({'function': 'list', 'value': list(addresses), 'kwargs': kwargs})
+        try:
+            records = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.get_paged, url, query, timeout
+            )
+        except (requests.RequestException, ValueError) as e:
+            logging.error(e)
+            return None
+
+        if len(addresses) > 1 and any('address' not in r for r in records):
+            logging.warning(f"{url} returned appearances without their address: listing {len(addresses)} addresses one at a time")
+            results = await asyncio.gather(*[self.get_appearances([a], firstBlock, lastBlock, timeout) for a in addresses])
+            if any(r is None for r in results):
+                return None
+            return {a: appearances for r in results for a, appearances in r.items()}
+
+        grouped = {a.lower(): ([], []) for a in addresses}
+        for r in records:
+            blocks, txIndexes = grouped.setdefault(r.get('address', addresses[0]).lower(), ([], []))
+            blocks.append(r['blockNumber'])
+            txIndexes.append(r['transactionIndex'])
+
+        return {a: Appearances(blocks, txIndexes) for a, (blocks, txIndexes) in grouped.items()}
+
+    async def _run_chunk(self, params, chunk, delay=0, timeout=None, fpath=None):
+        """Request one chunk of values, saving its records to fpath if given;
+        return (records, seconds, stats)
+        """
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        loop = asyncio.get_running_loop()
+        url, query = self.build_query({**params, 'value': chunk})
+        t0 = loop.time()
+        try:
+            records, nbytes = await loop.run_in_executor(self._executor, self.get, url, query, timeout)
+            stats = {'ok': True, 'bytes': nbytes}
+            if fpath:
+                await asyncio.to_thread(save_json, {'data': records}, fpath)
+        except (requests.RequestException, ValueError) as e:
+            logging.warning(f"Request to {url} failed on chunk of {len(chunk)} values: {e}")
+            records, stats = [], {'ok': False, 'bytes': 0}
+
+        return records, loop.time() - t0, stats
+
+
+class TrueblocksApiExtractor(ChunkedExtractor):
+    """Synchronous wrapper around AsyncTrueblocksApiExtractor, with the same
+    get_txids, get_appearances and chunked traces/transactions methods as
+    TrueblocksExtractor (but no chifra commands)
+    """
+
+    def __init__(self, baseUrl='http://localhost:8080', maxWorkers=4, timeout=60, pageSize=1000, session=None,
+                 cache=None):
+        super().__init__(AsyncTrueblocksApiExtractor(
+            baseUrl=baseUrl, maxWorkers=maxWorkers, timeout=timeout, pageSize=pageSize, session=session,
+            cache=cache
+        ))
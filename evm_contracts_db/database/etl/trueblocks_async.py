@@ -0,0 +1,453 @@
+import os
+import json
+import asyncio
+import logging
+
+from evm_contracts_db.database.etl.chunking import AdaptiveChunker
+from evm_contracts_db.database.etl.appearances import parse_chifra_list
+from utils.files import JsonArrayStream
+
+
+class AsyncChunkedExtractor:
+    """Run queries whose value is a list (e.g., chifra traces of transaction
+    ids) in chunks, on up to maxWorkers concurrent workers, through a
+    ChifraCache. Subclasses run one chunk (_run_chunk) and list appearances
+    (get_appearances): AsyncTrueblocksExtractor with chifra processes,
+    AsyncTrueblocksApiExtractor with requests to chifra serve.
+    """
+
+    def __init__(self, maxWorkers=1, timeout=None, cache=None):
+        """maxWorkers: default number of chunks to run concurrently
+        timeout: default timeout for each chunk, in seconds
+        cache: (optional) ChifraCache of chunked query results
+        """
+
+        self.maxWorkers = maxWorkers
+        self.timeout = timeout
+        self.cache = cache
+
+    def close(self):
+        """Release the resources held between queries (none here)"""
+
+    async def get_txids(self, address, firstBlock=None, timeout=None):
+        """Get list of all transaction IDs ("blockNumber.transactionIndex") for an address from the index
+
+        firstBlock: (optional) only list appearances from this block on
+        """
+
+        appearances = await self.get_appearances([address], firstBlock=firstBlock, timeout=timeout)
+        if appearances is None:
+            return None
+
+        return appearances[address.lower()].txids()
+
+    @staticmethod
+    def chunk_path(fpath, start):
+        """Path to save the chunk of values starting at index start to, given
+        the path of the whole query's result (e.g., tmp/traces.json ->
+        tmp/traces.250.json)
+        """
+
+        root, ext = os.path.splitext(fpath)
+
+        return f"{root}.{start}{ext}"
+
+    async def _run_cached_chunk(self, params, chunk, delay=0, timeout=None, fpath=None):
+        """Run one chunk of values, taking the records of values already in
+        self.cache from there; stats['n'] is the number of values actually run.
+        The cache is read and written in a thread, off the event loop.
+        """
+
+        if self.cache is None or not self.cache.accepts(params):
+            return await self._run_chunk(params, chunk, delay, timeout, fpath)
+
+        cached, missing = await asyncio.to_thread(self.cache.get, params, chunk)
+        if len(missing) == 0:
+            return [r for v in chunk for r in cached[str(v)]], 0, {'ok': True, 'bytes': 0, 'n': 0}
+
+        records, seconds, stats = await self._run_chunk(params, missing, delay, timeout, fpath)
+        stats['n'] = len(missing)
+        if not stats.get('ok'):
+            return records, seconds, stats
+
+        fresh = await asyncio.to_thread(self.cache.put, params, missing, records)
+        if fresh is None:
+            return [r for v in chunk if str(v) in cached for r in cached[str(v)]] + records, seconds, stats
+        cached.update(fresh)
+
+        return [r for v in chunk for r in cached[str(v)]], seconds, stats
+
+    async def iter_chifra_chunks(self, params, chunker=None, maxRetries=3, retryDelay=1, failed=None,
+                                 maxWorkers=None, timeout=None, fpath=None):
+        """Run a chifra query (see build_chifra_command) whose value is a list
+        (e.g., transaction ids) in chunks on up to maxWorkers concurrent chifra
+        processes, yielding (chunk values, list of parsed records) for each chunk
+        once it has succeeded, in the order of the values
+
+        chunker: (optional) AdaptiveChunker deciding the size of each chunk
+        maxRetries: number of times a failing chunk is retried (with a smaller
+            chunk size) before its values are given up on
+        retryDelay: seconds to wait before the first retry, doubling each time
+        failed: (optional) list extended with the values of chunks given up on
+        maxWorkers: number of concurrent chifra processes (default self.maxWorkers)
+        timeout: (optional) seconds after which a chunk's chifra call is killed
+            and retried
+        fpath: (optional) save the output of each chunk run to a file of its
+            own (see chunk_path); values taken from the cache are not saved
+        """
+
+        if chunker is None:
+            chunker = AdaptiveChunker()
+        maxWorkers = maxWorkers or self.maxWorkers
+        values = params['value']
+        if not isinstance(values, list):
+            values = [values]
+
+        # Ranges of values still to submit as (start, end, attempt); chunks are
+        # cut from the front of each range when a worker is free, so that their
+        # size follows the chunker's latest estimate
+        todo = [(0, len(values), 0)] if len(values) > 0 else []
+        running = {}
+        done = {}
+        nextStart = 0
+        try:
+            while len(todo) > 0 or len(running) > 0:
+                while len(todo) > 0 and len(running) < maxWorkers:
+                    start, end, attempt = todo.pop(0)
+                    chunk = chunker.next_chunk(values, start, end)
+                    if start + len(chunk) < end:
+                        todo.insert(0, (start + len(chunk), end, attempt))
+                    delay = retryDelay * 2 ** (attempt - 1) if attempt > 0 else 0
+                    chunkPath = self.chunk_path(fpath, start) if fpath else None
+                    task = asyncio.ensure_future(self._run_cached_chunk(params, chunk, delay, timeout, chunkPath))
+                    running[task] = (start, chunk, attempt)
+
+                finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    start, chunk, attempt = running.pop(task)
+                    records, seconds, stats = task.result()
+                    if stats.get('ok'):
+                        if stats.get('n', len(chunk)) > 0:
+                            chunker.record(stats.get('n', len(chunk)), seconds, stats['bytes'])
+                        done[start] = (chunk, records)
+                    elif attempt < maxRetries:
+                        chunker.shrink(len(chunk))
+                        logging.warning(f"chifra {params['function']} failed on chunk of {len(chunk)} values; retrying in {retryDelay * 2 ** attempt}s")
+                        todo.insert(0, (start, start + len(chunk), attempt + 1))
+                    else:
+                        logging.error(f"Giving up on chunk of {len(chunk)} values starting at {chunk[0]} after {maxRetries} retries")
+                        if failed is not None:
+                            failed.extend(chunk)
+                        done[start] = (chunk, None)
+
+                # Yield finished chunks in order
+                while nextStart in done:
+                    chunk, records = done.pop(nextStart)
+                    nextStart += len(chunk)
+                    if records is not None:
+                        yield chunk, records
+        finally:
+            # Cancelled or closed early: stop the chifra calls still running
+            for task in running:
+                task.cancel()
+            if len(running) > 0:
+                await asyncio.gather(*running, return_exceptions=True)
+
+    async def iter_records(self, params, **kwargs):
+        """Asynchronously yield the parsed records (traces, transactions) of a
+        chifra query with a list value, run in chunks (see iter_chifra_chunks)
+        """
+
+        async for chunk, records in self.iter_chifra_chunks(params, **kwargs):
+            for record in records:
+                yield record
+
+
+class AsyncTrueblocksExtractor(AsyncChunkedExtractor):
+    """asyncio counterpart of TrueblocksExtractor: runs chifra with
+    asyncio.create_subprocess_exec so that many commands can be interleaved on
+    one event loop. TrueblocksExtractor is a synchronous wrapper around this.
+
+    Every command can be given a timeout (in seconds, for the whole command);
+    on timeout or cancellation the chifra process is killed.
+    """
+
+    DEFAULT_PATH = 'tmp/trueblocks.log'
+    READ_SIZE = 1 << 16
+
+    def __init__(self, chifra='chifra', maxWorkers=1, timeout=None, cache=None):
+        """chifra: name or path of the chifra executable
+        maxWorkers: default number of chifra processes to run concurrently
+        timeout: default timeout for each command, in seconds
+        cache: (optional) ChifraCache of chunked query results
+        """
+
+        super().__init__(maxWorkers=maxWorkers, timeout=timeout, cache=cache)
+        self.chifra = chifra
+
+    def build_chifra_args(self, params):
+        """Build the argument list of a chifra command to run by subprocess
+        without a shell (see build_chifra_command for params; postprocess and
+        filepath are not supported)
+        """
+
+        assert ('function' in params.keys()) and ('value' in params.keys()), "Provide both a function and a value"
+        assert params.get('postprocess') is None and params.get('filepath') is None, "postprocess and filepath require a shell; use build_chifra_command"
+
+        # Get required arguments
+        fcn = params['function']
+        values = params['value']
+        if not isinstance(values, list):
+            values = [values]
+
+        # Add flags
+        argsList = [f"--{f.strip('-')}" for f in params.get('args') or []]
+
+        # Add keyword arguments if provided
+        kwargsList = []
+        for k, v in (params.get('kwargs') or {}).items():
+            kwargsList.extend([f"--{k.strip('-')}", str(v)])
+
+        # Set export format if provided
+        if params.get('format', None) is not None:
+            format = ["--fmt", params['format']]
+        else:
+            format = []
+
+        return [self.chifra, fcn, *argsList, *kwargsList, *format, *values]
+
+    def build_chifra_command(self, params):
+        """Build a chifra command to run by subprocess
+
+        params: dictionary with the following keys:
+            function: e.g., list, export
+            value: single value or list of values to provide to command (e.g., address(es), transaction(s))
+            format: (optional) e.g., csv, json
+            args: (optional) list of flags to provide
+            kwargs: (optional) dictionary of other keyword:value pairs for chifra
+            postprocess: (optional) string corresponding to command line postprocessing commands
+            filepath: (optional) provide file path to pipe output to
+        """
+
+        argList = self.build_chifra_args({**params, 'postprocess': None, 'filepath': None})
+
+        # Add shell postprocessing and pipe output to file if filepath provided
+        if params.get('postprocess', None) is not None:
+            argList.append(params['postprocess'])
+        if params.get('filepath', None) is not None:
+            argList.append(f"> {params['filepath']}")
+
+        # Return string to send to subprocess
+        return " ".join(argList)
+
+    async def _spawn(self, command):
+        """Start command: a list of arguments is run directly, a string by the shell"""
+
+        if isinstance(command, str):
+            return await asyncio.create_subprocess_shell(command, stdout=asyncio.subprocess.PIPE)
+        return await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE)
+
+    async def _read(self, process, deadline):
+        """Read the next chunk of stdout, raising asyncio.TimeoutError after deadline"""
+
+        if deadline is None:
+            return await process.stdout.read(self.READ_SIZE)
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        return await asyncio.wait_for(process.stdout.read(self.READ_SIZE), remaining)
+
+    async def _finish(self, process, completed):
+        """Kill process unless its output was fully read, then reap it"""
+
+        if not completed and process.returncode is None:
+            process.kill()
+        await process.wait()
+
+    def _deadline(self, timeout):
+        timeout = self.timeout if timeout is None else timeout
+        return None if timeout is None else asyncio.get_running_loop().time() + timeout
+
+    def _open_tee(self, command, mode, fpath):
+        """Return binary file to copy output to, or None"""
+
+        if fpath is None:
+            fpath = self.DEFAULT_PATH
+        if isinstance(command, str) and '>' in command:
+            logging.warning(f"Command already pipes output to {command.split('>')[-1]}: will not change this")
+            return None
+        if not fpath:
+            return None
+
+        return open(fpath, 'ab' if 'a' in mode else 'wb')
+
+    async def run_chifra(self, command, mode='w', parse_as='json', fpath=None, timeout=None):
+        """Call chifra command and return the output as a JSON object (or None on error)
+
+        command: chifra call as you would provide in command line, or list of
+            arguments (see build_chifra_args) to run it without a shell
+        parse_as: try to load the result as JSON or as a list of items, one on
+            each line, or return the raw output as 'bytes'
+        mode: overwrite or append to file
+        fpath: save output to a specified filepath, or pass False to suppress
+            file save (otherwise, saves to default JSON file)
+        timeout: (optional) seconds after which chifra is killed and None returned
+        """
+
+        assert parse_as in ['json', 'lines', 'bytes'], "Only 'json', 'lines' and 'bytes' (e.g., for result of chifra list) are supported parse_as values"
+
+        deadline = self._deadline(timeout)
+        tee = self._open_tee(command, mode, fpath)
+        result = None
+        try:
+            process = await self._spawn(command)
+            completed = False
+            chunks = []
+            try:
+                while True:
+                    chunk = await self._read(process, deadline)
+                    if not chunk:
+                        break
+                    if tee is not None:
+                        tee.write(chunk)
+                    chunks.append(chunk)
+                completed = True
+            finally:
+                await self._finish(process, completed)
+
+            output = b"".join(chunks)
+            if parse_as != 'bytes':
+                # NOTE: excapes all backslashes to prevent invalid \escape JSONDecoderError
+                output = output.decode('utf-8', errors='replace').replace('\\', '\\\\')
+
+            if parse_as == 'bytes':
+                if process.returncode == 0:
+                    result = output
+                else:
+                    logging.error(f"chifra exited with code {process.returncode}: {command}")
+
+            elif parse_as == 'json':
+                try:
+                    result = json.loads(output)
+                except json.decoder.JSONDecodeError:
+                    logging.warning("Could not parse chifra result as JSON")
+
+            elif parse_as == 'lines':
+                result = [s.strip() for s in output.splitlines()]
+
+        except asyncio.TimeoutError:
+            logging.error(f"chifra timed out: {command}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(e)
+        finally:
+            if tee is not None:
+                tee.close()
+
+        return result
+
+    async def stream_chifra(self, command, mode='w', fpath=None, stats=None, timeout=None):
+        """Call chifra command with JSON output and asynchronously yield the items
+        of its 'data' array one at a time as they are parsed from the pipe
+
+        mode: overwrite or append to file
+        fpath: save raw output to a specified filepath, or pass False to suppress
+            file save (otherwise, saves to default JSON file)
+        stats: (optional) dictionary updated with 'bytes' read, 'returncode'
+            and 'ok' (output fully parsed and chifra exited successfully)
+        timeout: (optional) seconds after which chifra is killed and
+            asyncio.TimeoutError raised
+        """
+
+        deadline = self._deadline(timeout)
+        tee = self._open_tee(command, mode, fpath)
+        process = await self._spawn(command)
+        stream = JsonArrayStream(key='data')
+        nbytes = 0
+        completed = False
+        try:
+            while True:
+                chunk = await self._read(process, deadline)
+                if not chunk:
+                    items = stream.close()
+                else:
+                    nbytes += len(chunk)
+                    if tee is not None:
+                        tee.write(chunk)
+                    items = stream.feed(chunk)
+                for item in items:
+                    yield item
+                if not chunk:
+                    break
+            completed = True
+        except json.decoder.JSONDecodeError as e:
+            logging.warning(f"Could not parse chifra result as JSON: {e}")
+        finally:
+            if tee is not None:
+                tee.close()
+            await self._finish(process, completed)
+
+        if completed and process.returncode != 0:
+            logging.warning(f"chifra exited with code {process.returncode}")
+        if stats is not None:
+            stats.update({
+                'bytes': nbytes,
+                'returncode': process.returncode,
+                'ok': completed and process.returncode == 0
+            })
+
+    async def get_status(self, timeout=None):
+        """Return the output of `chifra status` ({'data': [status], 'meta':
+        {'finalized': ..., ...}}), or None on error
+        """
+
+        return await self.run_chifra([self.chifra, 'status', '--fmt', 'json'], fpath=False, timeout=timeout)
+
+    async def get_appearances(self, addresses, firstBlock=None, lastBlock=None, timeout=None):
+        """Get the appearances of many addresses from the index, listing as many
+        addresses per chifra call as fit on a command line; return dictionary of
+        lowercase address -> Appearances (or None on error)
+
+        firstBlock, lastBlock: (optional) only list appearances in this block range
+        """
+
+        kwargs = {}
+        if firstBlock is not None:
+            kwargs['first_block'] = firstBlock
+        if lastBlock is not None:
+            kwargs['last_block'] = lastBlock
+
+        chunker = AdaptiveChunker(initialSize=len(addresses), maxSize=max(1, len(addresses)))
+        result = {}
+        start = 0
+        while start < len(addresses):
+            chunk = chunker.next_chunk(addresses, start)
+            cmd = self.build_chifra_args({'function': 'list', 'value': chunk, 'format': 'txt', 'kwargs': kwargs})
+            output = await self.run_chifra(cmd, parse_as='bytes', fpath=False, timeout=timeout)
+            if output is None:
+                return None
+            result.update(parse_chifra_list(output, addresses=chunk))
+            start += len(chunk)
+
+        return result
+
+    async def _run_chunk(self, params, chunk, delay=0, timeout=None, fpath=None):
+        """Run chifra on one chunk of values, saving its raw output to fpath if
+        given; return (records, seconds, stats)
+        """
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        loop = asyncio.get_running_loop()
+        stats = {}
+        t0 = loop.time()
+        cmd = self.build_chifra_args({**params, 'value': chunk})
+        try:
+            records = [r async for r in self.stream_chifra(cmd, fpath=fpath or False, stats=stats, timeout=timeout)]
+        except asyncio.TimeoutError:
+            logging.warning(f"chifra {params['function']} timed out on chunk of {len(chunk)} values")
+            records = []
+
+        return records, loop.time() - t0, stats
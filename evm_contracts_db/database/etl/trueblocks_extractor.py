@@ -1,140 +1,187 @@
-import os
-import json
-import subprocess
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from evm_contracts_db.database.etl.trueblocks_async import AsyncTrueblocksExtractor
+from utils.files import save_json
 
-class TrueblocksExtractor:
+
+def iterate_async(agen):
+    """Iterate over an async generator from synchronous code, on a private event loop"""
+
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        # Closing early runs the generator's cleanup (e.g., killing chifra)
+        loop.run_until_complete(agen.aclose())
+        loop.close()
+
+
+class ChunkedExtractor:
+    """Synchronous wrapper around an AsyncChunkedExtractor (self.aio): chunked
+    queries, appearances and transaction ids, on a private event loop. See
+    TrueblocksExtractor (chifra) and TrueblocksApiExtractor (chifra serve).
+    """
+
+    def __init__(self, aio):
+        self.aio = aio
+
+    def close(self):
+        """See AsyncChunkedExtractor.close"""
+
+        self.aio.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def maxWorkers(self):
+        return self.aio.maxWorkers
+
+    @property
+    def cache(self):
+        return self.aio.cache
+
+    @cache.setter
+    def cache(self, cache):
+        self.aio.cache = cache
+
+    def get_status(self, timeout=None):
+        """Return chifra's status and index head ({'data': [status], 'meta':
+        {'finalized': ..., ...}}), or None on error
+        """
+
+        return asyncio.run(self.aio.get_status(timeout=timeout))
+
+    def run_many(self, fcn, items, ordered=True, maxWorkers=None):
+        """Apply fcn (e.g., get_txids) to each item on a pool of maxWorkers
+        threads, each waiting on its own chifra process, and yield (item, result)
+        pairs in the order of items, or as they complete if ordered=False
+        """
+
+        maxWorkers = maxWorkers or self.maxWorkers
+        with ThreadPoolExecutor(max_workers=maxWorkers) as pool:
+            futures = {pool.submit(fcn, item): item for item in items}
+            for future in (futures if ordered else as_completed(futures)):
+                yield futures[future], future.result()
+
+    def iter_chifra_chunks(self, params, **kwargs):
+        """Run a chifra query whose value is a list in chunks on concurrent chifra
+        processes, yielding (chunk values, list of parsed records) for each chunk
+        in order (see AsyncChunkedExtractor.iter_chifra_chunks)
+        """
+
+        return iterate_async(self.aio.iter_chifra_chunks(params, **kwargs))
+
+    def iter_records(self, params, **kwargs):
+        """Yield the parsed records (traces, transactions) of a chifra query
+        with a list value as its chunks complete, in order (see
+        iter_chifra_chunks)
+        """
+
+        return iterate_async(self.aio.iter_records(params, **kwargs))
+
+    def run_chifra_chunked(self, params, fpath=None, **kwargs):
+        """Run a chifra query with a list value in chunks (see iter_chifra_chunks)
+        and merge the results into a single {'data': [...]} dictionary; values of
+        chunks that could not be run are listed under 'failed'. The merged
+        result is held in memory; use iter_chifra_chunks (or iter_records) to
+        process a large query chunk by chunk.
+
+        fpath: (optional) save merged result to a specified filepath
+        """
+
+        failed = []
+        data = []
+        for chunk, records in self.iter_chifra_chunks(params, failed=failed, **kwargs):
+            data.extend(records)
+        result = {'data': data, 'failed': failed}
+
+        if len(failed) > 0:
+            logging.warning(f"chifra {params['function']} failed for {len(failed)} of {len(params['value'])} values")
+        if fpath:
+            save_json(result, fpath)
+
+        return result
+
+    def get_txids(self, address, firstBlock=None, timeout=None):
+        """Get list of all transaction IDs ("blockNumber.transactionIndex") for an address from the index
+
+        firstBlock: (optional) only list appearances from this block on
+        """
+
+        return asyncio.run(self.aio.get_txids(address, firstBlock=firstBlock, timeout=timeout))
+
+    def get_appearances(self, addresses, firstBlock=None, lastBlock=None, timeout=None):
+        """Get the appearances of many addresses from the index, with as few
+        chifra calls as possible (see AsyncTrueblocksExtractor.get_appearances)
+        """
+
+        return asyncio.run(self.aio.get_appearances(addresses, firstBlock=firstBlock, lastBlock=lastBlock, timeout=timeout))
+
+
+class TrueblocksExtractor(ChunkedExtractor):
     """Run chifra commands and extract, transform, and load the outputs of these
     e.g., `chifra traces --articulate --fmt json [addresses]` 
 
-    To support setups other than a single machine, probably want to switch to
-    the REST api: https://trueblocks.io/api/
+    This is a synchronous wrapper around AsyncTrueblocksExtractor (self.aio),
+    which asyncio code should use directly.
+
+    To query a TrueBlocks REST server (chifra serve) instead of running chifra
+    locally, see TrueblocksApiExtractor.
     """
 
-    def build_chifra_command(self, params):
-        """Build a chifra command to run by subprocess
-        
-        params: dictionary with the following keys:
-            function: e.g., list, export
-            value: single value or list of values to provide to command (e.g., address(es), transaction(s))
-            format: (optional) e.g., csv, json
-            args: (optional) list of flags to provide
-            kwargs: (optional) dictionary of other keyword:value pairs for chifra
-            postprocess: (optional) string corresponding to command line postprocessing commands
-            filepath: (optional) provide file path to pipe output to
+    def __init__(self, chifra='chifra', maxWorkers=1, timeout=None, cache=None):
+        """chifra: name or path of the chifra executable
+        maxWorkers: default number of chifra processes to run concurrently
+        timeout: default timeout for each command, in seconds
+        cache: (optional) ChifraCache of chunked query results
         """
 
-        assert ('function' in params.keys()) and ('value' in params.keys()), "Provide both a function and a value"
-
-        # Get required arguments
-        fcn = params['function']
-        addresses = params['value']
-        if isinstance(addresses, list):
-            addresses = " ".join(addresses)
-
-        # Set optional arguments
-        postprocess = params.get('postprocess', None)
-
-        # Set export format if provided
-        if params.get('format', None) is not None:
-            format = f"--fmt {params['format']}"
-        else:
-            format = None
-
-        # Add flags
-        if params.get('args', None) is not None:
-            argsList = [f"--{f.strip('-')}" for f in params.get('args')]
-        else:
-            argsList = []
-
-        # Add keyword arguments if provided
-        if params.get('kwargs', None) is not None:
-            kwargsList = [f"--{k.strip('-')} {v}" for k, v in params.get('kwargs').items()]
-        else:
-            kwargsList = []
-
-        # Pipe output to file if filepath provided
-        if params.get('filepath', None) is not None:
-            pipeTo = f"> {params['filepath']}"
-        else:
-            pipeTo = None
-
-        # Build list
-        argList = ["chifra", fcn, *argsList, *kwargsList, addresses]
-        if format:
-            argList.insert(-1, format)
-        if postprocess:
-            argList.append(postprocess)
-        if pipeTo:
-            argList.append(pipeTo)
-        
-        # Return string to send to subprocess
-        return " ".join(argList)
-
-    def run_chifra(self, command, mode='w', parse_as='json', fpath=None):
+        super().__init__(AsyncTrueblocksExtractor(chifra=chifra, maxWorkers=maxWorkers, timeout=timeout, cache=cache))
+
+    def build_chifra_args(self, params):
+        """See AsyncTrueblocksExtractor.build_chifra_args"""
+
+        return self.aio.build_chifra_args(params)
+
+    def build_chifra_command(self, params):
+        """See AsyncTrueblocksExtractor.build_chifra_command"""
+
+        return self.aio.build_chifra_command(params)
+
+    def run_chifra(self, command, mode='w', parse_as='json', fpath=None, timeout=None):
         """Call chifra command and return the output as a JSON object
 
-        command: chifra call as you would provide in command line
+        command: chifra call as you would provide in command line, or list of
+            arguments (see build_chifra_args) to run it without a shell
         parse_as: try to load the result as JSON or as a list of items, one on 
-            each line
+            each line, or 'stream' to return a generator over the items of the
+            JSON 'data' array (see stream_chifra)
         mode: overwrite or append to file
         fpath: save output to a specified filepath, or pass False to suppress 
             file save (otherwise, saves to default JSON file)
         """
 
-        DEFAULT_PATH = 'tmp/trueblocks.log'
-
-        assert parse_as in ['json', 'lines'], "Only 'json' and 'lines' (e.g., for result of chifra list) are supported parse_as values"
-        if fpath is None:
-            fpath = DEFAULT_PATH
-        elif fpath is False:
-            fpath = None
-
-        # Redirect output to fpath using pipe 
-        if '>' not in command and fpath is not None:
-            if 'w' in mode:
-                m = ''
-            elif 'a' in mode:
-                m = ' -a'
-            command = command + f"| tee{m} {fpath}"
-        else:
-            fpath = command.split('>')[-1]
-            logging.warning(f"Command already pipes output to {fpath}: will not change this")
-
-        try:
-            # Run command and parse output as either JSON or a list of lines
-            # NOTE: excapes all backslashes to prevent invalid \escape JSONDecoderError
-            process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
-            result_lines = [line.decode('utf-8', errors='replace').replace('\\','\\\\') for line in process.stdout]
-
-            if parse_as == 'json': 
-                result_str = "".join(result_lines)
-                try:
-                    result = json.loads(result_str)
-                except json.decoder.JSONDecodeError:
-                    logging.warning("Could not parse chifra result as JSON")
-                    result = None
-
-            elif parse_as == 'lines':
-                result = [s.strip() for s in result_lines]
-
-        except Exception as e:
-            logging.error(e)
-            result = None
+        assert parse_as in ['json', 'lines', 'stream'], "Only 'json', 'lines' (e.g., for result of chifra list) and 'stream' are supported parse_as values"
+        if parse_as == 'stream':
+            return self.stream_chifra(command, mode=mode, fpath=fpath, timeout=timeout)
 
-        return result
-
-    def get_txids(self, address):
-        """Get list of all transaction IDs for an address from the index"""
+        return asyncio.run(self.aio.run_chifra(command, mode=mode, parse_as=parse_as, fpath=fpath, timeout=timeout))
 
-        query_list = {
-            'function': 'list', 
-            'value': address, 
-            'postprocess': "| cut -f2,3 | tr '\t' '.' | grep -v blockNumber"
-        }
-        
-        cmd = self.build_chifra_command(query_list)
-        txIds= self.run_chifra(cmd, parse_as='lines')
+    def stream_chifra(self, command, mode='w', fpath=None, stats=None, timeout=None):
+        """Call chifra command with JSON output and yield the items of its 'data'
+        array one at a time as they are parsed from the pipe, so that memory use
+        does not depend on the size of the result (see
+        AsyncTrueblocksExtractor.stream_chifra)
+        """
 
-        return txIds
+        return iterate_async(self.aio.stream_chifra(command, mode=mode, fpath=fpath, stats=stats, timeout=timeout))
@@ -1,7 +1,43 @@
+import io
+import json
 import logging
-from django.db import transaction
+from django.db import connection, models, transaction
 
 from evm_contracts_db.database.models import blockchain
+from evm_contracts_db.database.etl.address_resolver import AddressResolver
+from evm_contracts_db.database.etl.block_timestamps import BlockTimestamps
+from evm_contracts_db.database.etl.partitions import BlockPartitions
+from utils.blockchain import pack_txid, unpack_compressed_call, word_to_bytes, TX_INDEX_BITS, ZERO_ADDRESS
+
+
+def _copy_value(value):
+    """Format a single value for Postgres COPY ... FROM STDIN (text format)"""
+
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        value = 't' if value else 'f'
+    elif isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, float):
+        value = repr(value)
+    elif isinstance(value, bytes):
+        value = '\\x' + value.hex() # bytea hex format
+    else:
+        value = str(value)
+
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Stream rows (iterable of tuples) into table with a single COPY statement"""
+
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(v) for v in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
 
 
 class TrueblocksLoader:
@@ -14,40 +50,168 @@ class TrueblocksLoader:
         else:
             self.chain = chain
 
-    def insert_transactions(self, dataDicts, includeTraces=False):
-        """Upload all blockchain transactions in file"""
+        self.resolver = AddressResolver(chain=self.chain)
+        self.partitions = BlockPartitions()
+
+    def insert_transactions(self, dataDicts, includeTraces=False, bulk=False, batchSize=None):
+        """Upload all blockchain transactions in file
+
+        bulk: write the whole batch with a fixed number of set-based statements
+            (see bulk_insert_transactions) instead of one record at a time
+        batchSize: (optional) load batchSize records per transaction, so that a
+            failure only rolls back the current batch (unless called inside an
+            atomic block)
+        """
+
+        if batchSize is not None and len(dataDicts) > batchSize:
+            for i in range(0, len(dataDicts), batchSize):
+                self.insert_transactions(dataDicts[i:i + batchSize], includeTraces=includeTraces, bulk=bulk)
+            return
+
+        # Partitioned tables need a partition for every block range in the batch
+        self.partitions.ensure(
+            pack_txid(d['transaction_id']) >> TX_INDEX_BITS for d in dataDicts if d is not None and d != {}
+        )
+
+        if bulk:
+            return self.bulk_insert_transactions(dataDicts, includeTraces=includeTraces)
 
         with transaction.atomic():
+            # Resolve every address in the batch up front so each record is a cache hit
+            self.resolver.resolve(self.batch_addresses(dataDicts, includeTraces=includeTraces))
+            BlockTimestamps.store(self.batch_timestamps(dataDicts))
             for d in dataDicts:
                 logging.debug(f"Updating/creating BlockchainTransaction for {d['transaction_id']}...")
-                self.update_or_create_transaction_record(d, includeTraces)
+                self.update_or_create_transaction_record(d, includeTraces=includeTraces)
 
         logging.info(f'Added {len(dataDicts)} transactions to database')
 
-    def update_or_create_address_record(self, address):
+    @staticmethod
+    def batch_addresses(dataDicts, includeTraces=False):
+        """Return set of every address string that appears in a batch of transformer output"""
+
+        addresses = set()
+        for d in dataDicts:
+            if d is None or d == {}:
+                continue
+            addresses.update(d.get(k, '0x0') for k in ['from_address', 'to_address'])
+            addresses.update(d.get('contracts_created', []))
+            addresses.update(d.get('addresses_involved', []))
+            addresses.update(l.get('address', '0x0') for l in d.get('logs', []))
+            if includeTraces:
+                for t in d.get('traces', []):
+                    addresses.update(t.get(k) for k in ['from_address', 'to_address', 'delegate'])
+        addresses.discard(None)
+
+        return addresses
+
+    @staticmethod
+    def batch_timestamps(dataDicts):
+        """Return dictionary of block number -> unix timestamp of the blocks of a
+        batch of transformer output, where chifra gave it
+        """
+
+        return {
+            int(d['block_number']): d['timestamp'] for d in dataDicts
+            if d is not None and d.get('timestamp') is not None and d.get('block_number') is not None
+        }
+
+    def appearance_roles(self, recordDict, includeTraces=False):
+        """Return set of (normalized address, BlockchainAddressAppearance.Role)
+        of every address in a record of transformer output. Addresses that are
+        not from, to or created are 'involved'; the zero address is left out.
+        """
+
+        Role = blockchain.BlockchainAddressAppearance.Role
+        specific = [
+            (Role.FROM, [recordDict.get('from_address')]),
+            (Role.TO, [recordDict.get('to_address')]),
+            (Role.CREATED, recordDict.get('contracts_created', [])),
+        ]
+        involved = list(recordDict.get('addresses_involved', []))
+        involved += [l.get('address') for l in recordDict.get('logs', [])]
+        if includeTraces:
+            involved += [t.get(k) for t in recordDict.get('traces', []) for k in ['from_address', 'to_address', 'delegate']]
+
+        roles = {(self.resolver.normalize(a), role) for role, values in specific for a in values if a is not None}
+        named = {a for a, _ in roles}
+        roles.update(
+            (a, Role.INVOLVED) for a in {self.resolver.normalize(a) for a in involved if a is not None} - named
+        )
+
+        return {(a, role) for a, role in roles if a != ZERO_ADDRESS}
+
+    @staticmethod
+    def decoded_call(name, inputs, compressed):
+        """Return (name, inputs) of a log or trace: as articulated by chifra, or
+        else unpacked from its compressed text (inputs None if neither is there)
+        """
+
+        if inputs is not None or not compressed:
+            return name, inputs
         try:
-            addressObj = blockchain.BlockchainAddress.objects.get(address=address, chain=self.chain)
-        except blockchain.BlockchainAddress.DoesNotExist:
-            addressObj = blockchain.BlockchainAddress.objects.create(address=address, chain=self.chain)
-            addressObj.save()
+            unpacked = unpack_compressed_call(compressed)
+        except ValueError:
+            logging.debug(f"Could not unpack {compressed}")
+            return name, None
+
+        return name or unpacked['name'], unpacked['input']
+
+    @staticmethod
+    def topic_columns(topics):
+        """Return the values of topic0 to topic3 (bytes, or None past the last
+        topic) of a log's list of topics
+        """
+
+        topics = [word_to_bytes(t) for t in (topics or [])]
+        if len(topics) > 4:
+            raise ValueError(f"A log has at most 4 topics, not {len(topics)}")
+
+        return tuple(topics + [None] * (4 - len(topics)))
+
+    def update_or_create_address_record(self, address):
+        """Return the BlockchainAddress of address (see AddressResolver), built
+        from its resolved id rather than read back; its sync marks are
+        deferred, so they are only read if used
+        """
+
+        addressId = self.resolver.resolve_one(address)
 
-        return addressObj
+        return blockchain.BlockchainAddress.from_db(
+            connection.alias, ['id', 'chain', 'address'], [addressId, self.chain, self.resolver.normalize(address)]
+        )
 
     def update_or_create_trace_record(self, traceDict):
+        """Create or update the trace of a transaction, matched on
+        (originating_from_id, trace_path)
+        """
+
         for addressType in ['from_address', 'to_address', 'delegate']:
-            value = traceDict.get(addressType)
+            value = traceDict.pop(addressType, None)
             if value is not None:
-                traceDict[addressType] = self.update_or_create_address_record(value)
-        traceObj = blockchain.BlockchainTransactionTrace.objects.update_or_create(**traceDict)[0]
-        traceObj.save()
+                traceDict[f"{addressType}_id"] = self.resolver.resolve_one(value)
+        traceDict['call_name'], traceDict['call_inputs'] = self.decoded_call(
+            traceDict.get('call_name'), traceDict.get('call_inputs'), traceDict.get('compressed_trace')
+        )
+        lookup = {k: traceDict.pop(k) for k in ['originating_from_id', 'trace_path'] if k in traceDict}
+        traceObj = blockchain.BlockchainTransactionTrace.objects.update_or_create(**lookup, defaults=traceDict)[0]
 
         return traceObj
 
     def update_or_create_log_record(self, logDict):
-        value = logDict.get('address', '0x0')
-        logDict['address'] = self.update_or_create_address_record(value)
-        logObj = blockchain.BlockchainTransactionLog.objects.update_or_create(**logDict)[0]
-        logObj.save()
+        """Create or update the log of a transaction, matched on
+        (originating_from_id, log_index)
+        """
+
+        value = logDict.pop('address', '0x0')
+        logDict['address_id'] = self.resolver.resolve_one(value)
+        for i, topic in enumerate(self.topic_columns(logDict.pop('topics', None))):
+            logDict[f"topic{i}"] = topic
+        logDict['event'], logDict['event_inputs'] = self.decoded_call(
+            logDict.get('event'), logDict.get('event_inputs'), logDict.get('compressed_log')
+        )
+        lookup = {k: logDict.pop(k) for k in ['originating_from_id', 'log_index'] if k in logDict}
+        logObj = blockchain.BlockchainTransactionLog.objects.update_or_create(**lookup, defaults=logDict)[0]
 
         return logObj
 
@@ -56,55 +220,50 @@ class TrueblocksLoader:
 
         if recordDict is None or recordDict == {}:
             return
+
+        # Key the transaction (and its logs and traces) on its packed id
+        txKey = pack_txid(recordDict.pop('transaction_id'))
+        recordDict['tx_key'] = txKey
+
+        # Create BlockchainAddress record for each address appearing in the transaction, if any
+        appearances = self.appearance_roles(recordDict, includeTraces=includeTraces)
+        appearanceIds = self.resolver.resolve(a for a, _ in appearances)
+        recordDict.pop('addresses_involved', None)
+        recordDict.pop('timestamp', None) # stored in the blocks table by insert_transactions
         
         # Create BlockchainAddress record for from and to addresses if they doesn't already exist
         for addressType in ['from_address', 'to_address']:
-            value = recordDict.get(addressType, '0x0')
-            recordDict[addressType] = self.update_or_create_address_record(value)
+            value = recordDict.pop(addressType, '0x0')
+            recordDict[f"{addressType}_id"] = self.resolver.resolve_one(value)
 
         # Create BlockchainAddress record for each created contract, if any
         contractsCreated_orig = recordDict.pop('contracts_created', [])
-        contractsCreated = []
-        for c in contractsCreated_orig:
-            contractsCreated.append(self.update_or_create_address_record(c))
-
-        # Create BlockchainAddress record for each involved address, if any
-        # TODO: find a way to more reliably get all addresses involved. Curently
-        # this is not included in the data model because it was too incomplete.
-        addressesInvolved_orig = recordDict.pop('addresses_involved', [])
-        addressesInvolved = []
-        for c in addressesInvolved_orig:
-            if (c not in contractsCreated) and not (
-                c == recordDict.get('from_address') or c == recordDict.get('from_address')
-            ):
-                addressesInvolved.append(self.update_or_create_address_record(c))
+        contractsCreated = list(self.resolver.resolve(contractsCreated_orig).values())
 
         # Create log record for each log, if any
         logs_orig = recordDict.pop('logs', [])
         logs = []
         for l in logs_orig:
-            logs.append(self.update_or_create_log_record(l))
+            logs.append(self.update_or_create_log_record({**l, 'originating_from_id': txKey}))
 
         # Create trace record for each trace, if any
         if includeTraces:
             traces_orig = recordDict.pop('traces', [])
             traces = []
             for t in traces_orig:
-                traces.append(self.update_or_create_trace_record(t))
+                traces.append(self.update_or_create_trace_record({**t, 'originating_from_id': txKey}))
         else:
             recordDict.pop('traces', None)
 
         # Update or create BlockchainTransaction record
         try:
-            txn = blockchain.BlockchainTransaction.objects.get(transaction_id=recordDict['transaction_id'])
+            txn = blockchain.BlockchainTransaction.objects.get(pk=txKey)
             for key, value in recordDict.items():
                 if key not in ['contracts_created', 'logs', 'traces']:
                     setattr(txn, key, value)
                 else:
                     if key == 'contracts_created':
                         txn.contracts_created.add(*value)
-                    # if key == 'addresses_involved':
-                    #     txn.addresses_involved.add(*value)
                     if key == 'logs':
                         txn.logs.add(*value)
                     if key == 'traces':
@@ -115,10 +274,188 @@ class TrueblocksLoader:
             txn = blockchain.BlockchainTransaction.objects.create(**recordDict)
             txn.save()
             txn.contracts_created.set(contractsCreated)
-            # txn.addresses_involved.set(addressesInvolved)
             txn.logs.set(logs)
             if includeTraces:
                 txn.traces.set(traces)
             logging.debug("Added new transaction to database...")
 
-        return txn
\ No newline at end of file
+        blockchain.BlockchainAddressAppearance.objects.bulk_create(
+            [blockchain.BlockchainAddressAppearance(address_id=appearanceIds[a], tx_id=txKey, role=role) for a, role in appearances],
+            ignore_conflicts=True
+        )
+
+        return txn
+
+    def bulk_insert_transactions(self, dataDicts, includeTraces=False):
+        """Upload a batch of transformer output with a fixed number of set-based
+        statements: each table is COPY'd into a temporary staging table, then
+        merged into its target with INSERT ... ON CONFLICT / UPDATE ... FROM.
+
+        Produces the same records as update_or_create_transaction_record:
+        transactions are updated in place, logs and traces are matched on
+        (originating_from, log_index/trace_path), and every from/to, created,
+        involved, log and trace address gets a BlockchainAddress record and its
+        BlockchainAddressAppearance records.
+        """
+
+        Txn = blockchain.BlockchainTransaction
+        Log = blockchain.BlockchainTransactionLog
+        Trace = blockchain.BlockchainTransactionTrace
+        Created = Txn.contracts_created.through
+        Appearance = blockchain.BlockchainAddressAppearance
+
+        # Deduplicate within the batch (last record wins, as for repeated update_or_create calls)
+        records = {}
+        for d in dataDicts:
+            if d is None or d == {}:
+                continue
+            records[pack_txid(d['transaction_id'])] = d
+        if len(records) == 0:
+            return
+
+        # Collect the rows for each table, keeping addresses as strings for now
+        txnFields = [
+            f.attname for f in Txn._meta.concrete_fields
+            if f.attname not in ['tx_key', 'from_address_id', 'to_address_id']
+        ]
+        txnColumns = ['tx_key'] + [c for c in txnFields if any(c in d for d in records.values())]
+        txnRows, logRows, traceRows, createdRows, appearanceRows = [], {}, {}, set(), set()
+        addresses = set()
+
+        def _address(value):
+            if value is None:
+                return None
+            value = self.resolver.normalize(value)
+            addresses.add(value)
+            return value
+
+        for txKey, d in records.items():
+            fromAddress = _address(d.get('from_address', '0x0'))
+            toAddress = _address(d.get('to_address', '0x0'))
+            txnRows.append((
+                txKey, *[self._field_value(Txn, c, d) for c in txnColumns[1:]], fromAddress, toAddress
+            ))
+            for c in d.get('contracts_created', []):
+                createdRows.add((txKey, _address(c)))
+            for a, role in self.appearance_roles(d, includeTraces=includeTraces):
+                appearanceRows.add((_address(a), txKey, role))
+            for l in d.get('logs', []):
+                logRows[(txKey, int(l['log_index']))] = (
+                    int(l['log_index']), _address(l.get('address', '0x0')), *self.topic_columns(l.get('topics')),
+                    *self.decoded_call(l.get('event'), l.get('event_inputs'), l.get('compressed_log')),
+                    l.get('compressed_log'), txKey
+                )
+            if includeTraces:
+                for t in d.get('traces', []):
+                    tracePath = tuple(t.get('trace_path', []))
+                    pathArray = "{" + ",".join(str(i) for i in tracePath) + "}" # integer[] in COPY text format
+                    traceRows[(txKey, tracePath)] = (
+                        pathArray, _address(t.get('from_address')), _address(t.get('to_address')),
+                        float(t['value']) if t.get('value') is not None else None,
+                        *self.decoded_call(t.get('call_name'), t.get('call_inputs'), t.get('compressed_trace')),
+                        t.get('compressed_trace'), t.get('error'), t.get('outputs', {}), _address(t.get('delegate')), txKey
+                    )
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Addresses: one SELECT for those not cached, one INSERT for those missing
+            addressIds = self.resolver.resolve(addresses)
+
+            # Block timestamps
+            BlockTimestamps.store(self.batch_timestamps(records.values()))
+
+            def _id(value):
+                return addressIds[value] if value is not None else None
+
+            # Transactions: upsert on the primary key
+            columns = txnColumns + ['from_address_id', 'to_address_id']
+            self._stage(cursor, 'staging_transactions', Txn._meta.db_table, columns)
+            copy_rows(cursor, 'staging_transactions', columns, (
+                (*row[:-2], _id(row[-2]), _id(row[-1])) for row in txnRows
+            ))
+            updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns if c != 'tx_key')
+            cursor.execute(
+                f"""INSERT INTO {Txn._meta.db_table} ({', '.join(columns)})
+                SELECT {', '.join(columns)} FROM staging_transactions
+                ON CONFLICT (tx_key) DO UPDATE SET {updates}"""
+            )
+
+            # Contracts created
+            columns = ['blockchaintransaction_id', 'blockchainaddress_id']
+            self._stage(cursor, 'staging_contracts_created', Created._meta.db_table, columns)
+            copy_rows(cursor, 'staging_contracts_created', columns, (
+                (txKey, _id(c)) for txKey, c in createdRows
+            ))
+            cursor.execute(
+                f"""INSERT INTO {Created._meta.db_table} ({', '.join(columns)})
+                SELECT {', '.join(columns)} FROM staging_contracts_created
+                ON CONFLICT DO NOTHING"""
+            )
+
+            # Appearances
+            columns = ['address_id', 'tx_key', 'role']
+            self._stage(cursor, 'staging_appearances', Appearance._meta.db_table, columns)
+            copy_rows(cursor, 'staging_appearances', columns, (
+                (_id(a), txKey, role) for a, txKey, role in appearanceRows
+            ))
+            cursor.execute(
+                f"""INSERT INTO {Appearance._meta.db_table} ({', '.join(columns)})
+                SELECT {', '.join(columns)} FROM staging_appearances
+                ON CONFLICT DO NOTHING"""
+            )
+
+            # Logs and traces: update rows already attached to the transaction, insert the rest
+            children = [
+                (Log, 'log_index', ['log_index', 'address_id', 'topic0', 'topic1', 'topic2', 'topic3', 'event',
+                 'event_inputs', 'compressed_log', 'originating_from_id'], logRows.values(), [1]),
+            ]
+            if includeTraces:
+                children.append(
+                    (Trace, 'trace_path', ['trace_path', 'from_address_id', 'to_address_id', 'value', 'call_name',
+                     'call_inputs', 'compressed_trace', 'error', 'outputs', 'delegate_id', 'originating_from_id'],
+                     traceRows.values(), [1, 2, 9])
+                )
+            for model, key, columns, rows, addressColumns in children:
+                table = model._meta.db_table
+                staging = f"staging_{table}"
+                self._stage(cursor, staging, table, columns)
+                copy_rows(cursor, staging, columns, (
+                    tuple(_id(v) if i in addressColumns else v for i, v in enumerate(row)) for row in rows
+                ))
+                updates = ", ".join(f"{c} = s.{c}" for c in columns if c not in [key, 'originating_from_id'])
+                cursor.execute(
+                    f"""UPDATE {table} t SET {updates} FROM {staging} s
+                    WHERE t.originating_from_id = s.originating_from_id AND t.{key} = s.{key}"""
+                )
+                cursor.execute(
+                    f"""INSERT INTO {table} ({', '.join(columns)})
+                    SELECT {', '.join(f's.{c}' for c in columns)} FROM {staging} s
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {table} t
+                        WHERE t.originating_from_id = s.originating_from_id AND t.{key} = s.{key}
+                    )"""
+                )
+
+        logging.info(f'Added {len(records)} transactions to database')
+
+    @staticmethod
+    def _field_value(model, attname, recordDict):
+        """Value to stage for a model field, falling back to the field default"""
+
+        field = model._meta.get_field(attname)
+        if attname in recordDict:
+            value = recordDict[attname]
+        elif field.has_default():
+            value = field.get_default()
+        else:
+            return None
+
+        return float(value) if isinstance(field, models.FloatField) and value is not None else value
+
+    @staticmethod
+    def _stage(cursor, staging, table, columns):
+        """Create an empty temporary table with the given columns of table"""
+
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+        cursor.execute(
+            f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {', '.join(columns)} FROM {table} WITH NO DATA"
+        )
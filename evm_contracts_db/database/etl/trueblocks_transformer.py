@@ -1,3 +1,4 @@
+import re
 import logging
 from pprint import pformat
 
@@ -6,101 +7,237 @@ from utils.blockchain import load_txid
 from utils.strings import camel_to_snake, could_be_address
 
 
+def parse_trace_address(traceAddress):
+    """Return a chifra traceAddress as a tuple of ints; the originating call
+    (traceAddress None or empty) is the empty tuple
+    """
+
+    if traceAddress is None:
+        return ()
+    if isinstance(traceAddress, (list, tuple)):
+        return tuple(int(i) for i in traceAddress)
+
+    return tuple(int(i) for i in re.findall(r'\d+', str(traceAddress)))
+
+
+class TraceNode:
+    """Node of a transaction's call tree, keyed on traceAddress"""
+
+    __slots__ = ['trace', 'children']
+
+    def __init__(self, trace=None):
+        self.trace = trace
+        self.children = {}
+
+    def insert(self, path, trace):
+        """Add trace at path (tuple of ints), creating intermediate nodes as needed.
+        Returns the new node, or None if a trace was already stored at that path.
+        """
+
+        node = self
+        for i in path:
+            node = node.children.setdefault(i, TraceNode())
+        if node.trace is not None:
+            return None
+        node.trace = trace
+        return node
+
+    def delegate_chain(self):
+        """Follow delegatecalls that forward this call (same sender context and
+        calldata) as deep as they go and return the list of delegated-to traces
+        """
+
+        trace = self.trace
+        sender = trace.get('action', {}).get('to')
+        compressedTrace = trace.get('compressedTrace', "")
+
+        chain = []
+        node = self
+        while node is not None:
+            nextNode = None
+            for i in sorted(node.children):
+                d = node.children[i].trace
+                if d is not None and (
+                    d.get('action', {}).get('callType', '') == 'delegatecall' and
+                    d['action'].get('from') == sender and
+                    d.get('compressedTrace', "") == compressedTrace
+                ):
+                    chain.append(d)
+                    nextNode = node.children[i]
+                    break
+            node = nextNode
+
+        return chain
+
+
 class TrueblocksTransformer:
 
+    def __init__(self, articulator=None):
+        """articulator: (optional) Articulator of chifra output run without
+        --articulate, applied to the records before they are transformed
+        """
+
+        self.articulator = articulator
+
     def transform_chifra_trace_result(self, result):
         """From result of chifra traces, return list of nested dictionaries corresponding to unique transactions records"""
 
-        txList = []
-        data = result['data']
-        data = [{**trace, 'transactionId': load_txid(trace['blockNumber'], trace['transactionIndex'])} for trace in data]
-
-        # Group traces by transaction hash and extract relevant information
-        uniqueTxs = list(set([trace['transactionId'] for trace in data]))
-        for txId in uniqueTxs:
-            txData = {'transaction_id': txId}
-            traces = [t for t in data if t['transactionId'] == txId]
-
-            # Get data on originating transaction
-            _origin = [t for t in traces if t["traceAddress"] is None]
-            if len(_origin) == 0:
-                # I hope this never happens...
-                logging.warning(f"Could not find a trace without a traceAddress for txn {txId}; expected 1. Skipping...")
-                continue            
-            elif len(_origin) > 1:
-                # Not sure why this happens - don't see anything odd upon inspection of Trueblocks output.
-                # When it finds two, it repeats the same one twice, so okay to proceed
-                logging.warning(f"Found {len(_origin)} traces with no traceAddress for txn {txId}; expected 1. Using the first one found...")
-            origin = _origin[0]
-            for key in ['transactionHash', 'blockNumber']:
-                txData[camel_to_snake(key)] = origin.get(key)
-            for key in ['from', 'to']:
-                txData[f"{key}_address"] = origin['action'][key]
-            txData['value'] = origin['action']['value']
+        if self.articulator is not None:
+            self.articulator.articulate_traces(result['data'])
 
-            aT = origin.get('articulatedTrace', {})
-            txData['call_name'] = aT.get('name')
-            txData['call_inputs'] = aT.get('inputs')
-            txData['call_outputs'] = aT.get('outputs')
+        # Group traces by transaction in a single pass, keeping the order in which transactions first appear
+        groups = {}
+        for trace in result['data']:
+            groups.setdefault((trace['blockNumber'], trace['transactionIndex']), []).append(trace)
 
-            # Get list of contracts created as a result of that transaction
-            contractsCreated = []
-            _creations = [t for t in traces if t.get('action', {}).get('callType', '') == 'creation']
-            for trace in _creations:
-                address = trace['result']['newContract']
-                contractsCreated.append(address)
-            txData['contracts_created'] = contractsCreated
-
-            # BlockchainTransactionTrace model: Lump together remaining compressedTrace + output information, tacking on delegation if found
-            # Warning: only captures the first iteration of call delegation! (not a deeper callstack)
-            _calls = [t for t in traces if t.get('action', {}).get('callType', '') == 'call' and t["traceAddress"] is not None]
-            _delegatecalls = [t for t in traces if t.get('action', {}).get('callType', '') == 'delegatecall' and t["traceAddress"] is not None]
-            calls = []
-            for trace in _calls:
-                try:
-                    call = {'id': f"{txId}.{trace['traceAddress']}"}
-                    action = trace.get('action', {})
-                    for key in ['from', 'to']:
-                        call[f"{key}_address"] = action.get(key)
-                    call['compressed_trace'] = trace.get('compressedTrace', "")
-                    call['value'] = action.get('value')
-                    call['error'] = trace.get('error')
-                    call['outputs'] = trace.get('result', {}).get('output')
-                    delegates = [
-                        d['action']['to'] for d in _delegatecalls if (
-                            d['action']['from'] == action.get('to') and
-                            d.get('compressedTrace', "") == trace.get('compressedTrace', "") and
-                            d['traceAddress'].startswith(trace['traceAddress'])
-                        )
-                    ]
-                    call['delegate'] = delegates[0] if len(delegates) > 0 else None
-                    calls.append(call)
-                except KeyError as e:
-                    logging.warning(e)
-                    logging.debug(pformat(trace))
-                    
-            txData['traces'] = calls
-
-            # Add transaction to list
-            txList.append(txData)
+        txList = []
+        for (blockNumber, transactionIndex), traces in groups.items():
+            txData = self.transform_chifra_transaction_traces(load_txid(blockNumber, transactionIndex), traces)
+            if txData is not None:
+                txList.append(txData)
 
         return txList
 
+    def iter_chifra_trace_records(self, traces):
+        """From an iterable of chifra traces sorted by transaction (as chifra
+        outputs them for sorted transaction ids, e.g. from
+        TrueblocksExtractor.iter_records), yield each transaction record as
+        soon as the last of its traces has been seen
+
+        Only the traces of the current transaction are held in memory (and
+        the batch of traces being articulated, if any). Raises ValueError on
+        a trace of an earlier transaction than the current one, as its
+        transaction would otherwise be yielded twice, each time with only
+        part of its traces (see transform_chifra_trace_result for unsorted
+        traces).
+        """
+
+        if self.articulator is not None:
+            traces = self.articulator.iter_articulated(traces, self.articulator.articulate_traces)
+
+        key = None
+        group = []
+        for trace in traces:
+            traceKey = (trace['blockNumber'], trace['transactionIndex'])
+            if traceKey != key:
+                if key is not None and traceKey < key:
+                    raise ValueError(f"Traces are not sorted by transaction: {load_txid(*traceKey)} after {load_txid(*key)}")
+                if len(group) > 0:
+                    txData = self.transform_chifra_transaction_traces(load_txid(*key), group)
+                    if txData is not None:
+                        yield txData
+                key = traceKey
+                group = []
+            group.append(trace)
+
+        if len(group) > 0:
+            txData = self.transform_chifra_transaction_traces(load_txid(*key), group)
+            if txData is not None:
+                yield txData
+
+    def transform_chifra_transaction_traces(self, txId, traces):
+        """From all chifra traces of a single transaction, return its nested transaction record
+        (or None if the originating trace is missing)
+        """
+
+        # Index traces as a call tree
+        root = TraceNode()
+        nodes = []
+        duplicateOrigins = 0
+        for trace in traces:
+            path = parse_trace_address(trace.get('traceAddress'))
+            node = root.insert(path, trace)
+            if node is None:
+                if len(path) == 0:
+                    duplicateOrigins += 1
+            elif len(path) > 0:
+                nodes.append(node)
+
+        txData = {'transaction_id': txId}
+
+        # Get data on originating transaction
+        origin = root.trace
+        if origin is None:
+            # I hope this never happens...
+            logging.warning(f"Could not find a trace without a traceAddress for txn {txId}; expected 1. Skipping...")
+            return None
+        elif duplicateOrigins > 0:
+            # Not sure why this happens - don't see anything odd upon inspection of Trueblocks output.
+            # When it finds two, it repeats the same one twice, so okay to proceed
+            logging.warning(f"Found {duplicateOrigins + 1} traces with no traceAddress for txn {txId}; expected 1. Using the first one found...")
+        for key in ['transactionHash', 'blockNumber', 'timestamp']:
+            txData[camel_to_snake(key)] = origin.get(key)
+        for key in ['from', 'to']:
+            txData[f"{key}_address"] = origin['action'][key]
+        txData['value'] = origin['action']['value']
+
+        aT = origin.get('articulatedTrace', {})
+        txData['call_name'] = aT.get('name')
+        txData['call_inputs'] = aT.get('inputs')
+        txData['call_outputs'] = aT.get('outputs')
+
+        # Get list of contracts created as a result of that transaction
+        contractsCreated = []
+        for trace in [origin] + [node.trace for node in nodes]:
+            if trace.get('action', {}).get('callType', '') == 'creation':
+                contractsCreated.append(trace['result']['newContract'])
+        txData['contracts_created'] = contractsCreated
+
+        # BlockchainTransactionTrace model: Lump together remaining compressedTrace + output information,
+        # tacking on the final implementation reached through the call's delegatecall chain, if any
+        calls = []
+        for node in nodes:
+            trace = node.trace
+            if trace.get('action', {}).get('callType', '') != 'call':
+                continue
+            try:
+                call = {'trace_path': list(parse_trace_address(trace['traceAddress']))}
+                action = trace.get('action', {})
+                for key in ['from', 'to']:
+                    call[f"{key}_address"] = action.get(key)
+                articulated = trace.get('articulatedTrace', {})
+                call['call_name'] = articulated.get('name')
+                call['call_inputs'] = articulated.get('inputs')
+                call['compressed_trace'] = trace.get('compressedTrace', "")
+                call['value'] = action.get('value')
+                call['error'] = trace.get('error')
+                call['outputs'] = trace.get('result', {}).get('output')
+                delegates = node.delegate_chain()
+                call['delegate'] = delegates[-1]['action']['to'] if len(delegates) > 0 else None
+                calls.append(call)
+            except KeyError as e:
+                logging.warning(e)
+                logging.debug(pformat(trace))
+
+        txData['traces'] = calls
+
+        return txData
+
     def transform_chifra_transaction_result(self, result):
         """From result of chifra transactions, return list of nested dictionaries corresponding to unique transactions records
         Does not get contracts_created or traces!"""
 
-        txList = []
         data = result.get('data')
         if data is None:
             logging.warning("'data' not found in transaction result")
             return []
 
-        for tx in data:
+        return list(self.iter_chifra_transaction_records(data))
+
+    def iter_chifra_transaction_records(self, transactions):
+        """From an iterable of chifra transactions, yield each transaction
+        record as it is transformed (see transform_chifra_transaction_result)
+        """
+
+        if self.articulator is not None:
+            transactions = self.articulator.iter_articulated(transactions, self.articulator.articulate_transactions)
+
+        for tx in transactions:
             txId = load_txid(tx['blockNumber'], tx['transactionIndex'])
             txData = {
                 'transaction_id': txId,
                 'block_number': tx.get('blockNumber'),
+                'timestamp': tx.get('timestamp'), # unix, of the block
                 'transaction_hash': tx.get('hash'),
                 'value': tx.get('value'),
             }
@@ -124,13 +261,13 @@ class TrueblocksTransformer:
             for log in tx.get('receipt', {}).get('logs', []):
                 #if log['address'] == txData['to_address']:
                 logData = {}
-                logData['log_index'] = f"{txId}.{log['logIndex']}"
+                logData['log_index'] = int(log['logIndex'])
                 logData['address'] = log['address']
-                #topics = " ".join([t for t in log.get('topics', [])])
-                #logData['topics'] = topics if len(topics) > 0 else None
+                logData['topics'] = log.get('topics', [])
                 #logData['data'] = log.get('data)
                 articulatedLog = log.get('articulatedLog', {})
                 logData['event'] = articulatedLog.get('name')
+                logData['event_inputs'] = articulatedLog.get('inputs')
                 logData['compressed_log'] = log.get('compressedLog')
                 logs.append(logData)
 
@@ -144,7 +281,4 @@ class TrueblocksTransformer:
 
             txData['addresses_involved'] = list(set(addresses_involved))
 
-            # Add transaction to list
-            txList.append(txData)
-
-        return txList
\ No newline at end of file
+            yield txData
\ No newline at end of file
@@ -0,0 +1,37 @@
+import logging
+from django.core.management.base import BaseCommand
+
+from evm_contracts_db.database.models.blockchain import BlockchainTransaction
+from evm_contracts_db.database.etl.block_timestamps import BlockTimestamps, fetch_rpc_timestamps
+
+
+class Command(BaseCommand):
+    help = "Fill the blocks table with the timestamps of blocks of loaded transactions, from batched RPC requests"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rpc', default=None, help="JSON-RPC endpoint (default: RPC_KEY)")
+        parser.add_argument('--batch-size', type=int, default=100, help="blocks per RPC request")
+        parser.add_argument('--chunk-size', type=int, default=10000, help="blocks stored per transaction")
+        parser.add_argument('--first-block', type=int, default=None)
+        parser.add_argument('--last-block', type=int, default=None)
+
+    def handle(self, *args, **options):
+        # Blocks of transactions that have no row in the blocks table
+        txns = BlockchainTransaction.objects.filter(block__timestamp__isnull=True)
+        if options['first_block'] is not None:
+            txns = txns.filter(block_number__gte=options['first_block'])
+        if options['last_block'] is not None:
+            txns = txns.filter(block_number__lte=options['last_block'])
+        blocks = list(txns.values_list('block_number', flat=True).distinct().order_by('block_number'))
+        logging.info(f"{len(blocks)} blocks without a timestamp")
+
+        stored = 0
+        for i in range(0, len(blocks), options['chunk_size']):
+            timestamps = fetch_rpc_timestamps(
+                blocks[i:i + options['chunk_size']], rpcUrl=options['rpc'], batchSize=options['batch_size']
+            )
+            BlockTimestamps.store(timestamps)
+            stored += len(timestamps)
+            logging.info(f"Stored {stored} of {len(blocks)} block timestamps")
+
+        self.stdout.write(f"Stored {stored} block timestamps")
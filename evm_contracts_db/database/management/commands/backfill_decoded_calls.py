@@ -0,0 +1,63 @@
+import json
+import logging
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from evm_contracts_db.database.models.blockchain import BlockchainTransactionLog, BlockchainTransactionTrace
+from evm_contracts_db.database.etl.trueblocks_loader import TrueblocksLoader
+
+
+# (model, name column, inputs column, compressed column)
+DECODED = {
+    'logs': (BlockchainTransactionLog, 'event', 'event_inputs', 'compressed_log'),
+    'traces': (BlockchainTransactionTrace, 'call_name', 'call_inputs', 'compressed_trace'),
+}
+
+
+def backfill(model, nameColumn, inputsColumn, compressedColumn, batchSize):
+    """Decode the compressed text of the rows of model without decoded inputs, batchSize rows per
+    transaction, and return (number of rows decoded, number that could not be)
+    """
+
+    table = model._meta.db_table
+    decoded, failed, lastId = 0, 0, 0
+    while True:
+        rows = list(
+            model.objects.filter(id__gt=lastId, **{f"{inputsColumn}__isnull": True, f"{compressedColumn}__isnull": False})
+            .order_by('id').values_list('id', nameColumn, compressedColumn)[:batchSize]
+        )
+        if len(rows) == 0:
+            break
+        lastId = rows[-1][0]
+
+        updates = []
+        for rowId, name, compressed in rows:
+            name, inputs = TrueblocksLoader.decoded_call(name, None, compressed)
+            if inputs is None:
+                failed += 1
+            else:
+                updates.append((rowId, name, json.dumps(inputs)))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"""UPDATE {table} t SET {nameColumn} = v.name, {inputsColumn} = v.inputs
+                FROM unnest(%s::bigint[], %s::varchar[], %s::jsonb[]) v (id, name, inputs)
+                WHERE t.id = v.id""",
+                [[u[0] for u in updates], [u[1] for u in updates], [u[2] for u in updates]]
+            )
+        decoded += len(updates)
+        logging.info(f"Decoded {decoded} rows of {table}")
+
+    return decoded, failed
+
+
+class Command(BaseCommand):
+    help = "Fill the decoded name and inputs of logs and traces loaded before they were stored, from their compressed text"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', choices=list(DECODED), action='append', help="default: logs and traces")
+        parser.add_argument('--batch-size', type=int, default=10000, help="rows updated per transaction")
+
+    def handle(self, *args, **options):
+        for name in options['table'] or list(DECODED):
+            decoded, failed = backfill(*DECODED[name], options['batch_size'])
+            self.stdout.write(f"{name}: decoded {decoded}, could not decode {failed}")
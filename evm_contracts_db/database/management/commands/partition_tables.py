@@ -0,0 +1,33 @@
+import logging
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from evm_contracts_db.database.etl.partitions import BlockPartitions, block_range, set_block_range
+
+
+class Command(BaseCommand):
+    help = ("Partition the transactions, logs and traces tables by block range (or convert them back into plain "
+            "tables), in place and keeping their rows")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--block-range', type=int, default=None,
+                            help="blocks per partition (default: PARTITION_BLOCK_RANGE)")
+        parser.add_argument('--undo', action='store_true', help="convert the tables back into plain tables")
+
+    def handle(self, *args, **options):
+        blockRange = None if options['undo'] else options['block_range'] or settings.PARTITION_BLOCK_RANGE
+        if blockRange is None and not options['undo']:
+            raise CommandError("Give --block-range (or set PARTITION_BLOCK_RANGE), or --undo")
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Foreign keys checked at commit would block rebuilding the tables
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            rebuilt = set_block_range(cursor, blockRange)
+        BlockPartitions.clear_cache()
+
+        with connection.cursor() as cursor:
+            current = block_range(cursor)
+        state = f"partitioned by {current} blocks" if current is not None else "not partitioned"
+        logging.info(f"Tables {'rebuilt' if rebuilt else 'unchanged'}: {state}")
+        self.stdout.write(f"Tables {state}")
@@ -0,0 +1,33 @@
+import logging
+from django.core.management.base import BaseCommand
+
+from evm_contracts_db.database.models.etl import EtlJob
+from evm_contracts_db.database.etl.trueblocks import TrueblocksHandler
+
+
+class Command(BaseCommand):
+    help = "Resume ETL jobs that are pending or failed (e.g., after a crash), from their first chunk not loaded"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job', type=int, action='append',
+                            help="id of a job to resume, even if marked running (default: every pending or failed job)")
+        parser.add_argument('--chain', default=None)
+        parser.add_argument('--save-dir', default=None, help="directory holding tmp/chifra_cache")
+        parser.add_argument('--bulk', action='store_true', help="load with bulk_insert_transactions")
+        parser.add_argument('--workers', type=int, default=1, help="number of chifra processes to run concurrently")
+        parser.add_argument('--abi', action='append', help="ABI file or directory to articulate chifra output with in process")
+
+    def handle(self, *args, **options):
+        jobs = EtlJob.objects.exclude(status=EtlJob.Status.DONE).order_by('pk')
+        if options['job']:
+            jobs = jobs.filter(pk__in=options['job'])
+        else:
+            # Jobs running in another process (or left running by a crash) are only resumed by id
+            jobs = jobs.exclude(status=EtlJob.Status.RUNNING)
+
+        with TrueblocksHandler(chain=options['chain'], saveDir=options['save_dir'], bulk=options['bulk'],
+                               maxWorkers=options['workers'], abiPaths=options['abi']) as tb:
+            for job in jobs:
+                logging.info(f"Resuming {job}")
+                tb.run_job(job, force=bool(options['job']))
+                self.stdout.write(f"{job}")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blockchainaddress",
+            name="last_synced_block",
+            field=models.PositiveIntegerField(null=True),
+        ),
+    ]
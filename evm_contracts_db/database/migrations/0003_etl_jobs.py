@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0002_blockchainaddress_last_synced_block"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EtlJob",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("function", models.CharField(max_length=20)),
+                ("listed_blocks", models.JSONField(default=dict)),
+                ("status", models.CharField(choices=[("pending", "Pending"), ("running", "Running"), ("done", "Done"), ("failed", "Failed")], default="pending", max_length=10)),
+                ("error", models.TextField(null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("addresses", models.ManyToManyField(related_name="etl_jobs", to="database.blockchainaddress")),
+            ],
+            options={
+                "db_table": "etl_jobs",
+            },
+        ),
+        migrations.CreateModel(
+            name="EtlJobChunk",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("position", models.PositiveIntegerField()),
+                ("tx_ids", models.JSONField(default=list)),
+                ("status", models.CharField(choices=[("pending", "Pending"), ("extracted", "Extracted"), ("transformed", "Transformed"), ("loaded", "Loaded"), ("failed", "Failed")], default="pending", max_length=12)),
+                ("records_extracted", models.PositiveIntegerField(default=0)),
+                ("records_loaded", models.PositiveIntegerField(default=0)),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("job", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="chunks", to="database.etljob")),
+            ],
+            options={
+                "db_table": "etl_job_chunks",
+                "ordering": ["job", "position"],
+                "constraints": [models.UniqueConstraint(fields=("job", "position"), name="unique_job_chunk")],
+            },
+        ),
+    ]
@@ -0,0 +1,169 @@
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def _key(column):
+    """SQL packing a "blockNumber.transactionIndex" column into blockNumber << 32 | transactionIndex"""
+
+    return f"(split_part({column}, '.', 1)::bigint << 32) | split_part({column}, '.', 2)::bigint"
+
+
+def _txid(column):
+    """SQL unpacking a packed key column into "blockNumber.transactionIndex\""""
+
+    return f"({column} >> 32)::text || '.' || ({column} & 4294967295)::text"
+
+
+# Tables whose foreign keys reference blockchain_transactions, with the column holding the key
+CHILDREN = [
+    ("blockchain_logs", "originating_from_id"),
+    ("blockchain_traces", "originating_from_id"),
+    ("blockchain_transactions_contracts_created", "blockchaintransaction_id"),
+]
+
+# Keys are converted in place (ALTER COLUMN ... TYPE ... USING), which backfills
+# every row and rebuilds the existing indexes on the new type. The foreign keys
+# to blockchain_transactions and the varchar_pattern_ops indexes of the string
+# keys are dropped first, and the foreign keys recreated on tx_key.
+DROP_FOREIGN_KEYS = """DO $$
+    DECLARE r record;
+    BEGIN
+        FOR r IN SELECT conrelid::regclass AS tbl, conname FROM pg_constraint
+                 WHERE contype = 'f' AND confrelid = 'blockchain_transactions'::regclass LOOP
+            EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', r.tbl, r.conname);
+        END LOOP;
+    END $$"""
+
+FORWARD = [
+    DROP_FOREIGN_KEYS,
+    """DO $$
+    DECLARE r record;
+    BEGIN
+        FOR r IN SELECT i.indexrelid::regclass AS idx FROM pg_index i JOIN pg_opclass o ON o.oid = i.indclass[0]
+                 WHERE o.opcname = 'varchar_pattern_ops' AND i.indrelid IN (
+                     'blockchain_transactions'::regclass, 'blockchain_logs'::regclass,
+                     'blockchain_traces'::regclass, 'blockchain_transactions_contracts_created'::regclass
+                 ) LOOP
+            EXECUTE format('DROP INDEX %s', r.idx);
+        END LOOP;
+    END $$""",
+    f"""ALTER TABLE blockchain_transactions ALTER COLUMN transaction_id TYPE bigint USING {_key("transaction_id")}""",
+    "ALTER TABLE blockchain_transactions RENAME COLUMN transaction_id TO tx_key",
+    f"""ALTER TABLE blockchain_transactions_contracts_created
+        ALTER COLUMN blockchaintransaction_id TYPE bigint USING {_key("blockchaintransaction_id")}""",
+    # log_index was "blockNumber.transactionIndex.logIndex"
+    f"""ALTER TABLE blockchain_logs
+        ALTER COLUMN originating_from_id TYPE bigint USING {_key("originating_from_id")},
+        ALTER COLUMN log_index DROP DEFAULT,
+        ALTER COLUMN log_index TYPE integer USING split_part(log_index, '.', 3)::integer,
+        ADD CONSTRAINT blockchain_logs_log_index_check CHECK (log_index >= 0)""",
+    # trace_address was "blockNumber.transactionIndex.<chifra traceAddress>", e.g. "100.1.[0, 2]"
+    f"""ALTER TABLE blockchain_traces
+        ALTER COLUMN originating_from_id TYPE bigint USING {_key("originating_from_id")},
+        ALTER COLUMN trace_address DROP DEFAULT,
+        ALTER COLUMN trace_address TYPE integer[] USING array_remove(
+            regexp_split_to_array(coalesce(substring(trace_address FROM '^[0-9]+\\.[0-9]+\\.(.*)$'), ''), '[^0-9]+'), ''
+        )::integer[]""",
+    "ALTER TABLE blockchain_traces RENAME COLUMN trace_address TO trace_path",
+    # Children are identified by (transaction, log index / trace path) from now on; keep the latest duplicate
+    """DELETE FROM blockchain_logs a USING blockchain_logs b
+        WHERE a.originating_from_id = b.originating_from_id AND a.log_index = b.log_index AND a.id < b.id""",
+    """DELETE FROM blockchain_traces a USING blockchain_traces b
+        WHERE a.originating_from_id = b.originating_from_id AND a.trace_path = b.trace_path AND a.id < b.id""",
+    "ALTER TABLE blockchain_logs ADD CONSTRAINT unique_log UNIQUE (originating_from_id, log_index)",
+    "ALTER TABLE blockchain_traces ADD CONSTRAINT unique_trace UNIQUE (originating_from_id, trace_path)",
+] + [
+    f"""ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fk_tx_key FOREIGN KEY ({column})
+        REFERENCES blockchain_transactions (tx_key) DEFERRABLE INITIALLY DEFERRED"""
+    for table, column in CHILDREN
+]
+
+BACKWARD = [
+    DROP_FOREIGN_KEYS,
+    "ALTER TABLE blockchain_logs DROP CONSTRAINT unique_log",
+    "ALTER TABLE blockchain_traces DROP CONSTRAINT unique_trace",
+    "ALTER TABLE blockchain_traces RENAME COLUMN trace_path TO trace_address",
+    f"""ALTER TABLE blockchain_traces
+        ALTER COLUMN trace_address TYPE varchar(50)
+            USING {_txid("coalesce(originating_from_id, 0)")} || '.' || array_to_string(trace_address, ','),
+        ALTER COLUMN originating_from_id TYPE varchar(20) USING {_txid("originating_from_id")}""",
+    f"""ALTER TABLE blockchain_logs
+        DROP CONSTRAINT blockchain_logs_log_index_check,
+        ALTER COLUMN log_index TYPE varchar(50)
+            USING {_txid("coalesce(originating_from_id, 0)")} || '.' || log_index::text,
+        ALTER COLUMN originating_from_id TYPE varchar(20) USING {_txid("originating_from_id")}""",
+    f"""ALTER TABLE blockchain_transactions_contracts_created
+        ALTER COLUMN blockchaintransaction_id TYPE varchar(20) USING {_txid("blockchaintransaction_id")}""",
+    "ALTER TABLE blockchain_transactions RENAME COLUMN tx_key TO transaction_id",
+    f"""ALTER TABLE blockchain_transactions ALTER COLUMN transaction_id TYPE varchar(20) USING {_txid("transaction_id")}""",
+] + [
+    f"""ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fk_transaction_id FOREIGN KEY ({column})
+        REFERENCES blockchain_transactions (transaction_id) DEFERRABLE INITIALLY DEFERRED"""
+    for table, column in CHILDREN
+] + [
+    f"CREATE INDEX {table}_{column}_like ON {table} ({column} varchar_pattern_ops)"
+    for table, column in [("blockchain_transactions", "transaction_id")] + CHILDREN
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0003_etl_jobs"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(FORWARD, reverse_sql=BACKWARD),
+            ],
+            state_operations=[
+                migrations.RenameField(
+                    model_name="blockchaintransaction",
+                    old_name="transaction_id",
+                    new_name="tx_key",
+                ),
+                migrations.AlterField(
+                    model_name="blockchaintransaction",
+                    name="tx_key",
+                    field=models.BigIntegerField(primary_key=True, serialize=False),
+                ),
+                migrations.AlterField(
+                    model_name="blockchaintransactionlog",
+                    name="log_index",
+                    field=models.PositiveIntegerField(),
+                ),
+                migrations.RemoveField(
+                    model_name="blockchaintransactiontrace",
+                    name="trace_address",
+                ),
+                migrations.AddField(
+                    model_name="blockchaintransactiontrace",
+                    name="trace_path",
+                    field=django.contrib.postgres.fields.ArrayField(
+                        base_field=models.PositiveIntegerField(), default=list, size=None
+                    ),
+                ),
+                migrations.AddConstraint(
+                    model_name="blockchaintransactionlog",
+                    constraint=models.UniqueConstraint(fields=("originating_from", "log_index"), name="unique_log"),
+                ),
+                migrations.AddConstraint(
+                    model_name="blockchaintransactiontrace",
+                    constraint=models.UniqueConstraint(fields=("originating_from", "trace_path"), name="unique_trace"),
+                ),
+            ],
+        ),
+        # The unique constraints lead with originating_from_id, so its own index is redundant
+        migrations.AlterField(
+            model_name="blockchaintransactionlog",
+            name="originating_from",
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name="logs", to="database.blockchaintransaction"),
+        ),
+        migrations.AlterField(
+            model_name="blockchaintransactiontrace",
+            name="originating_from",
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name="traces", to="database.blockchaintransaction"),
+        ),
+    ]
@@ -0,0 +1,43 @@
+import evm_contracts_db.database.models.fields
+from django.db import migrations
+
+
+# Addresses are decoded from hex in place (rebuilding unique_address on the new
+# type); "0x0" style short addresses are left padded, as by utils.blockchain.address_to_bytes
+FORWARD = [
+    """DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM blockchain_addresses WHERE address !~* '^0x[0-9a-f]{1,40}$') THEN
+            RAISE EXCEPTION 'blockchain_addresses has addresses that are not hex; fix or delete them before migrating';
+        END IF;
+    END $$""",
+    """ALTER TABLE blockchain_addresses
+        ALTER COLUMN address TYPE bytea USING decode(lpad(substring(address FROM 3), 40, '0'), 'hex')""",
+]
+
+BACKWARD = [
+    """ALTER TABLE blockchain_addresses
+        ALTER COLUMN address TYPE varchar(42) USING '0x' || encode(address, 'hex')""",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0004_packed_tx_key"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(FORWARD, reverse_sql=BACKWARD),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name="blockchainaddress",
+                    name="address",
+                    field=evm_contracts_db.database.models.fields.AddressField(),
+                ),
+            ],
+        ),
+    ]
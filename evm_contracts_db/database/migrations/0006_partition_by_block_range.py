@@ -0,0 +1,26 @@
+from django.db import migrations
+
+from evm_contracts_db.database.etl.partitions import is_partitioned, unpartition_tables
+
+
+# The transactions, logs and traces tables are partitioned by block range in
+# place, rows included, by the partition_tables command (see etl.partitions),
+# so that the schema migrations produce does not depend on the environment.
+# Migrating back before this migration converts them back into plain tables.
+
+
+def unpartition(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        if is_partitioned(cursor, "blockchain_transactions"):
+            unpartition_tables(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0005_address_bytea"),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, unpartition),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Appearances of the transactions already loaded: from, to and created
+# addresses, and the addresses of their logs and traces as involved (unless they
+# already have one of those roles). The zero address is left out, as by
+# TrueblocksLoader.appearance_roles.
+BACKFILL = """
+    WITH specific AS (
+        SELECT from_address_id AS address_id, tx_key, 1 AS role FROM blockchain_transactions WHERE from_address_id IS NOT NULL
+        UNION SELECT to_address_id, tx_key, 2 FROM blockchain_transactions WHERE to_address_id IS NOT NULL
+        UNION SELECT blockchainaddress_id, blockchaintransaction_id, 3 FROM blockchain_transactions_contracts_created
+    ), involved AS (
+        SELECT address_id, originating_from_id AS tx_key, 4 AS role FROM blockchain_logs
+        UNION SELECT from_address_id, originating_from_id, 4 FROM blockchain_traces
+        UNION SELECT to_address_id, originating_from_id, 4 FROM blockchain_traces
+        UNION SELECT delegate_id, originating_from_id, 4 FROM blockchain_traces
+        EXCEPT SELECT address_id, tx_key, 4 FROM specific
+    )
+    INSERT INTO blockchain_address_appearances (address_id, tx_key, role)
+    SELECT s.address_id, s.tx_key, s.role FROM (SELECT * FROM specific UNION ALL SELECT * FROM involved) s
+    JOIN blockchain_addresses a ON a.id = s.address_id
+    WHERE s.tx_key IS NOT NULL AND a.address <> decode(repeat('0', 40), 'hex')
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0006_partition_by_block_range"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BlockchainAddressAppearance",
+            fields=[
+                ("pk", models.CompositePrimaryKey("address_id", "tx_id", "role", blank=True, editable=False, primary_key=True, serialize=False)),
+                ("address", models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name="appearances", to="database.blockchainaddress")),
+                ("tx", models.ForeignKey(db_column="tx_key", on_delete=django.db.models.deletion.CASCADE, related_name="appearances", to="database.blockchaintransaction")),
+                ("role", models.PositiveSmallIntegerField(choices=[(1, "From"), (2, "To"), (3, "Created"), (4, "Involved")])),
+            ],
+            options={
+                "db_table": "blockchain_address_appearances",
+            },
+        ),
+        migrations.RunSQL(BACKFILL, reverse_sql=migrations.RunSQL.noop),
+    ]
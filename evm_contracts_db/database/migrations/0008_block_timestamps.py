@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0007_address_appearances"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Block",
+            fields=[
+                ("number", models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ("timestamp", models.DateTimeField()),
+            ],
+            options={
+                "db_table": "blockchain_blocks",
+            },
+        ),
+        migrations.AddField(
+            model_name="blockchaintransaction",
+            name="block",
+            field=models.ForeignObject(from_fields=["block_number"], null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name="transactions", to="database.block", to_fields=["number"]),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:50
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0008_block_timestamps"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blockchaintransactionlog",
+            name="event_inputs",
+            field=models.JSONField(null=True),
+        ),
+        migrations.AddField(
+            model_name="blockchaintransactiontrace",
+            name="call_inputs",
+            field=models.JSONField(null=True),
+        ),
+        migrations.AddField(
+            model_name="blockchaintransactiontrace",
+            name="call_name",
+            field=models.CharField(max_length=200, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="blockchaintransactionlog",
+            index=models.Index(fields=["event"], name="log_event"),
+        ),
+        migrations.AddIndex(
+            model_name="blockchaintransactionlog",
+            index=django.contrib.postgres.indexes.GinIndex(fields=["event_inputs"], name="log_event_inputs", opclasses=["jsonb_path_ops"]),
+        ),
+        migrations.AddIndex(
+            model_name="blockchaintransactiontrace",
+            index=models.Index(fields=["call_name"], name="trace_call_name"),
+        ),
+        migrations.AddIndex(
+            model_name="blockchaintransactiontrace",
+            index=django.contrib.postgres.indexes.GinIndex(fields=["call_inputs"], name="trace_call_inputs", opclasses=["jsonb_path_ops"]),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:53
+
+import evm_contracts_db.database.models.fields
+from django.db import migrations, models
+
+
+def _topic(i):
+    """SQL of the i-th space-separated hex word of topics, as bytea"""
+
+    word = f"split_part(topics, ' ', {i + 1})"
+    return f"CASE WHEN {word} <> '' THEN decode(lpad(substring({word} FROM 3), 64, '0'), 'hex') END"
+
+
+# topics ("0x... 0x..." words, if any were stored) are split into the topic columns and back
+FORWARD = "UPDATE blockchain_logs SET " + ", ".join(f"topic{i} = {_topic(i)}" for i in range(4)) + " WHERE topics IS NOT NULL"
+
+BACKWARD = """UPDATE blockchain_logs SET topics = nullif(concat_ws(' ', """ + ", ".join(
+    f"'0x' || encode(topic{i}, 'hex')" for i in range(4)
+) + "), '') WHERE topic0 IS NOT NULL"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0009_decoded_calls"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blockchaintransactionlog",
+            name="topic0",
+            field=evm_contracts_db.database.models.fields.WordField(null=True),
+        ),
+        migrations.AddField(
+            model_name="blockchaintransactionlog",
+            name="topic1",
+            field=evm_contracts_db.database.models.fields.WordField(null=True),
+        ),
+        migrations.AddField(
+            model_name="blockchaintransactionlog",
+            name="topic2",
+            field=evm_contracts_db.database.models.fields.WordField(null=True),
+        ),
+        migrations.AddField(
+            model_name="blockchaintransactionlog",
+            name="topic3",
+            field=evm_contracts_db.database.models.fields.WordField(null=True),
+        ),
+        migrations.RunSQL(FORWARD, reverse_sql=BACKWARD),
+        migrations.RemoveField(
+            model_name="blockchaintransactionlog",
+            name="topics",
+        ),
+        migrations.AddIndex(
+            model_name="blockchaintransactionlog",
+            index=models.Index(fields=["topic0", "address"], name="log_topic0_address"),
+        ),
+    ]
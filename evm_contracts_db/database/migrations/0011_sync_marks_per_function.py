@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:12
+
+from django.db import migrations, models
+
+
+# One sync mark per chifra function. last_synced_block was advanced by traces
+# and transactions syncs alike, so it cannot tell which one loaded an address up
+# to it: it is dropped, and the next sync of each function lists the full
+# history (transactions already loaded are not traced again, see TxIdDeduplicator).
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("database", "0010_log_topics"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blockchainaddress",
+            name="last_synced_traces_block",
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="blockchainaddress",
+            name="last_synced_transactions_block",
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.RemoveField(
+            model_name="blockchainaddress",
+            name="last_synced_block",
+        ),
+    ]
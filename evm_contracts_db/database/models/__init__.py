@@ -1,4 +1,5 @@
 from .offchain import *
 from .blockchain import *
+from .etl import *
 
 # TODO: update with actual models
\ No newline at end of file
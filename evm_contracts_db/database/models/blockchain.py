@@ -1,7 +1,11 @@
 from django.db import models
-from django.db.models import Q
+from django.db.models import F, Q
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 
-from utils.blockchain import get_timestamp, unpack_compressed_call
+from evm_contracts_db.database.models.fields import AddressField, WordField
+
+from utils.blockchain import unpack_compressed_call, tx_key, pack_txid, txid_of, TX_INDEX_MASK
 
 
 class BlockchainAddress(models.Model):
@@ -20,27 +24,31 @@ class BlockchainAddress(models.Model):
         choices=Chains.choices, 
         default=Chains.MAINNET
     )
-    address = models.CharField(max_length=42, null=False)
-
-    def appears_in(self):
-        """ Return QuerySet of all transactions in which the address appears
-        Uses related_names defined in BlockchainTransaction
-
-        This has not been tested and probably misses something... use with caution!!
+    address = AddressField(null=False) # bytea, read and written as lowercase hex; see etl.address_resolver.AddressResolver
+    last_synced_traces_block = models.PositiveIntegerField(null=True) # all appearances up to this block are loaded from chifra traces
+    last_synced_transactions_block = models.PositiveIntegerField(null=True) # ... and from chifra transactions
+
+    def appears_in(self, after=None, limit=None, roles=None):
+        """Return QuerySet of the transactions in which the address appears, in
+        block order, from its BlockchainAddressAppearance records (one index
+        range scan). Pages are read with keyset pagination, e.g.
+        page = address.appears_in(after=page[-1].tx_key, limit=1000)
+
+        after: (optional) tx_key or transaction id of the last transaction of the previous page
+        limit: (optional) number of transactions to return
+        roles: (optional) list of BlockchainAddressAppearance.Role to restrict to
         """
 
-        txns = self.transactions_from.all()
-        txns = txns.union(self.transactions_to.all())
-        txns = txns.union(self.created_by_transaction.all())
-        txns = txns.union(self.transactions_involving.all())
-
-        return txns
+        appearances = self.appearances.all()
+        if roles is not None:
+            appearances = appearances.filter(role__in=roles)
+        if after is not None:
+            appearances = appearances.filter(tx_id__gt=pack_txid(after))
+        txKeys = appearances.order_by('tx_id').values('tx_id').distinct()
+        if limit is not None:
+            txKeys = txKeys[:limit]
 
-    def save(self, *args, **kwargs):
-        """Overwrite save method to ensure address is lowercase"""
-
-        self.address = self.address.lower()
-        super(BlockchainAddress, self).save(*args, **kwargs)
+        return BlockchainTransaction.objects.filter(tx_key__in=txKeys).order_by('tx_key')
 
     class Meta:
         db_table = "blockchain_addresses"
@@ -54,10 +62,42 @@ class BlockchainAddress(models.Model):
         return self.address
 
 
+class Block(models.Model):
+    """Timestamp of a block, filled by TrueblocksLoader from chifra output or by
+    the backfill_block_timestamps command; see etl.block_timestamps
+    """
+
+    number = models.PositiveIntegerField(primary_key=True)
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        db_table = "blockchain_blocks"
+
+    def __str__(self):
+        return str(self.number)
+
+
+class BlockchainTransactionQuerySet(models.QuerySet):
+    def with_timestamps(self):
+        """Annotate block_timestamp (None if the block is not in the blocks
+        table) with one join, instead of a lookup per transaction
+        """
+
+        return self.annotate(block_timestamp=F('block__timestamp'))
+
+
 class BlockchainTransaction(models.Model):
-    transaction_id = models.CharField(primary_key=True, max_length=20, default="0.0")
+    tx_key = models.BigIntegerField(primary_key=True) # blockNumber << 32 | transactionIndex; see utils.blockchain.pack_txid
     transaction_hash = models.CharField(max_length=66, null=True)
     block_number = models.PositiveIntegerField()
+    block = models.ForeignObject(
+        Block,
+        on_delete=models.DO_NOTHING,
+        from_fields=['block_number'],
+        to_fields=['number'],
+        null=True,
+        related_name="transactions"
+    ) # no column or constraint: joins block_number to Block, whose row may be missing
     from_address = models.ForeignKey(
         BlockchainAddress, 
         on_delete=models.CASCADE, 
@@ -80,20 +120,43 @@ class BlockchainTransaction(models.Model):
         related_name='created_by_transaction'
     )
 
-    # TODO: once the method for doing this is more reliable in TrueblocksLoader, store a full list of all addresses involved in the transaction
-    # addresses_involved = models.ManyToManyField(
-    #     BlockchainAddress,
-    #     related_name='involved_in_transaction'
-    # )
+    objects = BlockchainTransactionQuerySet.as_manager()
+
+    # Every address involved in the transaction (from, to, created, in logs) is
+    # in BlockchainAddressAppearance, related_name 'appearances'
+
+    @property
+    def transaction_id(self):
+        """Transaction id ("blockNumber.transactionIndex")"""
+
+        return txid_of(self.tx_key)
+
+    @property
+    def transaction_index(self):
+        return self.tx_key & TX_INDEX_MASK
+
+    @staticmethod
+    def block_range(firstBlock, lastBlock, field='tx_key'):
+        """Return Q of the transactions in blocks firstBlock to lastBlock, as a
+        range scan of the primary key (which prunes partitions, if any)
+
+        field: transaction key to filter on, e.g. 'originating_from_id' for
+            BlockchainTransactionLog and BlockchainTransactionTrace
+        """
+
+        return Q(**{f"{field}__gte": tx_key(firstBlock, 0), f"{field}__lte": tx_key(lastBlock, TX_INDEX_MASK)})
 
     @property
     def timestamp(self):
-        return get_timestamp(self.block_number)
+        """Timestamp of the block, as annotated by with_timestamps or from
+        etl.block_timestamps.BlockTimestamps (LRU, blocks table, then RPC)
+        """
+
+        if getattr(self, 'block_timestamp', None) is not None:
+            return self.block_timestamp
+        from evm_contracts_db.database.etl.block_timestamps import BlockTimestamps
 
-    # @property
-    # def most_recent_appearance(self):
-    #     # TODO: implement
-    #     return
+        return BlockTimestamps().get(self.block_number)
 
     def contains_address(self, address):
         """Check if an address (string) appears anywhere in the transaction"""
@@ -114,33 +177,55 @@ class BlockchainTransaction(models.Model):
 
 
 class BlockchainTransactionLog(models.Model):
-    log_index = models.CharField(max_length=50, default="0.0.0") # transactionId.logIndex
+    log_index = models.PositiveIntegerField() # logIndex of the log in its block
     address = models.ForeignKey(
         BlockchainAddress, 
         on_delete=models.CASCADE, 
         null=True,
         related_name="logs_from"
     )
-    topics = models.CharField(max_length=267, null=True) # up to 4 space-separated 32-bit words
+    topic0 = WordField(null=True) # event signature hash (see utils.blockchain.event_topic); None if anonymous
+    topic1 = WordField(null=True)
+    topic2 = WordField(null=True)
+    topic3 = WordField(null=True)
     event = models.CharField(max_length=200, null=True)
+    event_inputs = models.JSONField(null=True) # decoded parameters, name -> value
     compressed_log = models.TextField(null=True)
     originating_from = models.ForeignKey(
         BlockchainTransaction, 
         on_delete=models.CASCADE,
         null=True,
-        related_name="logs"
+        related_name="logs",
+        db_index=False # indexed by unique_log
     )
 
+    @property
+    def topics(self):
+        return [t for t in [self.topic0, self.topic1, self.topic2, self.topic3] if t is not None]
+
     @property
     def log_dict(self):
+        if self.event_inputs is not None:
+            return {'name': self.event, 'input': self.event_inputs}
+
         return unpack_compressed_call(self.compressed_log) if self.compressed_log is not None else {}
 
     class Meta:
         db_table = "blockchain_logs"
 
+        constraints = [
+            models.UniqueConstraint(fields=['originating_from', 'log_index'], name='unique_log')
+        ]
+        # e.g. filter(event='SubmitProposal', event_inputs__contains={'applicant': address})
+        indexes = [
+            models.Index(fields=['topic0', 'address'], name='log_topic0_address'),
+            models.Index(fields=['event'], name='log_event'),
+            GinIndex(fields=['event_inputs'], opclasses=['jsonb_path_ops'], name='log_event_inputs')
+        ]
+
 
 class BlockchainTransactionTrace(models.Model):
-    trace_address = models.CharField(max_length=50, default="0.0.0") # transactionId.traceAddress
+    trace_path = ArrayField(models.PositiveIntegerField(), default=list) # traceAddress of the call in its transaction
     from_address = models.ForeignKey(
         BlockchainAddress, 
         on_delete=models.CASCADE, 
@@ -154,6 +239,8 @@ class BlockchainTransactionTrace(models.Model):
         related_name="traces_to"
     )
     value = models.FloatField()
+    call_name = models.CharField(max_length=200, null=True)
+    call_inputs = models.JSONField(null=True) # decoded parameters, name -> value
     compressed_trace = models.TextField(max_length=1000, null=True) # TODO: is there a max? Should we really be storing this?
     error = models.CharField(max_length=20, null=True)
     outputs = models.JSONField(default=dict, null=True)
@@ -167,13 +254,55 @@ class BlockchainTransactionTrace(models.Model):
         BlockchainTransaction, 
         on_delete=models.CASCADE,
         null=True,
-        related_name="traces"
+        related_name="traces",
+        db_index=False # indexed by unique_trace
     )
 
     @property
     def trace_dict(self):
+        if self.call_inputs is not None:
+            return {'name': self.call_name, 'input': self.call_inputs}
+
         return unpack_compressed_call(self.compressed_trace) if self.compressed_trace is not None else {}
 
     class Meta:
         db_table = "blockchain_traces"
 
+        constraints = [
+            models.UniqueConstraint(fields=['originating_from', 'trace_path'], name='unique_trace')
+        ]
+        indexes = [
+            models.Index(fields=['call_name'], name='trace_call_name'),
+            GinIndex(fields=['call_inputs'], opclasses=['jsonb_path_ops'], name='trace_call_inputs')
+        ]
+
+
+class BlockchainAddressAppearance(models.Model):
+    """An address appearing in a transaction, with its role there. Narrow and
+    keyed on (address, tx_key, role), so that every transaction of an address
+    is one index range scan in block order; see BlockchainAddress.appears_in
+    """
+
+    class Role(models.IntegerChoices):
+        FROM = 1, 'From'
+        TO = 2, 'To'
+        CREATED = 3, 'Created'
+        INVOLVED = 4, 'Involved' # in logs, log arguments or traces
+
+    pk = models.CompositePrimaryKey('address_id', 'tx_id', 'role') # no surrogate id
+    address = models.ForeignKey(
+        BlockchainAddress,
+        on_delete=models.CASCADE,
+        related_name="appearances",
+        db_index=False # indexed by the primary key
+    )
+    tx = models.ForeignKey(
+        BlockchainTransaction,
+        on_delete=models.CASCADE,
+        related_name="appearances",
+        db_column="tx_key"
+    )
+    role = models.PositiveSmallIntegerField(choices=Role.choices)
+
+    class Meta:
+        db_table = "blockchain_address_appearances"
@@ -0,0 +1,64 @@
+from django.db import models
+
+from evm_contracts_db.database.models.blockchain import BlockchainAddress
+
+
+class EtlJob(models.Model):
+    """A resumable extraction of chifra traces or transactions for one or more
+    addresses, split into EtlJobChunk records that are loaded (and committed)
+    one at a time; see TrueblocksHandler.create_job and run_job
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
+    function = models.CharField(max_length=20) # chifra function, e.g. traces
+    addresses = models.ManyToManyField(
+        BlockchainAddress,
+        related_name='etl_jobs'
+    )
+    listed_blocks = models.JSONField(default=dict) # address -> last block listed, for its sync mark
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    error = models.TextField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "etl_jobs"
+
+    def __str__(self):
+        return f"{self.function} job {self.pk} ({self.status})"
+
+
+class EtlJobChunk(models.Model):
+    """A chunk of the transaction ids of an EtlJob, with its progress"""
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        EXTRACTED = 'extracted', 'Extracted'
+        TRANSFORMED = 'transformed', 'Transformed'
+        LOADED = 'loaded', 'Loaded'
+        FAILED = 'failed', 'Failed'
+
+    job = models.ForeignKey(
+        EtlJob,
+        on_delete=models.CASCADE,
+        related_name='chunks'
+    )
+    position = models.PositiveIntegerField()
+    tx_ids = models.JSONField(default=list)
+    status = models.CharField(max_length=12, choices=Status.choices, default=Status.PENDING)
+    records_extracted = models.PositiveIntegerField(default=0)
+    records_loaded = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "etl_job_chunks"
+        ordering = ['job', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'position'], name='unique_job_chunk')
+        ]
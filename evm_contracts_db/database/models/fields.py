@@ -0,0 +1,45 @@
+from django.db import models
+
+from utils.blockchain import address_to_bytes, bytes_to_address, word_to_bytes, bytes_to_word
+
+
+class AddressField(models.Field):
+    """Address stored as 20-byte bytea and exposed as lowercase 0x-prefixed hex
+
+    Values are converted both ways, so records and lookups (exact, in) take
+    address strings in any case, e.g. filter(address='0xAbC...').
+    """
+
+    description = "20-byte address"
+
+    def db_type(self, connection):
+        return 'bytea'
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else bytes_to_address(value)
+
+    def to_python(self, value):
+        return None if value is None else bytes_to_address(address_to_bytes(value))
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        return None if value is None else address_to_bytes(value)
+
+
+class WordField(models.Field):
+    """32-byte word (e.g. a log topic) stored as bytea and exposed as lowercase 0x-prefixed hex"""
+
+    description = "32-byte word"
+
+    def db_type(self, connection):
+        return 'bytea'
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else bytes_to_word(value)
+
+    def to_python(self, value):
+        return None if value is None else bytes_to_word(word_to_bytes(value))
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        return None if value is None else word_to_bytes(value)
@@ -4,10 +4,10 @@ Django settings for evm_contracts_db project.
 Generated by 'django-admin startproject' using Django 4.0.3.
 
 For more information on this file, see
-https://docs.djangoproject.com/en/4.0/topics/settings/
+https://docs.djangoproject.com/en/5.2/topics/settings/
 
 For the full list of settings and their values, see
-https://docs.djangoproject.com/en/4.0/ref/settings/
+https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
@@ -36,7 +36,7 @@ logging.basicConfig()
 logging.getLogger().setLevel(LOG_LEVEL)
 
 # Quick-start development settings - unsuitable for production
-# See https://docs.djangoproject.com/en/4.0/howto/deployment/checklist/
+# See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.getenv("DJANGO_SECRET_KEY")
@@ -98,7 +98,7 @@ WSGI_APPLICATION = 'evm_contracts_db.wsgi.application'
 
 
 # Database
-# https://docs.djangoproject.com/en/4.0/ref/settings/#databases
+# https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
 DATABASES = {
     'default': {
@@ -109,8 +109,12 @@ DATABASES = {
     }
 }
 
+# Default blocks per partition of the transactions, logs and traces tables for
+# `manage.py partition_tables`; partitioning is opt-in (see etl.partitions)
+PARTITION_BLOCK_RANGE = int(os.getenv("PARTITION_BLOCK_RANGE", 0)) or None
+
 # Password validation
-# https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
+# https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -129,7 +133,7 @@ AUTH_PASSWORD_VALIDATORS = [
 
 
 # Internationalization
-# https://docs.djangoproject.com/en/4.0/topics/i18n/
+# https://docs.djangoproject.com/en/5.2/topics/i18n/
 
 LANGUAGE_CODE = 'en-us'
 
@@ -141,7 +145,7 @@ USE_TZ = True
 
 
 # Static files (CSS, JavaScript, Images)
-# https://docs.djangoproject.com/en/4.0/howto/static-files/
+# https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 if LOCAL:
     STATIC_ROOT = os.path.join(BASE_DIR, 'static')
@@ -166,7 +170,7 @@ else:
     #STATICFILES_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 
 # Default primary key field type
-# https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
+# https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
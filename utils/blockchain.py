@@ -1,26 +1,145 @@
 import os
+import re
 from datetime import datetime
 from web3 import Web3, HTTPProvider
 
 
+# A transaction is keyed in the database by one integer, blockNumber << 32 | transactionIndex
+TX_INDEX_BITS = 32
+TX_INDEX_MASK = (1 << TX_INDEX_BITS) - 1
+
+ZERO_ADDRESS = '0x' + '0' * 40
+
+
 def load_txid(blockNumber, txIndex):
     return f"{blockNumber}.{txIndex}"
 
 
-def unpack_txid(txId):
+def tx_key(blockNumber, txIndex):
+    """Packed integer key (BlockchainTransaction.tx_key) of a transaction"""
+
+    return (int(blockNumber) << TX_INDEX_BITS) | int(txIndex)
+
+
+def pack_txid(txId):
+    """Packed integer key of a transaction id ("blockNumber.transactionIndex")"""
+
+    if isinstance(txId, int):
+        return txId
     blockNumber, txIndex = txId.split('.')
+    return tx_key(blockNumber, txIndex)
+
+
+def unpack_txid(txId):
+    """Block number and transaction index of a transaction id or packed key"""
+
+    if isinstance(txId, int):
+        blockNumber, txIndex = str(txId >> TX_INDEX_BITS), str(txId & TX_INDEX_MASK)
+    else:
+        blockNumber, txIndex = txId.split('.')
     return {'blockNumber': blockNumber, 'transactionIndex': txIndex}
 
 
+def txid_of(txKey):
+    """Transaction id ("blockNumber.transactionIndex") of a packed key"""
+
+    return load_txid(txKey >> TX_INDEX_BITS, txKey & TX_INDEX_MASK)
+
+
+def _hex_to_bytes(value, size, kind):
+    """size-byte value of hex (with or without 0x, left padded with zeros) or bytes"""
+
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        result = bytes(value)
+    else:
+        digits = value[2:] if value[:2] in ['0x', '0X'] else value
+        if len(digits) > 2 * size:
+            raise ValueError(f"Not {kind}: {value}")
+        result = bytes.fromhex(digits.zfill(2 * size))
+    if len(result) != size:
+        raise ValueError(f"Not {kind}: {value}")
+
+    return result
+
+
+def address_to_bytes(address):
+    """20-byte value of an address given as hex (with or without 0x, left
+    padded with zeros, so "0x0" is the zero address) or as bytes
+    """
+
+    return _hex_to_bytes(address, 20, 'an address')
+
+
+def word_to_bytes(word):
+    """32-byte value of a word (e.g. a log topic) given as hex or bytes"""
+
+    return _hex_to_bytes(word, 32, 'a 32-byte word')
+
+
+def bytes_to_address(value):
+    """Lowercase 0x-prefixed hex of a 20-byte address"""
+
+    return '0x' + bytes(value).hex()
+
+
+def bytes_to_word(value):
+    """Lowercase 0x-prefixed hex of a 32-byte word"""
+
+    return '0x' + bytes(value).hex()
+
+
+def normalize_address(address):
+    return bytes_to_address(address_to_bytes(address))
+
+
+def event_topic(signature):
+    """topic0 of the logs of an event, e.g. event_topic('Transfer(address,address,uint256)')"""
+
+    return '0x' + bytes(Web3.keccak(text=signature)).hex()
+
+
+def _split_params(paramsString):
+    """Split a compressed parameter list on the commas outside brackets and quotes"""
+
+    params, depth, quote, start = [], 0, None, 0
+    for i, c in enumerate(paramsString):
+        if quote is not None:
+            quote = None if c == quote else quote
+        elif c in '"\'':
+            quote = c
+        elif c in '([{':
+            depth += 1
+        elif c in ')]}':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            params.append(paramsString[start:i])
+            start = i + 1
+    params.append(paramsString[start:])
+
+    return [p.strip() for p in params if p.strip() != '']
+
+
 def unpack_compressed_call(s):
-    """Unpack compressed_trace or compressed_log"""
+    """Unpack compressed_trace or compressed_log, e.g.
+    "Transfer(0xab... /*from*/, 10 /*value*/);" into
+    {'name': 'Transfer', 'input': {'from': '0xab...', 'value': '10'}}.
+    Parameters without a /*name*/ are keyed by position.
+    """
 
     s = s.strip().strip(';')
-    name, paramsString = s.split('(')
-    paramsList = [s.strip(p).split() for p in paramsString[:-1].split(', ')]
-    paramsDict = {p[1]: p[0].strip('/').strip('*') for p in paramsList}
+    name, paren, paramsString = s.partition('(')
+    if paren == '' or not paramsString.endswith(')'):
+        raise ValueError(f"Not a compressed call: {s}")
+
+    paramsDict = {}
+    for i, p in enumerate(_split_params(paramsString[:-1])):
+        match = re.fullmatch(r'(.*?)\s*/\*\s*(.*?)\s*\*/', p, re.DOTALL)
+        if match is None:
+            paramsDict[str(i)] = p
+        else:
+            paramsDict[match.group(2) or str(i)] = match.group(1)
 
-    return {'name': name, 'input': paramsDict}
+    return {'name': name.strip(), 'input': paramsDict}
 
 
 def get_timestamp(block):
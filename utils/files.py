@@ -1,14 +1,21 @@
 import os
 import re
 import json
+import codecs
 
 
 def load_json(fpath):
-    """Load JSON file"""
+    """Load JSON file, either written by save_json or raw chifra output (which
+    may contain invalid escapes)
+    """
 
     r = {}
     try:
         with open(fpath, 'r', encoding='utf-8', errors='replace') as f:
+            try:
+                return json.load(f)
+            except json.decoder.JSONDecodeError:
+                f.seek(0)
             lines = f.readlines()
             lines = [re.sub(r'\\{1}', r'\\\\', l) for l in lines] # to prevent invalid \escape JSONDecodeError
             r = json.loads("\n".join(lines))
@@ -20,6 +27,93 @@ def load_json(fpath):
     return r
 
 
+class JsonArrayStream:
+    """Incrementally parse the items of one top-level array of a JSON document
+    (e.g., 'data' in chifra output) from chunks of bytes, so that only the item
+    currently being parsed is held in memory.
+
+    Like load_json, escapes all backslashes (on the bytes, before decoding) to
+    prevent invalid \\escape JSONDecodeError.
+    """
+
+    def __init__(self, key='data', sanitize=True):
+        self.sanitize = sanitize
+        self._start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._state = 'seek'
+        self._retryAt = 0
+
+    @property
+    def done(self):
+        return self._state == 'done'
+
+    def feed(self, chunk):
+        """Add a chunk of bytes and return list of items completed by it"""
+
+        if self._state == 'done':
+            return []
+        if self.sanitize:
+            chunk = chunk.replace(b'\\', b'\\\\')
+        self._buffer += self._decoder.decode(chunk)
+
+        return self._parse(final=False)
+
+    def close(self):
+        """Signal end of input and return any remaining items"""
+
+        self._buffer += self._decoder.decode(b'', final=True)
+        items = self._parse(final=True)
+        if self._state != 'done':
+            raise json.decoder.JSONDecodeError("Unterminated array", self._buffer, 0)
+
+        return items
+
+    def _parse(self, final):
+        items = []
+        if self._state == 'seek':
+            m = self._start.search(self._buffer)
+            if m is None:
+                return items
+            self._buffer = self._buffer[m.end():]
+            self._state = 'items'
+
+        # Only retry an incomplete item once the buffer has doubled, so that
+        # parsing stays linear in the size of the item
+        if self._state != 'items' or (not final and len(self._buffer) < self._retryAt):
+            return items
+
+        pos = 0
+        buffer = self._buffer
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if buffer[pos] == ']':
+                self._state = 'done'
+                pos += 1
+                break
+            try:
+                item, end = self._json.raw_decode(buffer, pos)
+            except json.decoder.JSONDecodeError:
+                if final:
+                    raise
+                self._retryAt = 2 * (len(buffer) - pos)
+                break
+            if end == len(buffer) and not final and not isinstance(item, (dict, list)):
+                # A scalar at the end of the buffer may continue in the next chunk
+                break
+            items.append(item)
+            pos = end
+            self._retryAt = 0
+
+        self._buffer = buffer[pos:]
+
+        return items
+
+
 def save_json(data, fpath):
     """Save JSON file"""
 